@@ -0,0 +1,176 @@
+"""
+api_client.py - общий клиент Telegram Bot API
+
+Обработчики (bot_core) и напоминания (reminders) отправляют сообщения
+через один TeleBot (get_bot) и одну HTTP-сессию requests с пулом
+keep-alive соединений. По умолчанию telebot заводит отдельную сессию
+в каждом потоке и пересоздает ее раз в 10 минут - это лишние
+TLS-рукопожатия и сокеты на каждый поток обработки и отправки.
+
+Исходящие сообщения обработчиков и напоминаний идут через одну
+очередь отправки (get_dispatcher, см. dispatcher.py): лимиты Telegram
+считаются на бота, а не отдельно для каждого источника.
+
+Пул блокирующий: при всплеске напоминаний потоки ждут свободное
+соединение из пула, а не открывают новые.
+
+Для проверок без сети в configure(transport=...) передается
+адаптер requests (например, FakeTransport): он подключается к сессии
+вместо настоящего HTTP.
+
+Переменные окружения:
+  API_POOL_SIZE       - соединений в пуле (по умолчанию 16; не меньше
+                        UPDATE_WORKERS + SEND_WORKERS + 1 на long polling)
+  API_CONNECT_TIMEOUT - таймаут соединения, секунды (по умолчанию 10)
+  API_READ_TIMEOUT    - таймаут ответа, секунды (по умолчанию 30)
+"""
+import json
+import logging
+import os
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from telebot import apihelper, asyncio_helper
+
+from batching import BatchingTeleBot
+from dispatcher import MessageDispatcher
+
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE", "16"))
+API_CONNECT_TIMEOUT = float(os.environ.get("API_CONNECT_TIMEOUT", "10"))
+API_READ_TIMEOUT = float(os.environ.get("API_READ_TIMEOUT", "30"))
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_session = None
+_bots = {}   # токен -> общий TeleBot
+_dispatchers = {}   # токен -> общая очередь отправки
+
+def create_session(pool_size=API_POOL_SIZE, transport=None):
+    """
+    Сессия requests с пулом keep-alive соединений
+    transport - адаптер requests вместо HTTP (для проверок без сети)
+    """
+    session = requests.Session()
+    adapter = transport or HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                                       pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def configure(pool_size=API_POOL_SIZE, connect_timeout=API_CONNECT_TIMEOUT,
+              read_timeout=API_READ_TIMEOUT, transport=None):
+    """
+    Устанавливает общую сессию для всех TeleBot процесса (настройки
+    apihelper глобальные). Повторный вызов заменяет сессию.
+    Возвращает сессию.
+    """
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = create_session(pool_size, transport)
+        apihelper.session = _session
+        # Одна сессия на все потоки и без пересоздания по времени
+        apihelper.SESSION_TIME_TO_LIVE = None
+        apihelper.CONNECT_TIMEOUT = connect_timeout
+        apihelper.READ_TIMEOUT = read_timeout
+        # В async-режиме тот же размер пула у aiohttp
+        asyncio_helper.REQUEST_LIMIT = pool_size
+    log.info("Клиент Bot API настроен",
+             extra={"pool_size": pool_size, "fake_transport": transport is not None})
+    return _session
+
+def get_session():
+    """Общая сессия (создается при первом вызове)"""
+    if _session is None:
+        configure()
+    return _session
+
+def get_bot(token, factory=BatchingTeleBot):
+    """
+    Общий TeleBot для токена: один объект на процесс, отправляющий
+    через общую сессию
+    """
+    get_session()
+    with _lock:
+        bot = _bots.get(token)
+        if bot is None:
+            bot = _bots[token] = factory(token)
+        return bot
+
+def get_dispatcher(token):
+    """
+    Общая очередь отправки для токена (запускается при создании):
+    через нее отправляют и обработчики, и напоминания
+    """
+    bot = get_bot(token)
+    with _lock:
+        sender = _dispatchers.get(token)
+        if sender is None:
+            sender = _dispatchers[token] = MessageDispatcher(bot.send_message)
+            sender.start()
+        return sender
+
+def stop_dispatchers():
+    """Останавливает общие очереди отправки, дождавшись поставленных сообщений"""
+    with _lock:
+        senders = list(_dispatchers.values())
+        _dispatchers.clear()
+    for sender in senders:
+        sender.stop()
+
+def reset():
+    """Забывает общие клиенты и закрывает сессию"""
+    global _session
+    stop_dispatchers()
+    with _lock:
+        _bots.clear()
+        if _session is not None:
+            _session.close()
+        _session = None
+        apihelper.session = None
+
+# ---------- фейковый транспорт ----------
+
+class FakeTransport(BaseAdapter):
+    """
+    Адаптер requests, отвечающий на запросы Bot API без сети.
+    Запросы копятся в self.requests: (метод API, параметры).
+    Методы, возвращающие сообщение, получают минимальное сообщение
+    в чат из параметров, остальные - true.
+    """
+
+    MESSAGE_METHODS = {"sendMessage", "editMessageText"}
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+        self._lock = threading.Lock()
+        self._message_id = 0
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        method = url.path.rsplit("/", 1)[-1]
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        with self._lock:
+            self.requests.append((method, params))
+            self._message_id += 1
+            message_id = self._message_id
+        result = True
+        if method in self.MESSAGE_METHODS:
+            result = {"message_id": message_id, "date": 0, "text": params.get("text"),
+                      "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}}
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({"ok": True, "result": result}).encode("utf-8")
+        response.headers["Content-Type"] = "application/json"
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
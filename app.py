@@ -0,0 +1,131 @@
+"""
+app.py - сборка и запуск приложения
+
+Application в одном месте собирает бота (общий клиент и общую
+очередь отправки из api_client, обработчики bot_core), хранилище
+и систему напоминаний. Импорт
+модулей бота ничего не делает, поэтому их можно импортировать
+в инструментах и проверках без токена и сети.
+
+Порядок запуска:
+  1. бот и обработчики - сразу, это дешево;
+  2. хранилище, перенос прошедших записей в архив (archive.py)
+     и расписание напоминаний - в фоновом потоке: polling
+     подключается параллельно с загрузкой, и первое обновление ждет
+     только загрузку записей (первый обработчик, обратившийся
+     к хранилищу, дождется ее на блокировке get_store), а не
+     построение расписания напоминаний. Расписание строится уже
+     по записям без истории.
+Индексы занятости, списков записей и справочник клиентов строятся
+лениво, по чатам, при первом запросе (schedule.py, listing.py,
+clients.py).
+
+Длительность каждого этапа пишется в лог и в метрику
+bot_startup_phase_seconds.
+"""
+import contextlib
+import logging
+import threading
+import time
+
+import api_client
+import archive
+import bot_core
+import database as db
+import metrics
+import reminders
+
+log = logging.getLogger(__name__)
+
+@contextlib.contextmanager
+def startup_phase(name):
+    """Замеряет этап запуска: лог и метрика bot_startup_phase_seconds"""
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    metrics.STARTUP_SECONDS.set(seconds, phase=name)
+    log.info("Этап запуска завершен", extra={"phase": name, "seconds": round(seconds, 3)})
+
+class Application:
+    """
+    Приложение бота
+    token - токен Bot API
+    mode - "polling" (по умолчанию), "webhook" или "async" (см. main.py)
+    """
+
+    def __init__(self, token, mode="polling"):
+        self.token = token
+        self.mode = mode
+        self.bot = None
+        self.dispatcher = None
+        self.reminders = None
+        self._created = time.perf_counter()
+        self._warmup = None
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def build(self):
+        """Собирает бота и регистрирует обработчики (без сети)"""
+        if self.bot is None:
+            with startup_phase("bot"):
+                # В async-режиме очередь отправки работает через мост
+                # к AsyncTeleBot и создается в async_runtime
+                if self.mode != "async":
+                    self.dispatcher = api_client.get_dispatcher(self.token)
+                self.bot = bot_core.attach(api_client.get_bot(self.token),
+                                           self.dispatcher)
+        return self
+
+    def warm_up(self):
+        """Загружает хранилище, переносит историю в архив и запускает напоминания"""
+        with startup_phase("storage"):
+            db.get_store()
+        with self._lock:
+            if self._stopping:
+                return
+            with startup_phase("archive"):
+                archive.init_archiver()
+            with startup_phase("reminders"):
+                self.reminders = reminders.init_reminder_system(self.token,
+                                                                self.dispatcher)
+        log.info("Приложение готово",
+                 extra={"seconds": round(time.perf_counter() - self._created, 3)})
+
+    def _warm_up_safely(self):
+        try:
+            self.warm_up()
+        except Exception:
+            log.exception("Ошибка фоновой загрузки")
+
+    def start_background(self):
+        """Запускает warm_up в фоновом потоке"""
+        if self._warmup is None:
+            self._warmup = threading.Thread(target=self._warm_up_safely,
+                                            name="warmup", daemon=True)
+            self._warmup.start()
+        return self._warmup
+
+    def run(self):
+        """Запускает бота в выбранном режиме (блокирует до остановки)"""
+        with startup_phase("metrics"):
+            metrics.start_metrics_server()
+        self.build()
+        if self.mode == "async":
+            # Хранилище и напоминания загружает цикл asyncio
+            from async_runtime import run_async_bot
+            run_async_bot(self.token)
+            return
+        self.start_background()
+        if self.mode == "webhook":
+            from webhook import run_webhook
+            run_webhook(self.bot)
+        else:
+            bot_core.run_bot()
+
+    def stop(self):
+        """Останавливает напоминания, перенос в архив и очередь отправки"""
+        with self._lock:
+            self._stopping = True
+        reminders.stop_reminder_system()
+        archive.stop_archiver()
+        api_client.stop_dispatchers()
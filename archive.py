@@ -0,0 +1,301 @@
+"""
+archive.py - архив прошедших записей по месяцам
+
+Прошедшие записи не нужны ни спискам, ни напоминаниям, ни расписанию,
+но читались бы при каждом запуске и просматривались при каждом проходе.
+Поэтому фоновая задача (Archiver) периодически переносит записи,
+дата которых прошла больше ARCHIVE_AFTER_DAYS дней назад, из рабочего
+хранилища в архив: сегмент archive/<chat_id>/<ГГГГ-ММ>.jsonl на месяц
+чата, по записи в строке. В рабочем хранилище остаются сегодняшние
+и будущие записи (и записи без распознанной даты).
+
+Сегменты только для чтения: бот их не меняет, при переносе новых
+записей сегмент целиком собирается заново и атомарно подменяется через
+os.replace (в потоке записи storage_writer). Перенос идет в два шага:
+сначала записи фиксируются в сегменте, затем удаляются из хранилища,
+причем запись, измененная за это время, остается в хранилище. После
+сбоя между шагами запись есть в обоих местах - архив ее не показывает,
+пока она в хранилище, и при следующем переносе сегмент заменяет копию.
+
+История доступна явным запросом к архиву (/history в боте, экспорт
+bulk.py --archive): читаются только сегменты нужного чата и месяцев.
+
+Переменные окружения:
+  ARCHIVE_DIR            - каталог архива (по умолчанию archive)
+  ARCHIVE_AFTER_DAYS     - через сколько дней после даты записи она
+                           уходит в архив (по умолчанию 1: вчерашние
+                           и более ранние)
+  ARCHIVE_INTERVAL_HOURS - как часто переносить (по умолчанию 6;
+                           0 - не переносить)
+  ARCHIVE_MAX_LEAD_DAYS  - запись, время которой отстоит от момента
+                           ее создания больше чем на столько дней
+                           (по умолчанию 90), переносится, только если
+                           и повторный разбор текста даты дает прошедшее
+                           время: так записи с неверно подобранным годом
+                           не уходят в архив раньше времени
+"""
+import datetime
+import logging
+import os
+import threading
+
+from booking import Booking
+import database as db
+import dates
+import metrics
+from storage_writer import get_writer
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "1"))
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get("ARCHIVE_INTERVAL_HOURS", "6"))
+ARCHIVE_MAX_LEAD_DAYS = int(os.environ.get("ARCHIVE_MAX_LEAD_DAYS", "90"))
+
+log = logging.getLogger(__name__)
+
+def record_month(record):
+    """Месяц записи "ГГГГ-ММ" или None, если дата не распознана"""
+    key = record.day
+    return key[:7] if key else None
+
+class RecordArchive:
+    """Сегменты архива: по файлу на месяц каждого чата"""
+
+    def __init__(self, directory=ARCHIVE_DIR, writer=None):
+        self.directory = directory
+        self.writer = writer or get_writer()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """
+        Подписывает callback(records) на перенос записей в архив
+        (records - перенесенные записи, уже удаленные из хранилища)
+        """
+        self._listeners.append(callback)
+
+    def notify_archived(self, records):
+        for callback in list(self._listeners):
+            try:
+                callback(records)
+            except Exception:
+                log.exception("Ошибка обработчика переноса в архив")
+
+    def segment_path(self, chat_id, month):
+        return os.path.join(self.directory, str(chat_id), f"{month}.jsonl")
+
+    def chat_ids(self):
+        """Чаты, у которых есть архив"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [_chat_id(name) for name in sorted(names)]
+
+    def months(self, chat_id):
+        """Месяцы ("ГГГГ-ММ") с архивом чата, по возрастанию"""
+        try:
+            names = os.listdir(os.path.join(self.directory, str(chat_id)))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(".jsonl")] for name in names if name.endswith(".jsonl"))
+
+    # ---------- запись ----------
+
+    def add(self, records):
+        """
+        Добавляет записи (с распознанной датой) в сегменты их месяцев.
+        Копии записей снимаются сразу, так что в архив попадает
+        состояние на момент вызова. Возвращает эти копии
+        """
+        segments = {}
+        copies = []
+        for record in records:
+            copy = record.copy()
+            copies.append(copy)
+            path = self.segment_path(copy.chat_id, record_month(copy))
+            segments.setdefault(path, {})[copy.id] = copy.to_json() + "\n"
+
+        def commit():
+            for path, lines in segments.items():
+                self._write_segment(path, lines)
+
+        if segments:
+            self.writer.call(commit).result()
+        return copies
+
+    def _write_segment(self, path, lines):
+        """
+        Собирает сегмент заново: старые строки (кроме замененных)
+        и новые. Выполняется в потоке записи
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        kept = [line for line in _read_lines(path)
+                if _line_id(line) not in lines]
+        self.writer.track(path)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(kept)
+                f.writelines(lines.values())
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o444)
+            self.writer.replace_file(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # ---------- чтение ----------
+
+    def month_records(self, chat_id, month):
+        """Записи чата за месяц "ГГГГ-ММ", отсортированные по времени"""
+        return sorted(self._read(self.segment_path(chat_id, month)),
+                      key=lambda record: record.starts_at)
+
+    def iter_records(self, chat_id=None, date_from=None, date_to=None, in_store=None):
+        """
+        Записи архива чата (или всех чатов) с датой в диапазоне
+        [date_from, date_to] ("ГГГГ-ММ-ДД", границы необязательны).
+        Открываются только сегменты месяцев из диапазона
+        in_store(record_id) - есть ли запись в рабочем хранилище (такие
+                   не выдаются); по умолчанию - поиск в database
+        """
+        chat_ids = self.chat_ids() if chat_id is None else [chat_id]
+        for chat in chat_ids:
+            for month in self.months(chat):
+                if date_from is not None and month < date_from[:7]:
+                    continue
+                if date_to is not None and month > date_to[:7]:
+                    break
+                for record in self._read(self.segment_path(chat, month), in_store):
+                    key = record.day
+                    if ((date_from is None or key >= date_from)
+                            and (date_to is None or key <= date_to)):
+                        yield record
+
+    def _read(self, path, in_store=None):
+        """Записи сегмента без тех, что есть в рабочем хранилище"""
+        if in_store is None:
+            in_store = lambda record_id: db.get_record(record_id) is not None
+        records = []
+        for line in _read_lines(path):
+            try:
+                record = Booking.from_json(line)
+            except ValueError:
+                log.warning("Пропущена поврежденная строка архива", extra={"path": path})
+                continue
+            if not in_store(record.id):
+                records.append(record)
+        return records
+
+def _chat_id(name):
+    """Имя каталога чата -> chat_id"""
+    try:
+        return int(name)
+    except ValueError:
+        return name
+
+def _read_lines(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return [line if line.endswith("\n") else line + "\n"
+                    for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def _line_id(line):
+    try:
+        return Booking.from_json(line).id
+    except ValueError:
+        return None
+
+# Общий архив процесса
+archive = RecordArchive()
+
+@metrics.instrument(metrics.DB_SECONDS, metrics.DB_ERRORS, "operation")
+def archive_past_records(now=None, after_days=ARCHIVE_AFTER_DAYS):
+    """
+    Переносит в архив записи с датой не позже чем after_days дней
+    назад. Возвращает количество перенесенных записей
+    """
+    now = now or datetime.datetime.now()
+    cutoff = (now.date() - datetime.timedelta(days=after_days)).isoformat()
+    records = list(db.iter_records(date_to=cutoff))
+    suspicious = [record for record in records if not _really_past(record, cutoff)]
+    if suspicious:
+        log.warning("Записи с сомнительным годом оставлены в хранилище",
+                    extra={"count": len(suspicious),
+                           "record_ids": [record.id for record in suspicious[:10]]})
+        skipped = {record.id for record in suspicious}
+        records = [record for record in records if record.id not in skipped]
+    if not records:
+        return 0
+    copies = archive.add(records)
+    removed = set(db.delete_unchanged_records(copies))
+    archive.notify_archived([copy for copy in copies if copy.id in removed])
+    metrics.ARCHIVED_RECORDS.inc(len(removed))
+    log.info("Прошедшие записи перенесены в архив",
+             extra={"archived": len(removed), "changed": len(copies) - len(removed),
+                    "cutoff": cutoff})
+    return len(removed)
+
+def _really_past(record, cutoff, max_lead=datetime.timedelta(days=ARCHIVE_MAX_LEAD_DAYS)):
+    """
+    Прошло ли время записи наверняка: если оно отстоит от момента
+    создания больше чем на max_lead, год мог быть подобран неверно -
+    тогда дата разбирается заново относительно момента создания
+    и тоже должна быть не позже cutoff ("ГГГГ-ММ-ДД")
+    """
+    created = record.created
+    if created is None or abs(record.appointment - created) <= max_lead:
+        return True
+    reparsed = dates.parse_appointment(record.date, created)
+    return reparsed is not None and reparsed.date().isoformat() <= cutoff
+
+class Archiver:
+    """Фоновый поток, переносящий прошедшие записи в архив раз в interval"""
+
+    def __init__(self, interval=datetime.timedelta(hours=ARCHIVE_INTERVAL_HOURS)):
+        self.interval = interval
+        self.thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.thread is None and self.interval:
+            self.thread = threading.Thread(target=self._loop, name="archiver",
+                                           daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval.total_seconds()):
+            try:
+                archive_past_records()
+            except Exception:
+                log.exception("Ошибка переноса записей в архив")
+
+# Глобальный экземпляр фоновой задачи архива
+archiver = None
+
+def init_archiver():
+    """
+    Переносит прошедшие записи в архив и запускает периодический перенос
+    """
+    global archiver
+    if archiver is None:
+        if ARCHIVE_INTERVAL_HOURS:
+            archive_past_records()
+        archiver = Archiver()
+        archiver.start()
+    return archiver
+
+def stop_archiver():
+    """Останавливает периодический перенос в архив"""
+    global archiver
+    if archiver:
+        archiver.stop()
+        archiver = None
@@ -0,0 +1,119 @@
+"""
+async_runtime.py - запуск бота на asyncio (BOT_MODE=async)
+
+Обновления получает AsyncTeleBot. Каждое обновление обрабатывается
+корутиной: она ждет своей очереди в чате (порядок сообщений одного чата
+сохраняется) и выполняет обработчик из bot_core в пуле потоков, так что
+файловая работа хранилища не блокирует цикл событий, а разные чаты
+обрабатываются параллельно.
+
+Ответы обработчиков и напоминания отправляются через одну очередь
+отправки (dispatcher.py) и один AsyncTeleBot, то есть через одну
+HTTP-сессию aiohttp. Планировщик напоминаний -
+задача asyncio в том же цикле.
+"""
+import asyncio
+import inspect
+import logging
+
+from telebot.async_telebot import AsyncTeleBot
+
+import archive
+import bot_core
+from batching import update_chat_id
+from app import startup_phase
+import database as db
+from dispatcher import DispatchingBot, MessageDispatcher
+import reminders
+
+log = logging.getLogger(__name__)
+
+class AsyncBotBridge:
+    """
+    Синхронный фасад над AsyncTeleBot для кода, работающего в потоках:
+    bridge.send_message(...) выполняет корутину в цикле событий бота
+    и ждет результата. Нельзя вызывать из потока самого цикла.
+    """
+
+    def __init__(self, async_bot, loop):
+        self._async_bot = async_bot
+        self._loop = loop
+
+    def __getattr__(self, name):
+        method = getattr(self._async_bot, name)
+        if not inspect.iscoroutinefunction(method):
+            return method
+
+        def call(*args, **kwargs):
+            future = asyncio.run_coroutine_threadsafe(method(*args, **kwargs),
+                                                      self._loop)
+            return future.result()
+
+        return call
+
+class ChatOrderedAsyncBot(AsyncTeleBot):
+    """
+    AsyncTeleBot, передающий обновления в обработчики bot_core
+    с сохранением порядка внутри каждого чата
+    """
+
+    def __init__(self, token, handlers_bot, **kwargs):
+        super().__init__(token, **kwargs)
+        self.handlers_bot = handlers_bot
+        self._chat_locks = {}  # chat_id -> [asyncio.Lock, сколько корутин его ждут]
+
+    async def process_new_updates(self, updates):
+        await asyncio.gather(*(self._process_update(update) for update in updates))
+
+    async def _process_update(self, update):
+        chat_id = update_chat_id(update)
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await asyncio.to_thread(self.handlers_bot.process_new_updates, [update])
+        except Exception:
+            log.exception("Ошибка обработки обновления",
+                          extra={"update_id": update.update_id})
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[chat_id]
+
+def _load_store():
+    with startup_phase("storage"):
+        db.get_store()
+    with startup_phase("archive"):
+        archive.init_archiver()
+
+async def _run(token):
+    loop = asyncio.get_running_loop()
+    async_bot = ChatOrderedAsyncBot(token, bot_core.handlers_bot)
+    # Ответы обработчиков и напоминания - через одну очередь отправки,
+    # она же замеряет отправки (dispatcher.py)
+    bridge = AsyncBotBridge(async_bot, loop)
+    dispatcher = MessageDispatcher(bridge.send_message)
+    dispatcher.start()
+    bot_core.use_bot_client(DispatchingBot(bridge, dispatcher))
+
+    # Записи загружаются вне цикла событий параллельно с подключением
+    # polling; построение расписания напоминаний ждет загрузки внутри задачи
+    store_task = asyncio.create_task(asyncio.to_thread(_load_store))
+
+    reminder_system = reminders.ReminderSystem(token, bot=bridge, dispatcher=dispatcher)
+    reminder_task = asyncio.create_task(reminder_system.run_async())
+    try:
+        log.info("Запускаем polling (asyncio)")
+        await async_bot.infinity_polling(timeout=30)
+    finally:
+        await asyncio.to_thread(reminder_system.stop)
+        await asyncio.to_thread(archive.stop_archiver)
+        await asyncio.to_thread(dispatcher.stop)
+        reminder_task.cancel()
+        store_task.cancel()
+        await async_bot.close_session()
+
+def run_async_bot(token):
+    """Запускает бота и напоминания в одном цикле asyncio"""
+    log.info("Бот запускается (asyncio)")
+    asyncio.run(_run(token))
\ No newline at end of file
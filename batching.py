@@ -0,0 +1,94 @@
+"""
+batching.py - параллельная обработка пачки обновлений по чатам
+
+getUpdates отдает обновления пачкой. BatchingTeleBot делит пачку
+по chat_id: разные чаты обрабатываются параллельно в пуле потоков,
+а обновления одного чата - строго по порядку в одном потоке
+(от этого зависит пошаговое добавление клиента). Следующая пачка
+запрашивается, когда обработана текущая, так что порядок внутри
+чата сохраняется и между пачками.
+
+Записи чатов пачки читаются из хранилища одним запросом
+(database.batch_snapshot) и общие для всех обработчиков пачки.
+
+Переменные окружения:
+  UPDATE_WORKERS - число потоков обработки (по умолчанию 8)
+"""
+import collections
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import telebot
+
+import database as db
+import metrics
+
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", "8"))
+
+log = logging.getLogger(__name__)
+
+def update_chat_id(update):
+    """chat_id обновления (None, если у обновления нет чата)"""
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    return None
+
+def group_by_chat(updates):
+    """{chat_id: [обновления чата по порядку]} в порядке первого появления чата"""
+    groups = collections.OrderedDict()
+    for update in updates:
+        groups.setdefault(update_chat_id(update), []).append(update)
+    return groups
+
+class BatchingTeleBot(telebot.TeleBot):
+    """
+    TeleBot, обрабатывающий пачку обновлений параллельно по чатам.
+    Собственный пул потоков TeleBot не используется (threaded=False):
+    он не сохраняет порядок внутри чата.
+    """
+
+    def __init__(self, token, workers=UPDATE_WORKERS, **kwargs):
+        kwargs["threaded"] = False
+        super().__init__(token, **kwargs)
+        self.workers = workers
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix="updates")
+        return self._executor
+
+    def process_new_updates(self, updates):
+        if not updates:
+            return
+        metrics.UPDATES.inc(len(updates))
+        groups = group_by_chat(updates)
+        with db.batch_snapshot([chat_id for chat_id in groups if chat_id is not None]):
+            if len(groups) == 1:
+                # Один чат - обрабатываем в текущем потоке
+                self._process_chat(next(iter(groups.values())))
+            else:
+                wait([self._pool().submit(contextvars.copy_context().run,
+                                          self._process_chat, chat_updates)
+                      for chat_updates in groups.values()])
+        # Потоки отмечают last_update_id вперемешку - выставляем максимум
+        self.last_update_id = max(self.last_update_id,
+                                  max(update.update_id for update in updates))
+
+    def _process_chat(self, updates):
+        """Обновления одного чата по порядку"""
+        for update in updates:
+            try:
+                super().process_new_updates([update])
+            except Exception:
+                log.exception("Ошибка обработки обновления",
+                              extra={"update_id": update.update_id})
+
+    def send_message(self, *args, **kwargs):
+        """send_message обработчиков с замером времени и исхода"""
+        return metrics.timed_send(super().send_message, "handlers")(*args, **kwargs)
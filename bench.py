@@ -0,0 +1,285 @@
+"""
+bench.py - бенчмарки хранилища, расписания напоминаний и списка записей
+
+Для каждого размера генерируется синтетический набор данных (разделы
+clients/<chat_id>.json и reminders_sent.json) во временном каталоге,
+и в отдельном процессе замеряются:
+  load_cold      - загрузка хранилища и load_all_records
+  load_warm      - load_all_records из памяти
+  update_field   - update_record_field (дописывание в журнал с fsync)
+  reminder_scan  - загрузка журнала напоминаний и построение расписания
+  show_all       - обработчик "📋 Все записи" (сортировка и отрисовка страницы)
+  show_today     - обработчик "👥 Сегодняшние записи"
+  client_index   - построение справочника клиентов чата (clients.py)
+  find_client    - /find по началу имени и поиск по телефону
+Сообщения уходят в заглушку вместо TeleBot, сеть не используется.
+
+Для каждого пути печатаются перцентили задержки и пик памяти
+(tracemalloc, отдельным прогоном), результаты пишутся в JSON,
+чтобы сравнивать коммиты между собой.
+
+Запуск:
+    python bench.py                            # 1k, 10k, 100k записей
+    python bench.py --sizes 1000,1000000 --output results.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+from booking import Booking
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+SERVICES = ("Стрижка", "Окрашивание", "Маникюр", "Укладка")
+
+# ---------- данные ----------
+
+def generate_dataset(directory, size, chats, seed=1, legacy=False):
+    """
+    Пишет size записей, разложенных по chats разделам, и статусы
+    напоминаний примерно для трети записей. Даты - от года назад
+    до месяца вперед, часть записей - на сегодня.
+    legacy - записи прежним форматом (словарями), как до booking.py
+    """
+    rng = random.Random(seed)
+    clients_dir = os.path.join(directory, "clients")
+    os.makedirs(clients_dir, exist_ok=True)
+    now = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    files = {chat_id: open(os.path.join(clients_dir, f"{chat_id}.json"), "w",
+                           encoding="utf-8")
+             for chat_id in range(1, chats + 1)}
+    try:
+        with open(os.path.join(directory, "reminders_sent.json"), "w",
+                  encoding="utf-8") as reminders:
+            for i in range(size):
+                chat_id = rng.randint(1, chats)
+                if rng.random() < 0.02:
+                    appointment = now.replace(hour=rng.randint(9, 20))
+                else:
+                    appointment = now + datetime.timedelta(hours=rng.randint(-24 * 365, 24 * 30))
+                record = Booking.from_dict({
+                    "id": f"rec_{i:08x}",
+                    "chat_id": chat_id,
+                    "timestamp": (appointment - datetime.timedelta(days=7)).isoformat(),
+                    "client": {
+                        "name": f"Клиент {i}",
+                        "phone": f"+7 9{rng.randint(0, 10 ** 9 - 1):09d}",
+                        "date": appointment.strftime("%d.%m.%Y в %H:%M"),
+                        "service": rng.choice(SERVICES),
+                        "datetime": appointment.isoformat(timespec="seconds"),
+                    }
+                })
+                if legacy:
+                    line = json.dumps(record.to_dict(), ensure_ascii=False)
+                else:
+                    line = record.to_json()
+                files[chat_id].write(line + "\n")
+                if rng.random() < 0.3:
+                    status = {"day_reminder_sent": True,
+                              "day_reminder_for": record.appointment_iso}
+                    reminders.write(json.dumps({"record_id": record.id,
+                                                "status": status},
+                                               ensure_ascii=False) + "\n")
+    finally:
+        for f in files.values():
+            f.close()
+
+# ---------- замеры ----------
+
+class StubBot:
+    """Заглушка TeleBot: принимает любые вызовы и ничего не отправляет"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls += 1
+        return call
+
+def _message(chat_id, text):
+    return types.SimpleNamespace(chat=types.SimpleNamespace(id=chat_id), text=text)
+
+def percentiles(samples):
+    """Сводка задержек в миллисекундах"""
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000
+
+    return {"count": len(ordered), "mean_ms": statistics.fmean(ordered) * 1000,
+            "p50_ms": pick(0.5), "p90_ms": pick(0.9), "p99_ms": pick(0.99),
+            "max_ms": ordered[-1] * 1000}
+
+def timed(func, repeats, setup=None):
+    samples = []
+    for _ in range(repeats):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def peak_memory(func, setup=None):
+    """Пик выделенной Python-памяти за один вызов func (байты)"""
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_size(size, chats, repeats, measure_memory, legacy=False):
+    """Замеры для одного размера (вызывается в дочернем процессе)"""
+    directory = tempfile.mkdtemp(prefix=f"salon-bench-{size}-")
+    try:
+        generate_dataset(directory, size, chats, legacy=legacy)
+        os.chdir(directory)
+        os.environ["STORAGE_BACKEND"] = "json"
+        os.environ["STATE_SNAPSHOT_PATH"] = ""
+
+        import database as db
+        import reminders
+        import bot_core
+        from listing import listing
+
+        stub = StubBot()
+        bot_core.use_bot_client(stub)
+        rng = random.Random(2)
+        results = {}
+
+        def fresh_store():
+            db._store = db.ShardedRecordStore()
+            listing.invalidate()
+
+        def measure(name, func, count, setup=None):
+            results[name] = percentiles(timed(func, count, setup))
+            if measure_memory:
+                results[name]["peak_alloc_bytes"] = peak_memory(func, setup)
+
+        measure("load_cold", db.load_all_records, max(repeats // 10, 3), fresh_store)
+        ids = [record.id for record in db.load_all_records()]
+        measure("load_warm", db.load_all_records, repeats)
+        measure("update_field",
+                lambda: db.update_record_field(rng.choice(ids), "phone", "+7 900 000-00-00"),
+                repeats)
+
+        def reminder_scan():
+            system = reminders.ReminderSystem("0:bench", bot=stub)
+            system._load_ledger()
+            system._schedule_all()
+
+        measure("reminder_scan", reminder_scan, max(repeats // 10, 3))
+        measure("show_all", lambda: bot_core.show_all_records(
+            _message(rng.randint(1, chats), "📋 Все записи")), repeats, listing.invalidate)
+        measure("show_today", lambda: bot_core.show_today_records(
+            _message(rng.randint(1, chats), "👥 Сегодняшние записи")), repeats)
+
+        from clients import directory
+        measure("client_index", lambda: directory.find(1, "Клиент", 1),
+                max(repeats // 10, 3), lambda: directory._chats.clear())
+        phones = [record.phone for record in db.load_all_records()]
+        for chat_id in range(1, chats + 1):
+            directory.find(chat_id, "Клиент", 1)
+
+        def find_client():
+            chat_id = rng.randint(1, chats)
+            bot_core.find_client_command(
+                _message(chat_id, f"/find Клиент {rng.randint(1, size)}"))
+            directory.find(chat_id, rng.choice(phones), 1)
+
+        measure("find_client", find_client, repeats)
+
+        return {"size": size, "chats": chats, "paths": results,
+                "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    finally:
+        os.chdir("/")
+        shutil.rmtree(directory, ignore_errors=True)
+
+# ---------- запуск ----------
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results):
+    print(f"{'записей':>9} {'путь':<14} {'p50 мс':>9} {'p90 мс':>9} "
+          f"{'p99 мс':>9} {'пик МБ':>8}")
+    for result in results:
+        for name, stats in result["paths"].items():
+            peak = stats.get("peak_alloc_bytes")
+            peak = f"{peak / 2 ** 20:8.1f}" if peak is not None else f"{'-':>8}"
+            print(f"{result['size']:>9} {name:<14} {stats['p50_ms']:9.3f} "
+                  f"{stats['p90_ms']:9.3f} {stats['p99_ms']:9.3f} {peak}")
+        print(f"{result['size']:>9} {'RSS процесса':<14} "
+              f"{result['peak_rss_bytes'] / 2 ** 20:.0f} МБ")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки salon-bot")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="размеры наборов через запятую")
+    parser.add_argument("--chats", type=int, default=10, help="число чатов в наборе")
+    parser.add_argument("--repeats", type=int, default=100, help="повторов на путь")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="не замерять пик памяти (tracemalloc)")
+    parser.add_argument("--legacy-format", action="store_true",
+                        help="журналы записей в прежнем формате (словарями)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        # Сообщения модулей бота - в stderr, в stdout только результат
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_size(args.child, args.chats, args.repeats, not args.no_memory,
+                              args.legacy_format)
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(f"⏱️ Набор из {size} записей...", file=sys.stderr)
+        command = [sys.executable, os.path.abspath(__file__), "--child", str(size),
+                   "--chats", str(args.chats), "--repeats", str(args.repeats)]
+        if args.no_memory:
+            command.append("--no-memory")
+        if args.legacy_format:
+            command.append("--legacy-format")
+        child = subprocess.run(command, capture_output=True, text=True)
+        if child.returncode != 0:
+            print(child.stderr, file=sys.stderr)
+            return child.returncode
+        results.append(json.loads(child.stdout.splitlines()[-1]))
+
+    report = {"commit": _git_commit(),
+              "created": datetime.datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(),
+              "repeats": args.repeats, "legacy_format": args.legacy_format,
+              "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_table(results)
+    print(f"📄 Результаты: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
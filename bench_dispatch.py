@@ -0,0 +1,106 @@
+"""
+bench_dispatch.py - микробенчмарк выбора обработчика сообщения
+
+Сравнивает цепочку фильтров @bot.message_handler(func=lambda ...)
+(как было в bot_core) с таблицей MessageRouter на синтетических
+обновлениях. Обработчики пустые, сеть не используется: измеряется
+только путь обновления через telebot до обработчика.
+
+Запуск:
+    python bench_dispatch.py [число обновлений] [число чатов]
+"""
+import random
+import sys
+import time
+
+import telebot
+from telebot import types
+
+from router import MessageRouter
+from states import StateStore
+
+MENU_TEXTS = ["📅 Записать клиента", "👥 Сегодняшние записи", "📋 Все записи"]
+COMMANDS = ["start", "help", "delete", "edit"]
+STATES = ["adding_name", "adding_phone", "adding_date", "adding_service",
+          "editing_choose_field", "editing_enter_value"]
+
+def _noop(message):
+    pass
+
+def build_filter_chain(bot, states):
+    """Обработчики в том же порядке и с теми же фильтрами, что были в bot_core"""
+    for command in COMMANDS[:2]:
+        bot.register_message_handler(_noop, commands=[command])
+    for text in MENU_TEXTS:
+        bot.register_message_handler(_noop, func=lambda m, text=text: m.text == text)
+    for state in STATES[:4]:
+        bot.register_message_handler(_noop, func=lambda m, state=state:
+                                     states.state(m.chat.id) == state)
+    for command in COMMANDS[2:]:
+        bot.register_message_handler(_noop, commands=[command])
+    for state in STATES[4:]:
+        bot.register_message_handler(_noop, func=lambda m, state=state:
+                                     states.state(m.chat.id) == state)
+    bot.register_message_handler(_noop, func=lambda m: True)
+
+def build_router(bot, states):
+    router = MessageRouter(states.state)
+    for command in COMMANDS:
+        router.command(command)(_noop)
+    for text in MENU_TEXTS:
+        router.text(text)(_noop)
+    for state in STATES:
+        router.state(state)(_noop)
+    router.default(_noop)
+    router.register(bot)
+
+def synthetic_updates(count, chats, seed=1):
+    """Смесь команд, кнопок меню и свободного текста от разных чатов"""
+    rng = random.Random(seed)
+    texts = (MENU_TEXTS + ["/" + c + " 3" for c in COMMANDS]
+             + ["Анна", "+7 999 123-45-67", "25.12 в 15:00", "Стрижка"] * 3)
+    updates = []
+    for i in range(count):
+        chat_id = rng.randrange(1, chats + 1)
+        text = rng.choice(texts)
+        message = {"message_id": i, "date": 0, "text": text,
+                   "chat": {"id": chat_id, "type": "private"},
+                   "from": {"id": chat_id, "is_bot": False, "first_name": "u"}}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0,
+                                    "length": len(text.split()[0])}]
+        updates.append(types.Update.de_json({"update_id": i, "message": message}))
+    return updates
+
+def measure(bot, updates, repeat=5):
+    """Лучшее из repeat прогонов: наносекунд на обновление"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        bot.process_new_updates(updates)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(updates) * 1e9
+
+def main(count=20000, chats=500):
+    states = StateStore(snapshot_path="")
+    rng = random.Random(2)
+    for chat_id in range(1, chats + 1):
+        # Примерно у половины чатов идет диалог
+        if rng.random() < 0.5:
+            states.set(chat_id, rng.choice(STATES))
+    updates = synthetic_updates(count, chats)
+
+    results = {}
+    for name, build in (("цепочка фильтров", build_filter_chain),
+                        ("MessageRouter", build_router)):
+        bot = telebot.TeleBot("0:bench", threaded=False)
+        build(bot, states)
+        results[name] = measure(bot, updates)
+        print(f"{name:>18}: {results[name]:8.0f} нс/обновление")
+    before, after = results.values()
+    print(f"{'ускорение':>18}: {before / after:8.2f}x "
+          f"({count} обновлений, {chats} чатов)")
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,219 @@
+"""
+booking.py - запись клиента (Booking)
+
+Запись в памяти - объект со __slots__ вместо пары вложенных словарей:
+поля читаются как атрибуты (booking.name, booking.starts_at), без поиска
+по строковым ключам, а объект занимает в несколько раз меньше памяти.
+Время записи и момент создания хранятся целыми числами: starts_at -
+секунды, timestamp - микросекунды от 1970-01-01 по местному времени
+(как наивный datetime, без часовых поясов). Название услуги интернируется:
+у тысяч записей "Стрижка" - одна строка.
+
+В журнале запись - строка-массив JSON в порядке __slots__:
+  ["rec_1a2b3c4d", 123456789, 1766600000000000, "Анна", "+7...",
+   "25.12 в 15:00", "Стрижка", 1766674800]
+(и словарь extra девятым элементом, если есть поля client вне модели).
+Такой массив json разбирает быстрее словаря, а числа не нужно переводить
+из строк. Прежний формат - словарь {"id", "chat_id", "timestamp",
+"client": {"name", "phone", "date", "service", "datetime"}} - читается
+так же (from_json различает их сам) и используется во внешних форматах:
+экспорт bulk.py и SQLite (to_dict/from_dict).
+"""
+import datetime
+import json
+import sys
+
+import dates
+
+# Поля клиента, которые хранятся атрибутами (порядок - как в JSON)
+CLIENT_FIELDS = ("name", "phone", "date", "service", "datetime")
+_CLIENT_KEYS = frozenset(CLIENT_FIELDS)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_MICROSECOND = datetime.timedelta(microseconds=1)
+DAY_SECONDS = 86400
+
+# Кодировщик без ensure_ascii создается один раз: json.dumps с параметрами
+# собирает новый JSONEncoder на каждый вызов
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+def to_epoch(dt):
+    """datetime (наивный) -> секунды от 1970-01-01"""
+    return ((dt.toordinal() - _EPOCH_ORDINAL) * DAY_SECONDS
+            + dt.hour * 3600 + dt.minute * 60 + dt.second)
+
+def from_epoch(seconds):
+    """Секунды от 1970-01-01 -> наивный datetime"""
+    return _EPOCH + datetime.timedelta(seconds=seconds)
+
+def day_number(key):
+    """День "ГГГГ-ММ-ДД" -> номер дня от 1970-01-01 (как Booking.day_number)"""
+    return datetime.date.fromisoformat(key).toordinal() - _EPOCH_ORDINAL
+
+def parse_timestamp(text):
+    """Момент создания в ISO -> микросекунды (None, если не разобран)"""
+    try:
+        created = datetime.datetime.fromisoformat(text)
+    except (TypeError, ValueError):
+        return None
+    if created.tzinfo is not None:
+        created = created.astimezone().replace(tzinfo=None)
+    return (created - _EPOCH) // _MICROSECOND
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+class Booking:
+    """Запись клиента: кто, когда и на какую услугу"""
+
+    __slots__ = ("id", "chat_id", "timestamp", "name", "phone", "date",
+                 "service", "starts_at", "extra")
+
+    def __init__(self, id, chat_id, timestamp, name, phone, date, service,
+                 starts_at, extra=None):
+        self.id = id
+        self.chat_id = chat_id
+        self.timestamp = timestamp    # микросекунды от 1970-01-01 или None
+        self.name = name
+        self.phone = phone
+        self.date = date              # дата текстом, как ее ввели
+        self.service = _intern(service)
+        self.starts_at = starts_at    # секунды от 1970-01-01 или None
+        self.extra = extra            # прочие поля client или None
+
+    # ---------- время ----------
+
+    @property
+    def appointment(self):
+        """Время записи (datetime) или None, если дата не распознана"""
+        return from_epoch(self.starts_at) if self.starts_at is not None else None
+
+    @property
+    def appointment_iso(self):
+        """Время записи в ISO ("2026-12-25T15:00:00"), как client["datetime"]"""
+        return dates.to_iso(self.appointment) if self.starts_at is not None else None
+
+    @property
+    def day(self):
+        """День записи "ГГГГ-ММ-ДД" или None"""
+        if self.starts_at is None:
+            return None
+        return datetime.date.fromordinal(
+            self.starts_at // DAY_SECONDS + _EPOCH_ORDINAL).isoformat()
+
+    @property
+    def day_number(self):
+        """Номер дня записи от 1970-01-01 (ключ индекса по дням) или None"""
+        return self.starts_at // DAY_SECONDS if self.starts_at is not None else None
+
+    @property
+    def created(self):
+        """Момент создания или последнего изменения (datetime) или None"""
+        if self.timestamp is None:
+            return None
+        return _EPOCH + datetime.timedelta(microseconds=self.timestamp)
+
+    @property
+    def timestamp_iso(self):
+        created = self.created
+        return created.isoformat() if created is not None else None
+
+    # ---------- изменения ----------
+
+    def update(self, fields, timestamp):
+        """
+        Меняет поля клиента (как в журнале: "datetime" - строка ISO
+        или None) и момент изменения (микросекунды)
+        """
+        for field, value in fields.items():
+            if field == "datetime":
+                self.starts_at = to_epoch(dates.from_iso(value)) if value else None
+            elif field == "service":
+                self.service = _intern(value)
+            elif field in CLIENT_FIELDS:
+                setattr(self, field, value)
+            else:
+                self.extra = dict(self.extra or {}, **{field: value})
+        self.timestamp = timestamp
+
+    def has_field(self, field):
+        return field in CLIENT_FIELDS or bool(self.extra and field in self.extra)
+
+    def copy(self):
+        return Booking(self.id, self.chat_id, self.timestamp, self.name, self.phone,
+                       self.date, self.service, self.starts_at,
+                       dict(self.extra) if self.extra else None)
+
+    # ---------- словари и JSON ----------
+
+    def client_fields(self):
+        """Поля клиента словарем, как "client" в JSON"""
+        client = {"name": self.name, "phone": self.phone, "date": self.date,
+                  "service": self.service, "datetime": self.appointment_iso}
+        if self.extra:
+            client.update(self.extra)
+        return client
+
+    def to_dict(self):
+        return {"id": self.id, "chat_id": self.chat_id,
+                "timestamp": self.timestamp_iso, "client": self.client_fields()}
+
+    def to_json(self):
+        """Строка журнала - массив JSON (без перевода строки)"""
+        row = [self.id, self.chat_id, self.timestamp, self.name, self.phone,
+               self.date, self.service, self.starts_at]
+        if self.extra:
+            row.append(self.extra)
+        return _encode(row)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Запись из словаря формата хранилища. У старых записей без
+        client["datetime"] время разбирается из текста даты, год -
+        относительно момента создания
+        """
+        client = data.get("client") or {}
+        timestamp = data.get("timestamp")
+        timestamp = (timestamp if type(timestamp) is int
+                     else parse_timestamp(timestamp))
+        if "datetime" in client:
+            appointment = dates.from_iso(client["datetime"])
+        else:
+            created = (_EPOCH + datetime.timedelta(microseconds=timestamp)
+                       if timestamp is not None else None)
+            appointment = dates.parse_appointment(client.get("date"), created)
+        extra = None
+        if not client.keys() <= _CLIENT_KEYS:
+            extra = {key: value for key, value in client.items()
+                     if key not in _CLIENT_KEYS}
+        return cls(data.get("id"), data.get("chat_id"), timestamp,
+                   client.get("name"), client.get("phone"), client.get("date"),
+                   client.get("service"),
+                   to_epoch(appointment) if appointment is not None else None, extra)
+
+    @classmethod
+    def from_json(cls, line):
+        """Запись из строки журнала: массива или словаря прежнего формата"""
+        return cls.from_data(json.loads(line))
+
+    @classmethod
+    def from_data(cls, data):
+        """Запись из разобранной строки журнала (список или словарь)"""
+        if type(data) is list:
+            if not 8 <= len(data) <= 9:
+                raise ValueError("неверная строка записи")
+            return cls(*data)
+        return cls.from_dict(data)
+
+    @classmethod
+    def new(cls, chat_id, client, record_id, now=None):
+        """Новая запись из полей клиента (client - словарь, как в диалоге)"""
+        now = now or datetime.datetime.now()
+        return cls.from_dict({"id": record_id, "chat_id": chat_id,
+                              "timestamp": (now - _EPOCH) // _MICROSECOND,
+                              "client": client})
+
+    def __repr__(self):
+        return f"Booking({self.id!r}, chat_id={self.chat_id!r}, {self.appointment_iso})"
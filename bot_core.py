@@ -1,24 +1,39 @@
 """
 bot_core.py - основная логика Telegram бота
+
+Импорт модуля ничего не создает и не читает окружение: бот
+собирается в app.py, который регистрирует обработчики через attach().
 """
 import telebot
 from telebot import types
-import os
+import datetime
+import logging
 import time
+from archive import archive
+from clients import directory
 import database as db
+import dates
+from dispatcher import DispatchingBot
 import keyboards as kb
-
-# Инициализация бота
-TOKEN = os.environ.get('BOT_TOKEN')
-if not TOKEN:
-    print("❌ ОШИБКА: BOT_TOKEN не установлен!")
-    print("⚙️ Установите переменную окружения BOT_TOKEN")
-    exit(1)
-
-bot = telebot.TeleBot(TOKEN)
-
-# Состояния пользователей для многошаговых операций
-user_states = {}
+import metrics
+from listing import listing, chat_views, render_record
+from router import MessageRouter
+from schedule import schedule, format_conflicts
+from states import user_states
+
+log = logging.getLogger(__name__)
+
+# Клиент, через который обработчики отправляют сообщения, и TeleBot,
+# на котором они зарегистрированы (задаются в attach). Сообщения идут
+# через общую очередь отправки (dispatcher.DispatchingBot), если она
+# передана. В async-режиме bot подменяется мостом к AsyncTeleBot
+# (см. use_bot_client)
+bot = None
+handlers_bot = None
+
+# Таблица обработчиков текстовых сообщений, регистрируется в боте
+# одним обработчиком в attach()
+router = MessageRouter(user_states.state)
 
 # Константы состояний
 class UserState:
@@ -31,7 +46,7 @@ class UserState:
 
 # ===================== ОБРАБОТЧИКИ КОМАНД =====================
 
-@bot.message_handler(commands=['start'])
+@router.command('start')
 def start_command(message):
     """Обработчик команды /start"""
     bot.send_message(message.chat.id,
@@ -40,7 +55,7 @@ def start_command(message):
                     parse_mode='Markdown',
                     reply_markup=kb.main_menu_keyboard())
 
-@bot.message_handler(commands=['help'])
+@router.command('help')
 def help_command(message):
     """Обработчик команды /help"""
     help_text = """
@@ -48,36 +63,46 @@ def help_command(message):
 
 */start* - главное меню
 */help* - эта справка
-*/edit [номер]* - редактировать запись
-*/delete [номер]* - удалить запись
+*/edit [номер или ID]* - редактировать запись
+*/delete [номер или ID]* - удалить запись
+*/free [дата]* - свободное время на день
+*/history [месяц]* - прошедшие записи из архива
+*/find [имя или телефон]* - найти клиента и его визиты
 
 *Через кнопки меню:*
 📅 Записать клиента - новая запись
 👥 Сегодняшние записи - записи на сегодня
 📋 Все записи - все записи с номерами
 
+Номер - из последнего показанного вам списка,
+ID - из строки 🆔 в списке.
+
 *Примеры:*
 /edit 3 - редактировать запись №3
 /delete 2 - удалить запись №2
+`/edit rec_1a2b3c4d` - редактировать запись по ID
+/free 25.12 - свободные окна на 25 декабря
+/history 05.2026 - записи за май 2026 года
+/find Анна - клиенты, чье имя начинается на "Анна"
 """
     bot.send_message(message.chat.id, help_text, parse_mode='Markdown')
 
 # ===================== ГЛАВНОЕ МЕНЮ =====================
 
-@bot.message_handler(func=lambda message: message.text == "📅 Записать клиента")
+@router.text("📅 Записать клиента")
 def start_add_client(message):
     """Начало процесса добавления клиента"""
-    user_states[message.chat.id] = {"state": UserState.ADDING_NAME}
+    user_states.set(message.chat.id, UserState.ADDING_NAME)
     bot.send_message(message.chat.id,
                     "📝 *Начнем запись клиента:*\n\n"
                     "Введите *имя клиента*:",
                     parse_mode='Markdown',
                     reply_markup=kb.cancel_keyboard())
 
-@bot.message_handler(func=lambda message: message.text == "👥 Сегодняшние записи")
+@router.text("👥 Сегодняшние записи")
 def show_today_records(message):
-    """Показывает записи на сегодня"""
-    records = db.get_today_records()
+    """Показывает записи чата на сегодня"""
+    records = db.get_today_records(message.chat.id)
     
     if not records:
         bot.send_message(message.chat.id, "📝 На сегодня записей нет")
@@ -85,93 +110,119 @@ def show_today_records(message):
     
     response = "📋 *Записи на сегодня:*\n\n"
     for i, record in enumerate(records, 1):
-        client = record["client"]
-        response += f"{i}. *{client['name']}*\n"
-        response += f"   📅 {client['date']}\n"
-        response += f"   📞 {client['phone']}\n"
-        response += f"   💇 {client['service']}\n\n"
+        response += render_record(i, record)
     
+    chat_views.remember(message.chat.id, records)
     bot.send_message(message.chat.id, response, parse_mode='Markdown')
 
-@bot.message_handler(func=lambda message: message.text == "📋 Все записи")
+@router.text("📋 Все записи")
 def show_all_records(message):
-    """Показывает все записи"""
-    records = db.load_all_records()
-    
+    """Показывает первую страницу всех записей чата"""
+    records = listing.records(message.chat.id)
     if not records:
         bot.send_message(message.chat.id, "📝 Записей пока нет")
         return
     
-    response = "📋 *Все записи:*\n\n"
-    for i, record in enumerate(records, 1):
-        client = record["client"]
-        record_id = record.get("id", "без ID")[:8]
-        
-        response += f"{i}. *{client['name']}*\n"
-        response += f"   📅 {client['date']}\n"
-        response += f"   📞 {client['phone']}\n"
-        response += f"   💇 {client['service']}\n"
-        response += f"   🆔 {record_id}\n\n"
-    
-    response += "✏️ *Для управления:*\n"
-    response += "/edit [номер] - редактировать запись\n"
-    response += "/delete [номер] - удалить запись\n"
-    response += "Например: `/edit 3` или `/delete 2`"
+    chat_views.remember(message.chat.id, records)
+    page, pages, response = listing.page(message.chat.id, 0)
+    bot.send_message(message.chat.id, response, parse_mode='Markdown',
+                     reply_markup=kb.records_page_keyboard(page, pages))
+
+@metrics.instrument(metrics.HANDLER_SECONDS, metrics.HANDLER_ERRORS, "handler")
+def flip_records_page(call):
+    """Листание списка всех записей"""
+    try:
+        requested = int(call.data.split(":", 1)[1])
+    except ValueError:
+        bot.answer_callback_query(call.id)
+        return
     
-    bot.send_message(message.chat.id, response, parse_mode='Markdown')
+    chat_id = call.message.chat.id
+    page, pages, response = listing.page(chat_id, requested)
+    chat_views.remember(chat_id, listing.records(chat_id))
+    try:
+        bot.edit_message_text(response, chat_id, call.message.message_id,
+                              parse_mode='Markdown',
+                              reply_markup=kb.records_page_keyboard(page, pages))
+    except telebot.apihelper.ApiTelegramException as e:
+        # "message is not modified" при повторном нажатии - не ошибка
+        if "not modified" not in str(e):
+            raise
+    bot.answer_callback_query(call.id)
 
 # ===================== ДОБАВЛЕНИЕ КЛИЕНТА =====================
 
-@bot.message_handler(func=lambda message: 
-                    user_states.get(message.chat.id, {}).get("state") == UserState.ADDING_NAME)
+# Сколько сохраненных телефонов предлагать кнопками
+PHONE_CHOICES = 3
+
+@router.state(UserState.ADDING_NAME)
 def process_client_name(message):
     """Обработка ввода имени клиента"""
     if message.text == "❌ Отмена":
         cancel_operation(message.chat.id)
         return
     
-    user_states[message.chat.id] = {
-        "state": UserState.ADDING_PHONE,
-        "client": {"name": message.text}
-    }
+    user_states.set(message.chat.id, UserState.ADDING_PHONE,
+                    client={"name": message.text})
+    
+    # Постоянному клиенту - его телефон кнопкой, чтобы не вводить заново
+    phones = directory.phones_for_name(message.chat.id, message.text, PHONE_CHOICES)
+    if phones:
+        bot.send_message(message.chat.id,
+                        f"👤 Имя: *{message.text}*\n\n"
+                        "📞 Выберите сохраненный *телефон* или введите новый:",
+                        parse_mode='Markdown',
+                        reply_markup=kb.phone_choice_keyboard(phones))
+        return
     
     bot.send_message(message.chat.id,
                     f"👤 Имя: *{message.text}*\n\n"
                     "📞 Введите *телефон* клиента:",
                     parse_mode='Markdown')
 
-@bot.message_handler(func=lambda message: 
-                    user_states.get(message.chat.id, {}).get("state") == UserState.ADDING_PHONE)
+@router.state(UserState.ADDING_PHONE)
 def process_client_phone(message):
     """Обработка ввода телефона"""
     if message.text == "❌ Отмена":
         cancel_operation(message.chat.id)
         return
     
-    user_states[message.chat.id]["client"]["phone"] = message.text
-    user_states[message.chat.id]["state"] = UserState.ADDING_DATE
+    session = user_states.get(message.chat.id)
+    if session is None:
+        session_lost(message.chat.id)
+        return
+    user_states.update(message.chat.id, state=UserState.ADDING_DATE,
+                       client=dict(session.client, phone=message.text))
     
     bot.send_message(message.chat.id,
-                    "📅 Введите *дату и время* (например: 25.12 в 15:00):",
-                    parse_mode='Markdown')
+                    f"📅 Введите *дату и время* (например: {dates.DATE_EXAMPLE}):",
+                    parse_mode='Markdown',
+                    reply_markup=kb.cancel_keyboard())
 
-@bot.message_handler(func=lambda message: 
-                    user_states.get(message.chat.id, {}).get("state") == UserState.ADDING_DATE)
+@router.state(UserState.ADDING_DATE)
 def process_client_date(message):
     """Обработка ввода даты"""
     if message.text == "❌ Отмена":
         cancel_operation(message.chat.id)
         return
     
-    user_states[message.chat.id]["client"]["date"] = message.text
-    user_states[message.chat.id]["state"] = UserState.ADDING_SERVICE
+    appointment = parse_new_appointment(message.chat.id, message.text)
+    if appointment is None:
+        return
+    
+    session = user_states.get(message.chat.id)
+    if session is None:
+        session_lost(message.chat.id)
+        return
+    user_states.update(message.chat.id, state=UserState.ADDING_SERVICE,
+                       client=dict(session.client, date=message.text,
+                                   datetime=dates.to_iso(appointment)))
     
     bot.send_message(message.chat.id,
                     "💇 Введите *услугу* (например: Стрижка, Окрашивание):",
                     parse_mode='Markdown')
 
-@bot.message_handler(func=lambda message: 
-                    user_states.get(message.chat.id, {}).get("state") == UserState.ADDING_SERVICE)
+@router.state(UserState.ADDING_SERVICE)
 def process_client_service(message):
     """Обработка ввода услуги и сохранение"""
     if message.text == "❌ Отмена":
@@ -179,8 +230,14 @@ def process_client_service(message):
         return
     
     chat_id = message.chat.id
-    client_data = user_states[chat_id]["client"]
-    client_data["service"] = message.text
+    session = user_states.get(chat_id)
+    if session is None:
+        session_lost(chat_id)
+        return
+    client_data = dict(session.client, service=message.text)
+    
+    # Проверяем, не занято ли время (запись все равно сохраняется)
+    conflicts = find_conflicts(chat_id, client_data)
     
     # Сохраняем запись
     record_id = db.save_client_record(chat_id, client_data)
@@ -195,17 +252,19 @@ def process_client_service(message):
                         f"Запись сохранена!",
                         parse_mode='Markdown',
                         reply_markup=kb.main_menu_keyboard())
+        if conflicts:
+            bot.send_message(chat_id, format_conflicts(conflicts), parse_mode='Markdown')
     else:
         bot.send_message(chat_id,
                         "❌ Ошибка при сохранении записи",
                         reply_markup=kb.main_menu_keyboard())
     
     # Очищаем состояние
-    user_states.pop(chat_id, None)
+    user_states.pop(chat_id)
 
 # ===================== УДАЛЕНИЕ ЗАПИСЕЙ =====================
 
-@bot.message_handler(commands=['delete'])
+@router.command('delete')
 def delete_record_command(message):
     """Обработчик команды /delete"""
     try:
@@ -214,26 +273,18 @@ def delete_record_command(message):
             show_delete_help(message.chat.id)
             return
         
-        number = int(parts[1])
-        records = db.load_all_records()
-        
-        if number < 1 or number > len(records):
-            bot.send_message(message.chat.id,
-                           f"⚠️ Нет записи с номером {number}\n"
-                           f"Всего записей: {len(records)}")
+        record, label = resolve_record(message.chat.id, parts[1])
+        if record is None:
             return
         
-        record = records[number - 1]
-        if db.delete_record_by_id(record["id"]):
+        if db.delete_record_by_id(record.id):
             bot.send_message(message.chat.id,
-                           f"✅ Запись #{number} удалена\n"
-                           f"Клиент: *{record['client']['name']}*",
+                           f"✅ Запись {label} удалена\n"
+                           f"Клиент: *{record.name}*",
                            parse_mode='Markdown')
         else:
             bot.send_message(message.chat.id, "❌ Ошибка при удалении")
             
-    except ValueError:
-        bot.send_message(message.chat.id, "⚠️ Номер должен быть числом!")
     except Exception as e:
         bot.send_message(message.chat.id, f"❌ Ошибка: {e}")
 
@@ -241,15 +292,15 @@ def show_delete_help(chat_id):
     """Показывает справку по команде /delete"""
     bot.send_message(chat_id,
                     "✏️ *Удаление записи:*\n\n"
-                    "Используйте: `/delete [номер]`\n"
-                    "Например: `/delete 3`\n\n"
+                    "Используйте: `/delete [номер или ID]`\n"
+                    "Например: `/delete 3` или `/delete rec_1a2b3c4d`\n\n"
                     "Чтобы увидеть номера записей:\n"
                     "Нажмите *📋 Все записи*",
                     parse_mode='Markdown')
 
 # ===================== РЕДАКТИРОВАНИЕ ЗАПИСЕЙ =====================
 
-@bot.message_handler(commands=['edit'])
+@router.command('edit')
 def edit_record_command(message):
     """Обработчик команды /edit"""
     try:
@@ -258,47 +309,34 @@ def edit_record_command(message):
             show_edit_help(message.chat.id)
             return
         
-        number = int(parts[1])
-        records = db.load_all_records()
-        
-        if number < 1 or number > len(records):
-            bot.send_message(message.chat.id,
-                           f"⚠️ Нет записи с номером {number}\n"
-                           f"Всего записей: {len(records)}")
+        record, label = resolve_record(message.chat.id, parts[1])
+        if record is None:
             return
-        
-        record = records[number - 1]
         chat_id = message.chat.id
         
         # Сохраняем данные для редактирования
-        user_states[chat_id] = {
-            "state": UserState.EDITING_CHOOSE_FIELD,
-            "record_id": record["id"],
-            "record_number": number,
-            "client": record["client"]
-        }
+        user_states.set(chat_id, UserState.EDITING_CHOOSE_FIELD,
+                        record_id=record.id,
+                        record_label=label,
+                        client=record.client_fields())
         
         bot.send_message(chat_id,
-                        f"✏️ *Редактирование записи #{number}:*\n\n"
-                        f"👤 {record['client']['name']}\n"
-                        f"📞 {record['client']['phone']}\n"
-                        f"📅 {record['client']['date']}\n"
-                        f"💇 {record['client']['service']}\n\n"
+                        f"✏️ *Редактирование записи {label}:*\n\n"
+                        f"👤 {record.name}\n"
+                        f"📞 {record.phone}\n"
+                        f"📅 {record.date}\n"
+                        f"💇 {record.service}\n\n"
                         f"*Какое поле меняем?*",
                         parse_mode='Markdown',
                         reply_markup=kb.edit_fields_keyboard())
         
-    except ValueError:
-        bot.send_message(message.chat.id, "⚠️ Номер должен быть числом!")
     except Exception as e:
         bot.send_message(message.chat.id, f"❌ Ошибка: {e}")
 
-@bot.message_handler(func=lambda message: 
-                    user_states.get(message.chat.id, {}).get("state") == UserState.EDITING_CHOOSE_FIELD)
+@router.state(UserState.EDITING_CHOOSE_FIELD)
 def process_edit_field_choice(message):
     """Обработка выбора поля для редактирования"""
     chat_id = message.chat.id
-    state_data = user_states.get(chat_id, {})
     
     field_map = {
         "👤 Имя": "name",
@@ -308,12 +346,14 @@ def process_edit_field_choice(message):
     }
     
     if message.text in field_map:
-        state_data["field"] = field_map[message.text]
-        state_data["field_display"] = message.text
-        state_data["state"] = UserState.EDITING_ENTER_VALUE
-        user_states[chat_id] = state_data
+        session = user_states.update(chat_id, state=UserState.EDITING_ENTER_VALUE,
+                                     field=field_map[message.text],
+                                     field_display=message.text)
+        if session is None:
+            session_lost(chat_id)
+            return
         
-        current_value = state_data["client"][field_map[message.text]]
+        current_value = session.client[session.field]
         bot.send_message(chat_id,
                         f"✏️ Текущее значение: *{current_value}*\n"
                         f"Введите новое значение:",
@@ -325,8 +365,7 @@ def process_edit_field_choice(message):
     else:
         bot.send_message(chat_id, "⚠️ Пожалуйста, выберите поле из кнопок")
 
-@bot.message_handler(func=lambda message: 
-                    user_states.get(message.chat.id, {}).get("state") == UserState.EDITING_ENTER_VALUE)
+@router.state(UserState.EDITING_ENTER_VALUE)
 def process_edit_new_value(message):
     """Обработка ввода нового значения"""
     if message.text == "❌ Отмена":
@@ -334,60 +373,273 @@ def process_edit_new_value(message):
         return
     
     chat_id = message.chat.id
-    state_data = user_states.get(chat_id, {})
+    session = user_states.get(chat_id)
     
-    if not state_data:
-        bot.send_message(chat_id, "❌ Сессия редактирования утеряна")
-        return_main_menu(chat_id)
+    if session is None:
+        session_lost(chat_id)
         return
     
     new_value = message.text
-    record_id = state_data["record_id"]
-    field = state_data["field"]
-    field_display = state_data["field_display"]
-    record_number = state_data["record_number"]
+    record_id = session.record_id
+    field = session.field
+    field_display = session.field_display
+    record_label = session.record_label
     
-    if db.update_record_field(record_id, field, new_value):
+    fields = {field: new_value}
+    if field == "date":
+        appointment = parse_new_appointment(chat_id, new_value)
+        if appointment is None:
+            return
+        fields["datetime"] = dates.to_iso(appointment)
+    
+    # Новое время или услуга могут пересечься с другими записями
+    conflicts = []
+    if field in ("date", "service"):
+        conflicts = find_conflicts(chat_id, dict(session.client, **fields),
+                                   exclude=record_id)
+    
+    if db.update_record_fields(record_id, fields):
         bot.send_message(chat_id,
-                        f"✅ *Запись #{record_number} обновлена!*\n\n"
+                        f"✅ *Запись {record_label} обновлена!*\n\n"
                         f"Поле: {field_display}\n"
                         f"Новое значение: *{new_value}*",
                         parse_mode='Markdown',
                         reply_markup=kb.main_menu_keyboard())
+        if conflicts:
+            bot.send_message(chat_id, format_conflicts(conflicts), parse_mode='Markdown')
     else:
         bot.send_message(chat_id, "❌ Ошибка при обновлении записи")
     
-    user_states.pop(chat_id, None)
+    user_states.pop(chat_id)
+
+# ===================== СВОБОДНОЕ ВРЕМЯ =====================
+
+@router.command('free')
+def free_slots_command(message):
+    """Обработчик команды /free [дата] - свободные окна на день"""
+    chat_id = message.chat.id
+    parts = message.text.split()
+    if len(parts) > 2:
+        show_free_help(chat_id)
+        return
+    day = dates.parse_day(parts[1]) if len(parts) == 2 else datetime.date.today()
+    if day is None:
+        show_free_help(chat_id)
+        return
+    
+    slots = schedule.free_slots(chat_id, day)
+    if not slots:
+        bot.send_message(chat_id, f"📅 На {day.strftime('%d.%m.%Y')} свободного времени нет")
+        return
+    
+    response = f"🕐 *Свободное время на {day.strftime('%d.%m.%Y')}:*\n\n"
+    for start, end in slots:
+        response += f"• {start.strftime('%H:%M')}–{end.strftime('%H:%M')}\n"
+    bot.send_message(chat_id, response, parse_mode='Markdown')
+
+def show_free_help(chat_id):
+    """Показывает справку по команде /free"""
+    bot.send_message(chat_id,
+                    "🕐 *Свободное время:*\n\n"
+                    "Используйте: `/free [дата]`\n"
+                    "Например: `/free 25.12` (без даты - на сегодня)",
+                    parse_mode='Markdown')
+
+# ===================== АРХИВ =====================
+
+# Сколько записей архива показывать в одном сообщении
+HISTORY_LIMIT = 30
+
+@router.command('history')
+def history_command(message):
+    """Обработчик команды /history [месяц] - прошедшие записи из архива"""
+    chat_id = message.chat.id
+    parts = message.text.split()
+    if len(parts) > 2:
+        show_history_help(chat_id)
+        return
+    if len(parts) == 2:
+        month = dates.parse_month(parts[1])
+        if month is None:
+            show_history_help(chat_id)
+            return
+    else:
+        # Без месяца - последний месяц, за который есть архив
+        months = archive.months(chat_id)
+        if not months:
+            bot.send_message(chat_id, "📦 В архиве записей нет")
+            return
+        month = months[-1]
+    
+    year, month_number = month.split("-")
+    records = archive.month_records(chat_id, month)
+    if not records:
+        bot.send_message(chat_id, f"📦 За {month_number}.{year} в архиве записей нет")
+        return
+    
+    response = f"📦 *Архив за {month_number}.{year}* (записей: {len(records)}):\n\n"
+    for i, record in enumerate(records[:HISTORY_LIMIT], 1):
+        response += render_record(i, record)
+    if len(records) > HISTORY_LIMIT:
+        response += f"... и еще {len(records) - HISTORY_LIMIT}"
+    bot.send_message(chat_id, response, parse_mode='Markdown')
+
+def show_history_help(chat_id):
+    """Показывает справку по команде /history"""
+    bot.send_message(chat_id,
+                    "📦 *Архив записей:*\n\n"
+                    "Используйте: `/history [месяц]`\n"
+                    "Например: `/history 05.2026` (без месяца - последний месяц в архиве)",
+                    parse_mode='Markdown')
+
+# ===================== КЛИЕНТЫ =====================
+
+# Сколько клиентов показывать в результатах /find
+FIND_LIMIT = 10
+
+@router.command('find')
+def find_client_command(message):
+    """Обработчик команды /find [имя или телефон] - поиск клиента"""
+    chat_id = message.chat.id
+    query = message.text.partition(" ")[2].strip()
+    if not query:
+        show_find_help(chat_id)
+        return
+    
+    clients = directory.find(chat_id, query, FIND_LIMIT)
+    if not clients:
+        bot.send_message(chat_id, f"🔎 Клиенты по запросу «{query}» не найдены")
+        return
+    
+    if len(clients) == 1:
+        # Один клиент - сразу его визиты
+        client = clients[0]
+        visits = client.sorted_visits()
+        response = (f"👤 *{client.name}*, 📞 {client.phone}\n"
+                    f"Визитов: {len(visits)}\n\n")
+        shown = visits[-HISTORY_LIMIT:]
+        if len(visits) > len(shown):
+            response += f"... и еще {len(visits) - len(shown)} ранее\n\n"
+        for i, record in enumerate(shown, len(visits) - len(shown) + 1):
+            response += render_record(i, record)
+        bot.send_message(chat_id, response, parse_mode='Markdown')
+        return
+    
+    response = f"🔎 *Клиенты по запросу «{query}»:*\n\n"
+    for i, client in enumerate(clients, 1):
+        response += (f"{i}. *{client.name}* - 📞 {client.phone}\n"
+                     f"   визитов: {len(client.visits)}, последний: {client.last.date}\n")
+    if len(clients) == FIND_LIMIT:
+        response += "\nПоказаны первые совпадения - уточните запрос"
+    bot.send_message(chat_id, response, parse_mode='Markdown')
+
+def show_find_help(chat_id):
+    """Показывает справку по команде /find"""
+    bot.send_message(chat_id,
+                    "🔎 *Поиск клиента:*\n\n"
+                    "Используйте: `/find [имя или телефон]`\n"
+                    "Например: `/find Анна` (по началу имени или фамилии)\n"
+                    "или `/find 8 900 123-45-67` (по номеру в любом формате)",
+                    parse_mode='Markdown')
 
 # ===================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====================
 
+def resolve_record(chat_id, handle):
+    """
+    Находит запись для /edit и /delete
+    handle - ID записи (rec_1a2b3c4d) или номер из последнего списка,
+             показанного этому чату
+    Возвращает (запись, подпись для ответа) или (None, None),
+    отправив пользователю сообщение об ошибке
+    """
+    if handle.isdigit():
+        number = int(handle)
+        # Без показанного списка номера считаются по "📋 Все записи"
+        records = chat_views.get(chat_id) or listing.records(chat_id)
+        if number < 1 or number > len(records):
+            bot.send_message(chat_id,
+                           f"⚠️ Нет записи с номером {number}\n"
+                           f"Всего записей в списке: {len(records)}")
+            return None, None
+        record_id = records[number - 1].id
+        label = f"#{number}"
+    else:
+        record_id = handle if handle.startswith("rec_") else "rec_" + handle
+        label = f"`{record_id}`"
+    
+    # Запись берется заново по индексу ID: список мог устареть
+    record = db.get_record(record_id)
+    if record is None or record.chat_id != chat_id:
+        # Записи других чатов для этого чата не существуют
+        bot.send_message(chat_id, f"⚠️ Запись {label} не найдена (возможно, уже удалена)",
+                         parse_mode='Markdown')
+        return None, None
+    return record, label
+
+def find_conflicts(chat_id, client, exclude=None):
+    """Записи чата, пересекающиеся по времени с записью client"""
+    start = dates.from_iso(client.get("datetime"))
+    if start is None:
+        return []
+    return schedule.conflicts(chat_id, start, client.get("service"), exclude=exclude)
+
 def cancel_operation(chat_id):
     """Отменяет текущую операцию"""
-    user_states.pop(chat_id, None)
+    user_states.pop(chat_id)
     bot.send_message(chat_id,
                     "❌ Операция отменена",
                     reply_markup=kb.main_menu_keyboard())
 
+def session_lost(chat_id):
+    """Сессия истекла или вытеснена, пока пользователь отвечал"""
+    bot.send_message(chat_id, "❌ Сессия утеряна, начните заново")
+    return_main_menu(chat_id)
+
 def return_main_menu(chat_id):
     """Возвращает в главное меню"""
-    user_states.pop(chat_id, None)
+    user_states.pop(chat_id)
     bot.send_message(chat_id,
                     "💇 Возвращаемся в меню...",
                     reply_markup=kb.main_menu_keyboard())
 
+def parse_new_appointment(chat_id, text):
+    """
+    Разбирает время записи из диалога. Нераспознанная дата и уже
+    прошедшее время не принимаются: пользователю уходит сообщение
+    об ошибке, состояние не меняется, возвращается None
+    """
+    appointment = dates.parse_appointment(text)
+    if appointment is None:
+        show_date_format_error(chat_id)
+        return None
+    if appointment < datetime.datetime.now():
+        bot.send_message(chat_id,
+                        f"⚠️ Время *{appointment.strftime('%d.%m.%Y %H:%M')}* уже прошло.\n"
+                        "Введите будущие дату и время:",
+                        parse_mode='Markdown')
+        return None
+    return appointment
+
+def show_date_format_error(chat_id):
+    """Сообщает о нераспознанной дате, состояние не меняется"""
+    bot.send_message(chat_id,
+                    "⚠️ Не удалось распознать дату.\n"
+                    f"Введите дату и время в формате *{dates.DATE_EXAMPLE}*:",
+                    parse_mode='Markdown')
+
 def show_edit_help(chat_id):
     """Показывает справку по команде /edit"""
     bot.send_message(chat_id,
                     "✏️ *Редактирование записи:*\n\n"
-                    "Используйте: `/edit [номер]`\n"
-                    "Например: `/edit 3`\n\n"
+                    "Используйте: `/edit [номер или ID]`\n"
+                    "Например: `/edit 3` или `/edit rec_1a2b3c4d`\n\n"
                     "Чтобы увидеть номера записей:\n"
                     "Нажмите *📋 Все записи*",
                     parse_mode='Markdown')
 
 # ===================== ОБРАБОТКА ПРОЧИХ СООБЩЕНИЙ =====================
 
-@bot.message_handler(func=lambda message: True)
+@router.default
 def handle_other_messages(message):
     """Обработчик всех остальных сообщений"""
     if message.text == "❌ Отмена":
@@ -399,17 +651,43 @@ def handle_other_messages(message):
 
 # ===================== ЗАПУСК БОТА =====================
 
+def attach(telebot_bot, dispatcher=None):
+    """
+    Регистрирует обработчики в telebot_bot и отправляет ответы через него
+    dispatcher - общая очередь отправки: send_message обработчиков
+                 идет через нее (с лимитами, общими с напоминаниями)
+    Возвращает telebot_bot
+    """
+    global bot, handlers_bot
+    router.register(telebot_bot)
+    telebot_bot.register_callback_query_handler(
+        flip_records_page, func=lambda call: call.data.startswith("records_page:"))
+    handlers_bot = telebot_bot
+    bot = DispatchingBot(telebot_bot, dispatcher) if dispatcher is not None else telebot_bot
+    return telebot_bot
+
+def use_bot_client(client):
+    """
+    Перенаправляет отправку сообщений из обработчиков в client
+    (объект с методами TeleBot, например мост к AsyncTeleBot).
+    Возвращает TeleBot с зарегистрированными обработчиками, который
+    теперь вызывает их синхронно в текущем потоке.
+    """
+    global bot
+    bot = client
+    if handlers_bot is not None:
+        handlers_bot.threaded = False
+    return handlers_bot
+
 def run_bot():
     """Запускает бота"""
-    print("🚀 Бот запускается...")
-    print(f"🤖 Токен: {'Установлен' if TOKEN else 'НЕ УСТАНОВЛЕН!'}")
+    log.info("Бот запускается")
     
     while True:
         try:
-            print("🔄 Запускаем polling...")
-            bot.polling(none_stop=True, interval=0, timeout=30)
-        except Exception as e:
-            print(f"❌ Ошибка: {e}")
-            print("🔄 Перезапуск через 5 секунд...")
+            log.info("Запускаем polling")
+            handlers_bot.polling(none_stop=True, interval=0, timeout=30)
+        except Exception:
+            log.exception("Ошибка polling, перезапуск через 5 секунд")
             time.sleep(5)
             continue
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""
+bulk.py - массовый импорт и экспорт записей (перенос салона в бот и из него)
+
+Импорт читает CSV или JSON-lines построчно, проверяет и разбирает даты,
+пропускает записи с уже существующими ID и добавляет все записи в
+хранилище одной атомарной операцией (database.import_records).
+Экспорт читает журналы разделов построчно (database.stream_records)
+и пишет записи по одной, с фильтром по чату и диапазону дат;
+с --archive - вместе с прошедшими записями из архива (archive.py).
+
+CSV: строка заголовка с колонками name, phone, date, service
+(необязательные: id, chat_id, datetime, timestamp).
+JSON-lines: по записи в строке - в формате хранилища
+({"id", "chat_id", "timestamp", "client": {...}}) или плоско, как в CSV.
+
+Импорт можно запускать и при работающем боте: записи идут через
+тот же журнал под межпроцессной блокировкой, и бот перечитает
+измененные разделы (database.FOREIGN_CHECK_INTERVAL).
+
+Запуск:
+    python bulk.py import clients.csv --chat 123456789
+    python bulk.py export --chat 123456789 --from 2026-01-01 --to 2026-12-31 -o out.csv
+    python bulk.py export --archive --from 2025-01-01 -o history.csv
+"""
+import argparse
+import csv
+import datetime
+import json
+import itertools
+import sys
+
+from archive import archive
+from booking import Booking
+import database as db
+import dates
+import logs
+
+CSV_COLUMNS = ("id", "chat_id", "name", "phone", "date", "service",
+               "datetime", "timestamp")
+
+class RowError(ValueError):
+    """Строка импорта, которую нельзя превратить в запись"""
+
+def _detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+def read_rows(f, fmt):
+    """Строки файла импорта по одной: (номер строки, словарь)"""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+def row_to_record(row, chat_id=None, now=None):
+    """
+    Проверяет строку импорта и собирает из нее запись хранилища (Booking)
+    chat_id - чат, в который импортировать (важнее chat_id из строки)
+    """
+    if not isinstance(row, dict):
+        raise RowError("строка не разобрана")
+    client = row.get("client") if isinstance(row.get("client"), dict) else row
+    chat_id = chat_id if chat_id is not None else row.get("chat_id")
+    if chat_id in (None, ""):
+        raise RowError("не указан chat_id")
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        raise RowError(f"неверный chat_id: {chat_id}")
+
+    name = (client.get("name") or "").strip()
+    date_text = (client.get("date") or "").strip()
+    if not name:
+        raise RowError("нет имени клиента")
+
+    timestamp = row.get("timestamp") or (now or datetime.datetime.now()).isoformat()
+    try:
+        created = datetime.datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        raise RowError(f"неверный timestamp: {timestamp}")
+    if client.get("datetime"):
+        try:
+            appointment = dates.from_iso(client["datetime"])
+        except (TypeError, ValueError):
+            raise RowError(f"неверный datetime: {client['datetime']}")
+    else:
+        appointment = dates.parse_appointment(date_text, created)
+        if appointment is None:
+            raise RowError(f"дата не распознана: {date_text!r}")
+    if not date_text:
+        date_text = appointment.strftime("%d.%m.%Y в %H:%M")
+
+    return Booking.from_dict({
+        "id": row.get("id") or None,   # без ID - назначит import_file
+        "chat_id": chat_id,
+        "timestamp": timestamp,
+        "client": {
+            "name": name,
+            "phone": (client.get("phone") or "").strip(),
+            "date": date_text,
+            "service": (client.get("service") or "").strip(),
+            "datetime": dates.to_iso(appointment),
+        }
+    })
+
+def import_file(path, chat_id=None, fmt=None):
+    """
+    Импортирует файл. Возвращает (добавлено, пропущено дублей, ошибок)
+    """
+    fmt = _detect_format(path, fmt)
+    records, errors = [], 0
+    taken = set()   # ID из файла и уже выданные новые ID
+    now = datetime.datetime.now()
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for number, row in read_rows(f, fmt):
+            try:
+                record = row_to_record(row, chat_id, now)
+            except RowError as e:
+                errors += 1
+                print(f"⚠️ Строка {number}: {e}", file=sys.stderr)
+                continue
+            if record.id is None:
+                # Новый ID не должен совпасть ни с существующим, ни с ID из файла
+                record.id = db.generate_record_id()
+                while record.id in taken or db.get_record(record.id):
+                    record.id = db.generate_record_id()
+            taken.add(record.id)
+            records.append(record)
+    added = db.import_records(records)
+    return added, len(records) - added, errors
+
+def export_records(out, fmt="csv", chat_id=None, date_from=None, date_to=None,
+                   include_archive=False):
+    """
+    Пишет записи в out по одной. Возвращает количество записей
+    include_archive - добавить записи из архива (после рабочих)
+    """
+    count = 0
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer:
+        writer.writerow(CSV_COLUMNS)
+    # Журналы читаются построчно: хранилище целиком в память не загружается
+    records = db.stream_records(chat_id, date_from, date_to)
+    if include_archive:
+        # Запись, которая есть и в хранилище, и в архиве (сбой при переносе),
+        # выгружается один раз - из хранилища
+        exported = set()
+        records = itertools.chain(
+            (exported.add(record.id) or record for record in records),
+            archive.iter_records(chat_id, date_from, date_to, in_store=exported.__contains__))
+    for record in records:
+        if writer:
+            writer.writerow([record.id, record.chat_id, record.name, record.phone,
+                             record.date, record.service, record.appointment_iso,
+                             record.timestamp_iso])
+        else:
+            out.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+def _day(text):
+    """Аргумент даты: "2026-12-25" или "25.12.2026" -> "2026-12-25" """
+    try:
+        return datetime.date.fromisoformat(text).isoformat()
+    except ValueError:
+        day = dates.parse_day(text)
+        if day is None:
+            raise argparse.ArgumentTypeError(f"неверная дата: {text}")
+        return day.isoformat()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт и экспорт записей")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="импорт из CSV/JSON-lines")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--chat", type=int, help="чат, в который импортировать")
+    import_parser.add_argument("--format", choices=("csv", "jsonl"))
+
+    export_parser = commands.add_parser("export", help="экспорт в CSV/JSON-lines")
+    export_parser.add_argument("--chat", type=int)
+    export_parser.add_argument("--from", dest="date_from", type=_day)
+    export_parser.add_argument("--to", dest="date_to", type=_day)
+    export_parser.add_argument("--format", choices=("csv", "jsonl"))
+    export_parser.add_argument("--archive", action="store_true",
+                               help="вместе с архивом прошедших записей")
+    export_parser.add_argument("-o", "--output", help="файл (по умолчанию stdout)")
+
+    args = parser.parse_args(argv)
+    # Логи - в stderr, в stdout только выгрузка
+    logs.setup_logging()
+    if args.command == "import":
+        added, duplicates, errors = import_file(args.path, args.chat, args.format)
+        print(f"📥 Импортировано записей: {added}, дублей пропущено: {duplicates}, "
+              f"ошибок: {errors}", file=sys.stderr)
+        return 0 if not errors else 1
+
+    fmt = args.format or ("csv" if not args.output
+                          else _detect_format(args.output, None))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            count = export_records(out, fmt, args.chat, args.date_from, args.date_to,
+                                   args.archive)
+    else:
+        count = export_records(sys.stdout, fmt, args.chat, args.date_from, args.date_to,
+                               args.archive)
+    print(f"📤 Экспортировано записей: {count}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
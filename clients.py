@@ -0,0 +1,253 @@
+"""
+clients.py - справочник клиентов: поиск по телефону и по имени
+
+Клиент - это телефон: записи чата с одинаковым телефоном (после
+нормализации: только цифры, 8XXXXXXXXXX и 10 цифр с 9 в начале
+приводятся к 7XXXXXXXXXX) - визиты одного клиента. Имя и телефон
+клиента берутся из его последнего визита.
+
+Для каждого чата строятся:
+  - словарь нормализованный телефон -> клиент (поиск по номеру);
+  - словарь полное имя -> телефоны (подсказка номера при записи);
+  - отсортированный список (начало слова имени, телефон) для поиска
+    по префиксу: это тот же префиксный индекс, что и trie, но в одном
+    плоском списке - префикс находится бинарным поиском, совпадения
+    идут подряд, а памяти нужно на порядок меньше, чем на узлы trie.
+    Индексируется каждое слово имени, так что "ив" находит и
+    "Иванова Анна", и "Анна Иванова".
+
+В справочник попадают и записи из архива (archive.py): постоянные
+клиенты не пропадают, когда их визиты уходят в историю. Индекс чата
+строится при первом запросе и дальше обновляется по изменениям
+записей (database.add_change_listener) и по переносу в архив.
+"""
+import bisect
+import threading
+
+from archive import archive
+import database as db
+
+def normalize_phone(phone):
+    """Телефон -> только цифры в едином виде ("" - если цифр нет)"""
+    digits = "".join(ch for ch in phone or "" if ch.isdigit())
+    if len(digits) == 11 and digits[0] == "8":
+        return "7" + digits[1:]
+    if len(digits) == 10 and digits[0] == "9":
+        return "7" + digits
+    return digits
+
+def normalize_name(name):
+    """Имя для сравнения: без регистра, ё -> е, одиночные пробелы"""
+    return " ".join((name or "").casefold().replace("ё", "е").split())
+
+def _word_keys(name_key):
+    """Ключи префиксного поиска: имя с начала каждого слова"""
+    keys = [name_key]
+    for index, ch in enumerate(name_key):
+        if ch == " ":
+            keys.append(name_key[index + 1:])
+    return keys
+
+def _visit_order(record):
+    return record.starts_at or 0, record.timestamp or 0
+
+class Client:
+    """Клиент чата: телефон и его визиты (записи)"""
+
+    __slots__ = ("phone_key", "name", "phone", "visits", "last")
+
+    def __init__(self, phone_key):
+        self.phone_key = phone_key
+        self.name = None
+        self.phone = None
+        self.visits = {}      # id записи -> запись
+        self.last = None      # последний визит
+
+    def refresh(self):
+        """Имя и телефон - из последнего визита"""
+        self.last = max(self.visits.values(), key=_visit_order, default=None)
+        if self.last is not None:
+            self.name = self.last.name
+            self.phone = self.last.phone
+
+    def sorted_visits(self):
+        """Визиты по времени, последние в конце"""
+        return sorted(self.visits.values(), key=_visit_order)
+
+class ChatClients:
+    """Клиенты одного чата с индексами по телефону и имени"""
+
+    def __init__(self, records=()):
+        self._clients = {}    # нормализованный телефон -> Client
+        self._phone_of = {}   # id записи -> нормализованный телефон
+        self._by_name = {}    # полное имя -> {телефон: None} (в порядке добавления)
+        for record in records:
+            self._add_visit(record)
+        self._names = sorted((key, phone_key)
+                             for phone_key, client in self._clients.items()
+                             for key in self._refresh(client, index=False))
+
+    # ---------- изменения ----------
+
+    def add(self, record):
+        """Добавляет или обновляет визит (запись)"""
+        self.remove(record.id)
+        client = self._add_visit(record)
+        if client is not None:
+            self._reindex(client)
+
+    def remove(self, record_id):
+        phone_key = self._phone_of.pop(record_id, None)
+        if phone_key is None:
+            return
+        client = self._clients[phone_key]
+        del client.visits[record_id]
+        self._reindex(client)
+        if not client.visits:
+            del self._clients[phone_key]
+
+    def _add_visit(self, record):
+        phone_key = normalize_phone(record.phone)
+        if not phone_key:
+            return None   # без телефона клиента не узнать
+        client = self._clients.get(phone_key)
+        if client is None:
+            client = self._clients[phone_key] = Client(phone_key)
+        client.visits[record.id] = record
+        self._phone_of[record.id] = phone_key
+        return client
+
+    def _reindex(self, client):
+        """Переносит ключи имени клиента после изменения его визитов"""
+        old_name = client.name
+        if old_name is not None:
+            self._unindex_name(client.phone_key, normalize_name(old_name))
+        if client.visits:
+            self._refresh(client, index=True)
+
+    def _refresh(self, client, index):
+        """Обновляет клиента и индекс полного имени, возвращает ключи поиска"""
+        client.refresh()
+        name_key = normalize_name(client.name)
+        if not name_key:
+            return []
+        self._by_name.setdefault(name_key, {})[client.phone_key] = None
+        keys = _word_keys(name_key)
+        if index:
+            for key in keys:
+                bisect.insort(self._names, (key, client.phone_key))
+        return keys
+
+    def _unindex_name(self, phone_key, name_key):
+        if not name_key:
+            return
+        phones = self._by_name.get(name_key)
+        if phones is not None:
+            phones.pop(phone_key, None)
+            if not phones:
+                del self._by_name[name_key]
+        for key in _word_keys(name_key):
+            item = (key, phone_key)
+            index = bisect.bisect_left(self._names, item)
+            if index < len(self._names) and self._names[index] == item:
+                del self._names[index]
+
+    # ---------- поиск ----------
+
+    def by_phone(self, phone):
+        """Клиент по телефону (в любой записи) или None"""
+        return self._clients.get(normalize_phone(phone))
+
+    def by_name(self, name):
+        """Клиенты с таким именем, последний визит - первым"""
+        phones = self._by_name.get(normalize_name(name), ())
+        return sorted((self._clients[phone_key] for phone_key in phones),
+                      key=lambda client: _visit_order(client.last), reverse=True)
+
+    def find(self, prefix, limit):
+        """
+        Клиенты, у которых одно из слов имени (или имя целиком)
+        начинается с prefix; не больше limit, по алфавиту
+        """
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        found = {}
+        index = bisect.bisect_left(self._names, (prefix,))
+        while index < len(self._names) and len(found) < limit:
+            key, phone_key = self._names[index]
+            if not key.startswith(prefix):
+                break
+            found.setdefault(phone_key, self._clients[phone_key])
+            index += 1
+        return sorted(found.values(), key=lambda client: normalize_name(client.name))
+
+    def __len__(self):
+        return len(self._clients)
+
+class ClientDirectory:
+    """Справочники клиентов по чатам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chats = {}   # chat_id -> ChatClients
+        db.add_change_listener(self.on_change)
+        archive.add_listener(self.on_archive)
+
+    def on_change(self, record_id, chat_id):
+        """Обновляет справочник чата после изменения записи"""
+        record = db.get_record(record_id)
+        with self._lock:
+            clients = self._chats.get(chat_id)
+            if clients is None:
+                return  # Справочник чата еще не строился
+            if record is not None:
+                clients.add(record)
+            else:
+                clients.remove(record_id)
+
+    def on_archive(self, records):
+        """Записи ушли в архив - визиты остаются в справочнике"""
+        with self._lock:
+            for record in records:
+                clients = self._chats.get(record.chat_id)
+                if clients is not None:
+                    clients.add(record)
+
+    def _clients(self, chat_id):
+        with self._lock:
+            clients = self._chats.get(chat_id)
+            if clients is None:
+                clients = ChatClients([*db.get_chat_records(chat_id),
+                                       *archive.iter_records(chat_id)])
+                self._chats[chat_id] = clients
+            return clients
+
+    def by_phone(self, chat_id, phone):
+        clients = self._clients(chat_id)
+        with self._lock:
+            return clients.by_phone(phone)
+
+    def by_name(self, chat_id, name):
+        clients = self._clients(chat_id)
+        with self._lock:
+            return clients.by_name(name)
+
+    def find(self, chat_id, query, limit):
+        """
+        Клиенты чата по запросу: телефону (если в запросе нет букв)
+        или началу имени
+        """
+        clients = self._clients(chat_id)
+        with self._lock:
+            if not any(ch.isalpha() for ch in query):
+                client = clients.by_phone(query)
+                return [client] if client is not None else []
+            return clients.find(query, limit)
+
+    def phones_for_name(self, chat_id, name, limit):
+        """Телефоны клиентов с именем name (для подсказки при записи)"""
+        return [client.phone for client in self.by_name(chat_id, name)[:limit]]
+
+# Общий справочник клиентов
+directory = ClientDirectory()
@@ -1,145 +1,1368 @@
 """
 database.py - работа с хранением данных (файловая БД)
+
+Записи хранятся по разделам: у каждого чата свой файл clients/<chat_id>.json
+(ShardedRecordStore). Раздел загружается один раз и дальше живет в памяти
+(RecordStore) с индексами по ID и по дате записи, так что список, записи
+на сегодня, правка и удаление работают только с данными своего чата.
+Функции модуля - тонкие обертки над общим хранилищем. Записи
+возвращаются объектами Booking (booking.py).
+
+Файл раздела - журнал: строка с полной записью (массив Booking.to_json
+или словарь прежнего формата) добавляет ее, {"op": "update", ...} меняет
+поля, {"op": "delete", ...} удаляет.
+Когда мертвых строк становится много, файл атомарно переписывается
+(компактизация) в фоновом потоке. Старый общий clients.json при первом
+запуске раскладывается по разделам.
+
+Все записи в файлы идут через один поток (storage_writer.py): изменения,
+пришедшие одновременно, фиксируются одной записью и одним fsync, под
+межпроцессной блокировкой. Изменение применяется к памяти в потоке
+записи после fsync, а вызывающий поток ждет его фиксации.
+
+Журнал может дописывать и другой процесс (bulk.py, вторая копия бота).
+Чтения и добавление раз в FOREIGN_CHECK_INTERVAL секунд сверяют размер
+файла с ожидаемым; если он другой, журнал перечитывается в фоне, и
+чужие строки становятся видны следующим запросам. Раздел чата, который
+создал другой процесс, подхватывается при первом обращении к чату.
+
+Прошедшие записи периодически переносятся в архив по месяцам
+(archive.py, delete_unchanged_records), так что в хранилище остаются
+сегодняшние и будущие.
 """
+import contextlib
+import contextvars
 import json
 import datetime
+import logging
+import os
+import shutil
+import threading
+import time
 import uuid
 
+import dates
+from booking import Booking, day_number, parse_timestamp
+from storage_writer import ForeignWriteError, get_writer
+from metrics import DB_SECONDS, DB_ERRORS, instrument
+
+log = logging.getLogger(__name__)
+
+CLIENTS_FILE = "clients.json"
+CLIENTS_DIR = os.environ.get("CLIENTS_DIR", "clients")
+REMINDERS_FILE = "reminders_sent.json"
+
+# Пороги компактизации журнала
+COMPACT_DEAD_RATIO = float(os.environ.get("COMPACT_DEAD_RATIO", "0.5"))
+COMPACT_MIN_DEAD = int(os.environ.get("COMPACT_MIN_DEAD", "100"))
+COMPACT_MAX_DEAD = int(os.environ.get("COMPACT_MAX_DEAD", "5000"))
+
+# Как часто (секунды) проверять, не дописал ли журнал другой процесс
+FOREIGN_CHECK_INTERVAL = float(os.environ.get("FOREIGN_CHECK_INTERVAL", "1"))
+
 def generate_record_id():
     """Генерирует уникальный ID для записи"""
     return "rec_" + str(uuid.uuid4())[:8]
 
+class RecordStore:
+    """
+    Хранилище записей в памяти с индексами.
+    Файл читается один раз при первом обращении, дальше все запросы
+    обслуживаются из памяти. Возвращаемые записи - общие объекты
+    хранилища, изменять их нужно только через методы хранилища.
+    reminders_path - журнал статусов напоминаний; None - без него
+    (разделы ShardedRecordStore: статусы ведет сам ShardedRecordStore)
+    """
+
+    def __init__(self, path=CLIENTS_FILE, reminders_path=REMINDERS_FILE,
+                 dead_ratio=COMPACT_DEAD_RATIO, min_dead=COMPACT_MIN_DEAD,
+                 max_dead=COMPACT_MAX_DEAD, auto_compact=True, verbose=True,
+                 writer=None, on_reload=None, check_interval=FOREIGN_CHECK_INTERVAL):
+        self.path = path
+        self.reminders_path = reminders_path
+        self.dead_ratio = dead_ratio
+        self.min_dead = min_dead
+        self.max_dead = max_dead
+        self.auto_compact = auto_compact
+        self.verbose = verbose
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._records = {}   # id -> запись (в порядке добавления)
+        self._by_chat = {}   # chat_id -> {id: None}
+        self._by_date = {}   # номер дня (Booking.day_number) -> {id: None}
+        self._lines = 0      # строк в журнале
+        self._compact_tail = None  # строки, дописанные во время компактизации
+        self._generation = 0       # растет при каждом перечитывании журнала
+        self._reloading = False
+        self._checked_at = 0.0     # время последней проверки чужих записей
+        self.check_interval = check_interval
+        self.on_reload = on_reload
+        self.writer = writer or get_writer()
+        self.ledger = (ReminderLedger(reminders_path, self.writer)
+                       if reminders_path is not None else None)
+
+    # ---------- загрузка и индексы ----------
+
+    def load(self):
+        """Загружает записи из файла (один раз)"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._read_journal()
+            self._loaded = True
+            if self.verbose:
+                log.info("Записи загружены", extra={"records": len(self._records),
+                                                    "journal_lines": self._lines})
+        self._maybe_compact()
+
+    def _read_journal(self):
+        """Читает журнал в пустые индексы и запоминает размер файла (под self._lock)"""
+        self._records.clear()
+        self._by_chat.clear()
+        self._by_date.clear()
+        self._lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                line = ""
+                for line in f:
+                    if line.strip():
+                        self._lines += 1
+                        self._apply_line(line)
+            if line and not line.endswith("\n"):
+                # Закрываем оборванную строку, чтобы не склеить ее со следующей
+                # (через поток записи, не дожидаясь: load может идти в нем же)
+                self.writer.append(self.path, ["\n"])
+        except FileNotFoundError:
+            if self.verbose:
+                log.info("Файл записей не найден, создадим при первой записи",
+                         extra={"path": self.path})
+        except Exception as e:
+            log.error("Ошибка чтения файла записей",
+                      extra={"path": self.path, "error": str(e)})
+        self.writer.track(self.path)
+
+    def reload(self, only_if_changed=False):
+        """
+        Перечитывает журнал, который дописывал другой процесс (в потоке
+        записи: под межпроцессной блокировкой и после уже поставленных
+        изменений), и снова отслеживает его размер. Возвращает ID
+        появившихся, измененных и удаленных записей
+        only_if_changed - сначала точно проверить, что журнал менял
+                          кто-то еще, и не перечитывать, если нет
+        """
+        def read():
+            if only_if_changed:
+                try:
+                    self.writer.check_unchanged(self.path)
+                    return None
+                except ForeignWriteError:
+                    pass
+            with self._lock:
+                before = {record_id: record.to_json()
+                          for record_id, record in self._records.items()}
+                self._read_journal()
+                self._generation += 1
+                after = {record_id: record.to_json()
+                         for record_id, record in self._records.items()}
+            return [record_id for record_id in before.keys() | after.keys()
+                    if before.get(record_id) != after.get(record_id)]
+
+        changed = self.writer.call(read).result()
+        if changed is None:
+            return []
+        log.info("Журнал перечитан после записи другим процессом",
+                 extra={"path": self.path, "changed": len(changed)})
+        if self.on_reload is not None:
+            self.on_reload(changed)
+        return changed
+
+    def _maybe_reload(self, only_if_changed=False):
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload_guarded, args=(only_if_changed,),
+                         daemon=True).start()
+
+    def _reload_guarded(self, only_if_changed):
+        try:
+            self.reload(only_if_changed)
+        except Exception:
+            log.exception("Ошибка перечитывания журнала", extra={"path": self.path})
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+        self._check_foreign()
+
+    def _check_foreign(self):
+        """
+        Не дописал ли журнал другой процесс: не чаще раза в
+        check_interval сверяет размер файла и при расхождении
+        перечитывает журнал в фоне (этот запрос отвечает по памяти)
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        if self.writer.changed_elsewhere(self.path):
+            self._maybe_reload()
+        elif self.writer.size_changed(self.path):
+            # Возможно, это наша же запись в процессе - проверяем точно
+            self._maybe_reload(only_if_changed=True)
+
+    def _index(self, record):
+        record_id = record.id
+        if record_id in self._records:
+            self._unindex(record_id)
+        self._records[record_id] = record
+        self._by_chat.setdefault(record.chat_id, {})[record_id] = None
+        key = record.day_number
+        if key is not None:
+            self._by_date.setdefault(key, {})[record_id] = None
+
+    def _unindex(self, record_id):
+        record = self._records.pop(record_id, None)
+        if record is None:
+            return None
+        chat_ids = self._by_chat.get(record.chat_id)
+        if chat_ids is not None:
+            chat_ids.pop(record_id, None)
+            if not chat_ids:
+                del self._by_chat[record.chat_id]
+        key = record.day_number
+        date_ids = self._by_date.get(key)
+        if date_ids is not None:
+            date_ids.pop(record_id, None)
+            if not date_ids:
+                del self._by_date[key]
+        return record
+
+    def _apply_line(self, line):
+        """Применяет одну строку журнала к состоянию в памяти"""
+        try:
+            entry = json.loads(line)
+            if type(entry) is list:
+                self._index(Booking.from_data(entry))
+                return
+        except ValueError:
+            # Оборванная при сбое строка - пропускаем
+            log.warning("Пропущена поврежденная строка журнала", extra={"path": self.path})
+            return
+        op = entry.get("op")
+        if op is None:
+            self._index(Booking.from_dict(entry))
+        elif op == "delete":
+            self._unindex(entry.get("id"))
+        elif op == "update":
+            record = self._records.get(entry.get("id"))
+            if record is not None:
+                self._set_fields(record, *_update_args(entry, record))
+
+    def _set_fields(self, record, fields, timestamp):
+        """Меняет поля записи, сохраняя ее место и обновляя индекс дат"""
+        record_id = record.id
+        old_key = record.day_number
+        record.update(fields, timestamp)
+        new_key = record.day_number
+        if old_key != new_key:
+            date_ids = self._by_date.get(old_key)
+            if date_ids is not None:
+                date_ids.pop(record_id, None)
+                if not date_ids:
+                    del self._by_date[old_key]
+            if new_key is not None:
+                self._by_date.setdefault(new_key, {})[record_id] = None
+
+    def _append(self, entry, apply):
+        """
+        Ставит строку журнала (Booking или словарь операции) в очередь
+        потока записи. apply() применяет изменение к памяти после fsync.
+        Возвращает Future фиксации - ждать его можно только отпустив
+        self._lock.
+        """
+        if isinstance(entry, Booking):
+            line = entry.to_json() + "\n"
+        else:
+            line = json.dumps(entry, ensure_ascii=False) + "\n"
+
+        def commit():
+            with self._lock:
+                self._lines += 1
+                if self._compact_tail is not None:
+                    self._compact_tail.append(line)
+                apply()
+
+        return self.writer.append(self.path, [line], commit)
+
+    # ---------- компактизация ----------
+
+    def dead_lines(self):
+        """Количество строк журнала, не отражающих живые записи"""
+        with self._lock:
+            return max(self._lines - len(self._records), 0)
+
+    def needs_compaction(self):
+        dead = self.dead_lines()
+        if dead >= self.max_dead:
+            return True
+        return (dead >= self.min_dead
+                and dead >= self.dead_ratio * max(self._lines, 1))
+
+    def _maybe_compact(self):
+        if self.writer.changed_elsewhere(self.path):
+            # Сначала чужие строки: сжимать устаревшую копию нельзя
+            self._maybe_reload()
+            return
+        if not self.auto_compact:
+            return
+        with self._lock:
+            if self._compact_tail is not None or not self.needs_compaction():
+                return
+            self._compact_tail = []
+        threading.Thread(target=self._compact_guarded, daemon=True).start()
+
+    def _compact_guarded(self):
+        try:
+            self.compact()
+        except ForeignWriteError:
+            log.warning("Компактизация отменена: журнал менял другой процесс",
+                        extra={"path": self.path})
+            self._maybe_reload()
+        except Exception:
+            log.exception("Ошибка компактизации журнала", extra={"path": self.path})
+
+    def compact(self):
+        """
+        Переписывает журнал в виде одной строки на живую запись.
+        Снимок пишется во временный файл вне потока записи, строки,
+        зафиксированные за это время, переносятся в конец, и файл
+        атомарно подменяется через os.replace уже в потоке записи -
+        после всех поставленных раньше изменений.
+        """
+        with self._lock:
+            tail = self._compact_tail = []
+            generation = self._generation
+            snapshot = [r.to_json() + "\n" for r in self._records.values()]
+        tmp_path = self.path + ".tmp"
+
+        def finish():
+            with self._lock:
+                self._compact_tail = None
+                if self._generation != generation:
+                    # Журнал перечитан после снимка - в снимке нет чужих строк
+                    raise ForeignWriteError(f"{self.path} перечитан во время компактизации")
+            with open(tmp_path, "a", encoding="utf-8") as f:
+                f.writelines(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            self.writer.replace_file(tmp_path, self.path)
+            with self._lock:
+                self._lines = len(snapshot) + len(tail)
+
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(snapshot)
+            self.writer.call(finish).result()
+            log.info("Журнал записей сжат", extra={"path": self.path,
+                                                   "journal_lines": self._lines})
+        finally:
+            with self._lock:
+                if self._compact_tail is tail:
+                    self._compact_tail = None
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # ---------- запросы ----------
+
+    def all(self):
+        """Все записи в порядке добавления"""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._records.values())
+
+    def get(self, record_id):
+        """Запись по ID или None"""
+        with self._lock:
+            self._ensure_loaded()
+            return self._records.get(record_id)
+
+    def by_chat(self, chat_id):
+        """Записи одного чата"""
+        with self._lock:
+            self._ensure_loaded()
+            return [self._records[i] for i in self._by_chat.get(chat_id, ())]
+
+    def by_chats(self, chat_ids):
+        """Записи нескольких чатов одним обращением: {chat_id: [записи]}"""
+        with self._lock:
+            self._ensure_loaded()
+            return {chat_id: [self._records[i] for i in self._by_chat.get(chat_id, ())]
+                    for chat_id in chat_ids}
+
+    def by_date(self, key, chat_id=None):
+        """
+        Записи на дату в формате "ГГГГ-ММ-ДД": одного чата
+        или (chat_id=None) всех чатов
+        """
+        with self._lock:
+            self._ensure_loaded()
+            records = [self._records[i] for i in self._by_date.get(day_number(key), ())]
+        if chat_id is not None:
+            records = [r for r in records if r.chat_id == chat_id]
+        return records
+
+    # ---------- изменения ----------
+
+    def add(self, chat_id, client_data):
+        """Добавляет запись (client_data - словарь полей клиента), возвращает ее ID"""
+        record = Booking.new(chat_id, client_data, generate_record_id())
+        with self._lock:
+            self._ensure_loaded()
+        self._append(record, lambda: self._index(record)).result()
+        return record.id
+
+    def add_many(self, records):
+        """
+        Добавляет готовые записи (Booking с id) одной атомарной операцией:
+        журнал с новыми строками собирается во временном файле и
+        подменяет старый через os.replace (в потоке записи). Записи
+        с уже существующими ID пропускаются. Возвращает список
+        добавленных записей.
+        """
+        return self.submit_many(records).result()
+
+    def submit_many(self, records):
+        """
+        То же, что add_many, но без ожидания: возвращает Future со
+        списком добавленных записей (ждать его - отпустив блокировки)
+        """
+        with self._lock:
+            self._ensure_loaded()
+
+        def commit():
+            with self._lock:
+                fresh = {}
+                for record in records:
+                    if record.id not in self._records:
+                        fresh.setdefault(record.id, record)
+            if not fresh:
+                return []
+            lines = [r.to_json() + "\n" for r in fresh.values()]
+            tmp_path = self.path + ".import"
+            try:
+                self.writer.check_unchanged(self.path)
+                foreign = False
+            except ForeignWriteError:
+                foreign = True
+            try:
+                # Копируется текущий файл, вместе с чужими строками, если они есть
+                if os.path.exists(self.path):
+                    shutil.copyfile(self.path, tmp_path)
+                with open(tmp_path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self.writer.track(self.path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            with self._lock:
+                self._lines += len(lines)
+                if self._compact_tail is not None:
+                    self._compact_tail.extend(lines)
+                for record in fresh.values():
+                    self._index(record)
+            if foreign:
+                # Чужие строки скопированы в новый журнал, но в памяти их нет
+                self._maybe_reload()
+            return list(fresh.values())
+
+        return self.writer.call(commit)
+
+    def iter_records(self, chat_id=None, date_from=None, date_to=None):
+        """
+        Записи чата (или всех чатов) с датой в диапазоне
+        [date_from, date_to] ("ГГГГ-ММ-ДД", границы необязательны)
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if chat_id is None:
+                records = list(self._records.values())
+            else:
+                records = [self._records[i] for i in self._by_chat.get(chat_id, ())]
+        for record in records:
+            if _in_range(record, date_from, date_to):
+                yield record
+
+    def delete(self, record_id):
+        """Удаляет запись, возвращает False если ее нет"""
+        with self._lock:
+            self._ensure_loaded()
+            if record_id not in self._records:
+                return False
+            future = self._append({"op": "delete", "id": record_id},
+                                  lambda: self._unindex(record_id))
+        future.result()
+        self._maybe_compact()
+        return True
+
+    def delete_many(self, timestamps):
+        """
+        Удаляет пачку записей {id: timestamp} одной записью в журнал,
+        пропуская записи, измененные после чтения (timestamp другой).
+        Проверка выполняется в потоке записи после уже поставленных
+        изменений. Возвращает ID удаленных записей
+        """
+        with self._lock:
+            self._ensure_loaded()
+
+        def commit():
+            with self._lock:
+                ids = [record_id for record_id, timestamp in timestamps.items()
+                       if record_id in self._records
+                       and self._records[record_id].timestamp == timestamp]
+            if not ids:
+                return []
+            lines = [json.dumps({"op": "delete", "id": record_id}) + "\n"
+                     for record_id in ids]
+            self.writer.write(self.path, lines)
+            with self._lock:
+                self._lines += len(lines)
+                if self._compact_tail is not None:
+                    self._compact_tail.extend(lines)
+                for record_id in ids:
+                    self._unindex(record_id)
+            return ids
+
+        removed = self.writer.call(commit).result()
+        self._maybe_compact()
+        return removed
+
+    def update_fields(self, record_id, fields):
+        """Обновляет поля client, возвращает False если нечего менять"""
+        with self._lock:
+            self._ensure_loaded()
+            record = self._records.get(record_id)
+            if record is None or not fields or not all(
+                    record.has_field(field) for field in fields):
+                return False
+            timestamp = datetime.datetime.now().isoformat()
+
+            def apply():
+                # Запись могли удалить, пока изменение ждало в очереди
+                current = self._records.get(record_id)
+                if current is not None:
+                    self._set_fields(current, fields, parse_timestamp(timestamp))
+
+            future = self._append({"op": "update", "id": record_id, "fields": fields,
+                                   "timestamp": timestamp}, apply)
+        future.result()
+        self._maybe_compact()
+        return True
+
+    # ---------- статусы напоминаний ----------
+
+    def reminder_status(self, record_id):
+        """Статус напоминаний записи"""
+        return self.ledger.status(record_id)
+
+    def all_reminder_statuses(self):
+        """Все статусы напоминаний: {record_id: status}"""
+        return self.ledger.all()
+
+    def set_reminder_status(self, record_id, status):
+        """Сохраняет статус напоминаний записи"""
+        self.ledger.set(record_id, status)
+
+    def prune_reminder_statuses(self, now):
+        """
+        Удаляет статусы напоминаний удаленных и прошедших записей
+        Возвращает количество удаленных статусов
+        """
+        return self.ledger.prune(lambda record_id: _is_upcoming(self.get(record_id), now))
+
+class ReminderLedger:
+    """
+    Статусы отправленных напоминаний.
+
+    reminders_sent.json - журнал строк {"record_id": ..., "status": {...}},
+    последняя строка по записи побеждает. Старый формат (один JSON-словарь)
+    читается и при первой записи переводится в журнал.
+    """
+
+    def __init__(self, path=REMINDERS_FILE, writer=None):
+        self.path = path
+        self.writer = writer or get_writer()
+        self._lock = threading.Lock()
+        self._statuses = None  # id записи -> статус напоминаний
+        self._legacy = False
+
+    def _load(self):
+        """
+        Загружает статусы в память (один раз, под self._lock; заново -
+        если журнал дописывал другой процесс)
+        """
+        if self._statuses is not None and not self.writer.changed_elsewhere(self.path):
+            return
+        self._statuses = {}
+        self._legacy = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return
+        finally:
+            self.writer.track(self.path)
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and not {"record_id", "status"} <= data.keys():
+            self._statuses = data
+            self._legacy = True
+            return
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                log.warning("Пропущена поврежденная строка статусов напоминаний")
+                continue
+            self._statuses[entry["record_id"]] = entry["status"]
+        if text and not text.endswith("\n"):
+            # Закрываем оборванную строку, чтобы не склеить ее со следующей.
+            # Не дожидаясь и не держа поток записи под self._lock: следующие
+            # строки статусов встанут в очередь записи после нее
+            self.writer.append(self.path, ["\n"])
+
+    def _rewrite(self, statuses):
+        """
+        Атомарно переписывает журнал статусов (под self._lock, ждет
+        потока записи; если файл менял другой процесс - ForeignWriteError)
+        """
+        lines = [json.dumps({"record_id": record_id, "status": status},
+                            ensure_ascii=False) + "\n"
+                 for record_id, status in statuses.items()]
+        self.writer.call(lambda: self.writer.replace(self.path, lines)).result()
+        self._legacy = False
+
+    def status(self, record_id):
+        """Статус напоминаний записи"""
+        with self._lock:
+            self._load()
+            return dict(self._statuses.get(record_id, {}))
+
+    def all(self):
+        """Все статусы напоминаний: {record_id: status}"""
+        with self._lock:
+            self._load()
+            return {record_id: dict(status)
+                    for record_id, status in self._statuses.items()}
+
+    def set(self, record_id, status):
+        """Сохраняет статус напоминаний записи дописыванием одной строки"""
+        with self._lock:
+            self._load()
+            self._statuses[record_id] = dict(status)
+            if self._legacy:
+                self._rewrite(self._statuses)
+                return
+            line = json.dumps({"record_id": record_id, "status": status},
+                              ensure_ascii=False) + "\n"
+            # Порядок строк в файле - порядок постановки под self._lock
+            future = self.writer.append(self.path, [line])
+        future.result()
+
+    def prune(self, keep):
+        """
+        Оставляет статусы только тех записей, для которых keep(record_id)
+        истинно. Возвращает количество удаленных статусов
+        """
+        with self._lock:
+            self._load()
+            kept = {record_id: status
+                    for record_id, status in self._statuses.items()
+                    if keep(record_id)}
+            removed = len(self._statuses) - len(kept)
+            if removed:
+                try:
+                    self._rewrite(kept)
+                except ForeignWriteError:
+                    # Статусы перечитаются при следующем обращении, и размер
+                    # файла запомнится заново - следующая очистка пройдет
+                    log.warning("Очистка статусов отменена: журнал менял другой процесс",
+                                extra={"path": self.path})
+                    self._statuses = None
+                    return 0
+                self._statuses = kept
+            return removed
+
+def _update_args(entry, record):
+    """(поля, timestamp) строки журнала {"op": "update"} для записи record"""
+    # Старые строки журнала: одно поле в "field"/"value"
+    fields = entry.get("fields") or {entry["field"]: entry["value"]}
+    timestamp = parse_timestamp(entry.get("timestamp"))
+    return fields, timestamp if timestamp is not None else record.timestamp
+
+def stream_journal(path, date_from=None, date_to=None):
+    """
+    Живые записи журнала раздела по одной, без загрузки раздела в память.
+    Первый проход запоминает только строки операций (их немного:
+    компактизация их убирает), второй читает строки записей и
+    применяет к каждой изменения, записанные после нее
+    """
+    deletes, updates = {}, {}   # id -> номера строк / [(номер, операция)]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f):
+                if '"op"' not in line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if type(entry) is not dict:
+                    continue
+                if entry.get("op") == "delete":
+                    deletes.setdefault(entry.get("id"), []).append(number)
+                elif entry.get("op") == "update":
+                    updates.setdefault(entry.get("id"), []).append((number, entry))
+        with open(path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    if type(entry) is dict and entry.get("op") is not None:
+                        continue
+                    record = Booking.from_data(entry)
+                except (ValueError, TypeError):
+                    continue
+                if any(deleted > number for deleted in deletes.get(record.id, ())):
+                    continue
+                for updated, entry in updates.get(record.id, ()):
+                    if updated > number:
+                        record.update(*_update_args(entry, record))
+                if _in_range(record, date_from, date_to):
+                    yield record
+    except FileNotFoundError:
+        return
+
+def _in_range(record, date_from, date_to):
+    """Попадает ли дата записи в [date_from, date_to] (без дат - не попадает)"""
+    if date_from is None and date_to is None:
+        return True
+    key = record.day
+    return (key is not None
+            and (date_from is None or key >= date_from)
+            and (date_to is None or key <= date_to))
+
+def _is_upcoming(record, now):
+    """Есть ли у записи время и не прошло ли оно"""
+    appointment = record.appointment if record else None
+    return appointment is not None and appointment >= now
+
+class ShardedRecordStore:
+    """
+    Записи, разбитые по чатам: у каждого чата свой журнал
+    clients/<chat_id>.json (RecordStore) со своими индексами и своей
+    компактизацией. Запросы одного чата читают только его раздел,
+    запись по ID находится через общую карту id -> chat_id.
+    Интерфейс тот же, что у RecordStore.
+    """
+
+    def __init__(self, directory=CLIENTS_DIR, legacy_path=CLIENTS_FILE,
+                 reminders_path=REMINDERS_FILE):
+        self.directory = directory
+        self.legacy_path = legacy_path
+        self.reminders_path = reminders_path
+        self.writer = get_writer()
+        self.ledger = ReminderLedger(reminders_path, self.writer)
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._shards = {}   # chat_id -> RecordStore
+        self._chat_of = {}  # id записи -> chat_id
+
+    # ---------- загрузка ----------
+
+    def load(self):
+        """Загружает все разделы (один раз)"""
+        with self._lock:
+            if self._loaded:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._split_legacy()
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith(".json"):
+                    continue
+                # Ошибка чтения одного раздела не мешает остальным
+                self._open_shard(_shard_chat_id(name[:-len(".json")]))
+            self._loaded = True
+            log.info("Записи загружены", extra={"records": len(self._chat_of),
+                                                "chats": len(self._shards)})
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def _shard_path(self, chat_id):
+        return os.path.join(self.directory, f"{chat_id}.json")
+
+    def _new_shard(self, chat_id):
+        return RecordStore(self._shard_path(chat_id), reminders_path=None,
+                           verbose=False, writer=self.writer,
+                           on_reload=lambda changed: self._shard_reloaded(chat_id, changed))
+
+    def _open_shard(self, chat_id):
+        """Загружает существующий раздел чата (под self._lock)"""
+        shard = self._shards[chat_id] = self._new_shard(chat_id)
+        shard.load()
+        for record in shard.all():
+            self._chat_of[record.id] = chat_id
+        return shard
+
+    def _shard(self, chat_id, create=False):
+        """
+        Раздел чата (под self._lock). Раздел, который создал другой
+        процесс, загружается; create - завести пустой, если его нет
+        """
+        shard = self._shards.get(chat_id)
+        if shard is None:
+            if os.path.exists(self._shard_path(chat_id)):
+                shard = self._open_shard(chat_id)
+            elif create:
+                shard = self._shards[chat_id] = self._new_shard(chat_id)
+        return shard
+
+    def _shard_reloaded(self, chat_id, record_ids):
+        """
+        Журнал раздела перечитан (его дописывал другой процесс):
+        обновляет карту id -> chat_id и сообщает подписчикам об изменениях
+        """
+        with self._lock:
+            shard = self._shards.get(chat_id)
+            for record_id in record_ids:
+                if shard is not None and shard.get(record_id) is not None:
+                    self._chat_of[record_id] = chat_id
+                elif self._chat_of.get(record_id) == chat_id:
+                    del self._chat_of[record_id]
+        for record_id in record_ids:
+            _notify_change(record_id, chat_id)
+
+    def _split_legacy(self):
+        """
+        Однократно раскладывает старый общий clients.json по разделам
+        чатов и переименовывает его в clients.json.migrated
+        """
+        if not os.path.exists(self.legacy_path):
+            return
+        if any(name.endswith(".json") for name in os.listdir(self.directory)):
+            log.warning("Старый файл записей не разложен: разделы чатов уже есть",
+                        extra={"path": self.legacy_path})
+            return
+        legacy = RecordStore(self.legacy_path, reminders_path=None,
+                             auto_compact=False, verbose=False)
+        by_chat = {}
+        for record in legacy.all():
+            by_chat.setdefault(record.chat_id, []).append(record)
+        writer = get_writer()
+
+        def split():
+            for chat_id, records in by_chat.items():
+                writer.replace(self._shard_path(chat_id),
+                               [r.to_json() + "\n" for r in records])
+            os.replace(self.legacy_path, self.legacy_path + ".migrated")
+
+        writer.call(split).result()
+        log.info("Старый файл записей разложен по чатам",
+                 extra={"path": self.legacy_path, "chats": len(by_chat)})
+
+    def _shard_of(self, record_id):
+        """Раздел, в котором лежит запись, или None"""
+        with self._lock:
+            self._ensure_loaded()
+            chat_id = self._chat_of.get(record_id)
+            return self._shards.get(chat_id) if record_id in self._chat_of else None
+
+    # ---------- запросы ----------
+
+    def chat_ids(self):
+        """Чаты, у которых есть раздел"""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._shards)
+
+    def all(self):
+        """Все записи всех чатов (по чатам, внутри - в порядке добавления)"""
+        with self._lock:
+            self._ensure_loaded()
+            shards = list(self._shards.values())
+        return [record for shard in shards for record in shard.all()]
+
+    def get(self, record_id):
+        """Запись по ID или None"""
+        shard = self._shard_of(record_id)
+        return shard.get(record_id) if shard else None
+
+    def by_chat(self, chat_id):
+        """Записи одного чата"""
+        with self._lock:
+            self._ensure_loaded()
+            shard = self._shard(chat_id)
+        return shard.all() if shard else []
+
+    def by_chats(self, chat_ids):
+        """Записи нескольких чатов одним обращением: {chat_id: [записи]}"""
+        with self._lock:
+            self._ensure_loaded()
+            shards = {chat_id: self._shard(chat_id) for chat_id in chat_ids}
+        return {chat_id: shard.all() if shard else []
+                for chat_id, shard in shards.items()}
+
+    def by_date(self, key, chat_id=None):
+        """
+        Записи на дату в формате "ГГГГ-ММ-ДД": одного чата
+        или (chat_id=None) всех чатов
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if chat_id is not None:
+                shards = [shard for shard in [self._shard(chat_id)] if shard]
+            else:
+                shards = list(self._shards.values())
+        return [record for shard in shards for record in shard.by_date(key)]
+
+    # ---------- изменения ----------
+
+    def add(self, chat_id, client_data):
+        """Добавляет запись в раздел чата, возвращает ее ID"""
+        with self._lock:
+            self._ensure_loaded()
+            shard = self._shard(chat_id, create=True)
+        # Фиксацию ждем без общей блокировки: записи разных чатов,
+        # пришедшие одновременно, уходят одной пачкой
+        record_id = shard.add(chat_id, client_data)
+        with self._lock:
+            self._chat_of[record_id] = chat_id
+        return record_id
+
+    def add_many(self, records):
+        """
+        Добавляет готовые записи (с id) пачкой: одна атомарная запись
+        на раздел чата. Записи с уже существующими ID пропускаются.
+        Возвращает список добавленных записей.
+        """
+        by_chat = {}
+        seen = set()
+        with self._lock:
+            self._ensure_loaded()
+            for record in records:
+                if record.id not in self._chat_of and record.id not in seen:
+                    seen.add(record.id)
+                    by_chat.setdefault(record.chat_id, []).append(record)
+            futures = {}
+            for chat_id, chat_records in by_chat.items():
+                shard = self._shard(chat_id, create=True)
+                futures[chat_id] = shard.submit_many(chat_records)
+        # Фиксацию ждем без общей блокировки, как в add
+        added = []
+        for chat_id, future in futures.items():
+            chat_added = future.result()
+            with self._lock:
+                for record in chat_added:
+                    self._chat_of[record.id] = chat_id
+            added.extend(chat_added)
+        return added
+
+    def iter_records(self, chat_id=None, date_from=None, date_to=None):
+        """
+        Записи чата (или всех чатов) с датой в диапазоне
+        [date_from, date_to] ("ГГГГ-ММ-ДД", границы необязательны)
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if chat_id is None:
+                shards = list(self._shards.values())
+            else:
+                shards = [shard for shard in [self._shard(chat_id)] if shard]
+        for shard in shards:
+            yield from shard.iter_records(None, date_from, date_to)
+
+    def delete(self, record_id):
+        """Удаляет запись, возвращает False если ее нет"""
+        shard = self._shard_of(record_id)
+        if shard is None or not shard.delete(record_id):
+            return False
+        with self._lock:
+            self._chat_of.pop(record_id, None)
+        return True
+
+    def delete_many(self, timestamps):
+        """
+        Удаляет пачку записей {id: timestamp}, не измененных после
+        чтения: одна запись в журнал на раздел чата.
+        Возвращает ID удаленных записей
+        """
+        by_shard = {}
+        with self._lock:
+            self._ensure_loaded()
+            for record_id, timestamp in timestamps.items():
+                if record_id in self._chat_of:
+                    shard = self._shards[self._chat_of[record_id]]
+                    by_shard.setdefault(shard, {})[record_id] = timestamp
+        removed = []
+        for shard, shard_timestamps in by_shard.items():
+            removed.extend(shard.delete_many(shard_timestamps))
+        with self._lock:
+            for record_id in removed:
+                self._chat_of.pop(record_id, None)
+        return removed
+
+    def update_fields(self, record_id, fields):
+        """Обновляет поля client, возвращает False если нечего менять"""
+        shard = self._shard_of(record_id)
+        return shard is not None and shard.update_fields(record_id, fields)
+
+    # ---------- статусы напоминаний ----------
+
+    def reminder_status(self, record_id):
+        """Статус напоминаний записи"""
+        return self.ledger.status(record_id)
+
+    def all_reminder_statuses(self):
+        """Все статусы напоминаний: {record_id: status}"""
+        return self.ledger.all()
+
+    def set_reminder_status(self, record_id, status):
+        """Сохраняет статус напоминаний записи"""
+        self.ledger.set(record_id, status)
+
+    def prune_reminder_statuses(self, now):
+        """
+        Удаляет статусы напоминаний удаленных и прошедших записей
+        Возвращает количество удаленных статусов
+        """
+        return self.ledger.prune(lambda record_id: _is_upcoming(self.get(record_id), now))
+
+def _shard_chat_id(name):
+    """Имя файла раздела без .json -> chat_id"""
+    if name == "None":
+        return None
+    try:
+        return int(name)
+    except ValueError:
+        return name
+
+# Общее хранилище процесса
+_store = None
+_store_lock = threading.Lock()
+
+# Подписчики на изменения записей: callback(record_id, chat_id)
+_change_listeners = []
+
+# Снимок записей чатов текущей пачки обновлений (см. batch_snapshot)
+_batch_snapshot = contextvars.ContextVar("batch_snapshot", default=None)
+
+class ChatSnapshot:
+    """
+    Записи нескольких чатов, прочитанные одним обращением к хранилищу
+    при первом запросе любого из них. Чат, записи которого изменились,
+    из снимка выбрасывается, и дальше его записи читаются из хранилища.
+    """
+
+    def __init__(self, chat_ids, loader):
+        self._lock = threading.Lock()
+        self._chat_ids = set(chat_ids)
+        self._loader = loader   # loader(chat_ids) -> {chat_id: [записи]}
+        self._chats = None
+
+    def chat_records(self, chat_id):
+        """Записи чата из снимка или None, если чата в снимке нет"""
+        with self._lock:
+            if chat_id not in self._chat_ids:
+                return None
+            if self._chats is None:
+                self._chats = self._loader(self._chat_ids)
+            return self._chats.get(chat_id)
+
+    def invalidate(self, chat_id):
+        with self._lock:
+            self._chat_ids.discard(chat_id)
+            if self._chats is not None:
+                self._chats.pop(chat_id, None)
+
+@contextlib.contextmanager
+def batch_snapshot(chat_ids):
+    """
+    На время блока отдает get_chat_records и get_today_records для
+    чатов chat_ids из общего снимка, прочитанного одним запросом
+    (в текущем контексте и в контекстах, скопированных из него)
+    """
+    snapshot = ChatSnapshot(chat_ids, lambda ids: get_store().by_chats(ids))
+    token = _batch_snapshot.set(snapshot)
+    try:
+        yield snapshot
+    finally:
+        _batch_snapshot.reset(token)
+
+def _snapshot_records(chat_id):
+    snapshot = _batch_snapshot.get()
+    return snapshot.chat_records(chat_id) if snapshot is not None else None
+
+def add_change_listener(callback):
+    """
+    Подписывает callback(record_id, chat_id) на сохранение, изменение
+    и удаление записей (например, для планировщика напоминаний)
+    """
+    _change_listeners.append(callback)
+
+def remove_change_listener(callback):
+    """Отписывает callback от изменений записей"""
+    if callback in _change_listeners:
+        _change_listeners.remove(callback)
+
+def _notify_change(record_id, chat_id):
+    snapshot = _batch_snapshot.get()
+    if snapshot is not None:
+        snapshot.invalidate(chat_id)
+    for callback in list(_change_listeners):
+        try:
+            callback(record_id, chat_id)
+        except Exception:
+            log.exception("Ошибка обработчика изменений записи",
+                          extra={"record_id": record_id})
+
+def _failed(operation, message, **fields):
+    """Логирует перехваченную ошибку операции и считает ее в метриках"""
+    DB_ERRORS.inc(operation=operation)
+    log.exception(message, extra=dict(fields, operation=operation))
+
+def create_store(backend=None):
+    """
+    Создает хранилище по имени бэкенда: "json" (по умолчанию, разделы
+    по чатам в CLIENTS_DIR) или "sqlite". Без аргумента бэкенд берется
+    из переменной окружения STORAGE_BACKEND.
+    """
+    backend = (backend or os.environ.get("STORAGE_BACKEND") or "json").lower()
+    if backend == "json":
+        return ShardedRecordStore()
+    if backend == "sqlite":
+        from sqlite_store import SqliteRecordStore
+        return SqliteRecordStore()
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend}")
+
+def get_store():
+    """Возвращает общее хранилище, загружая его при первом вызове"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = create_store()
+                store.load()
+                _store = store
+    return _store
+
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
 def save_client_record(chat_id, client_data):
     """
-    Сохраняет запись клиента в файл
+    Сохраняет запись клиента в хранилище
     chat_id - ID чата Telegram
     client_data - словарь с данными клиента
     Возвращает ID созданной записи
     """
     try:
-        record = {
-            "id": generate_record_id(),
-            "chat_id": chat_id,
-            "timestamp": datetime.datetime.now().isoformat(),
-            "client": client_data
-        }
-        
-        with open("clients.json", "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-        
-        print(f"✅ Запись сохранена с ID: {record['id']}")
-        return record['id']
-        
-    except Exception as e:
-        print(f"❌ Ошибка сохранения: {e}")
+        record_id = get_store().add(chat_id, client_data)
+        log.info("Запись сохранена", extra={"record_id": record_id, "chat_id": chat_id})
+        _notify_change(record_id, chat_id)
+        return record_id
+
+    except Exception:
+        _failed("save_client_record", "Ошибка сохранения записи", chat_id=chat_id)
         return None
 
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
+def import_records(records):
+    """
+    Добавляет готовые записи пачкой (одна атомарная запись в хранилище)
+    records - Booking или словари формата хранилища
+    Записи с уже существующими ID пропускаются
+    Возвращает количество добавленных записей
+    """
+    added = get_store().add_many([r if isinstance(r, Booking) else Booking.from_dict(r)
+                                  for r in records])
+    for record in added:
+        _notify_change(record.id, record.chat_id)
+    return len(added)
+
+def iter_records(chat_id=None, date_from=None, date_to=None):
+    """
+    Записи по одной (для экспорта): одного чата или всех,
+    с датой в диапазоне [date_from, date_to] ("ГГГГ-ММ-ДД")
+    """
+    return get_store().iter_records(chat_id, date_from, date_to)
+
+def stream_records(chat_id=None, date_from=None, date_to=None):
+    """
+    То же, что iter_records, но без загрузки хранилища в память
+    (для bulk.py): журналы разделов JSON читаются с диска построчно,
+    только нужного чата. Если хранилище процесса уже загружено, бэкенд
+    не JSON или старый clients.json еще не разложен - как iter_records
+    """
+    backend = (os.environ.get("STORAGE_BACKEND") or "json").lower()
+    if _store is not None or backend != "json" or os.path.exists(CLIENTS_FILE):
+        yield from iter_records(chat_id, date_from, date_to)
+        return
+    if chat_id is not None:
+        names = [f"{chat_id}.json"]
+    else:
+        try:
+            names = sorted(name for name in os.listdir(CLIENTS_DIR)
+                           if name.endswith(".json"))
+        except FileNotFoundError:
+            return
+    for name in names:
+        yield from stream_journal(os.path.join(CLIENTS_DIR, name), date_from, date_to)
+
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
 def load_all_records():
-    """Загружает ВСЕ записи из файла"""
-    records = []
-    try:
-        with open("clients.json", "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    records.append(json.loads(line))
-    except FileNotFoundError:
-        print("📝 Файл записей не найден, создадим при первой записи")
-    except Exception as e:
-        print(f"❌ Ошибка чтения файла: {e}")
-    
-    return records
+    """Возвращает ВСЕ записи"""
+    return get_store().all()
+
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
+def get_record(record_id):
+    """Возвращает запись по ID или None"""
+    return get_store().get(record_id)
+
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
+def get_chat_records(chat_id):
+    """Возвращает записи одного чата"""
+    records = _snapshot_records(chat_id)
+    if records is not None:
+        return list(records)
+    return get_store().by_chat(chat_id)
 
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
 def delete_record_by_id(record_id):
     """Удаляет запись по ID"""
     try:
-        records = load_all_records()
-        new_records = [r for r in records if r.get("id") != record_id]
-        
-        if len(records) == len(new_records):
+        store = get_store()
+        record = store.get(record_id)
+        if record is None or not store.delete(record_id):
             return False  # Запись не найдена
-        
-        with open("clients.json", "w", encoding="utf-8") as f:
-            for record in new_records:
-                f.write(json.dumps(record, ensure_ascii=False) + "\n")
-        
-        print(f"✅ Запись {record_id} удалена")
+
+        log.info("Запись удалена", extra={"record_id": record_id})
+        _notify_change(record_id, record.chat_id)
         return True
-        
-    except Exception as e:
-        print(f"❌ Ошибка удаления: {e}")
+
+    except Exception:
+        _failed("delete_record_by_id", "Ошибка удаления записи", record_id=record_id)
         return False
 
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
+def delete_unchanged_records(records):
+    """
+    Удаляет пачку записей одной операцией (перенос в архив, archive.py)
+    records - копии записей на момент чтения: запись, измененная
+              с тех пор (другой timestamp), не удаляется
+    Возвращает ID удаленных записей
+    """
+    removed = get_store().delete_many({record.id: record.timestamp for record in records})
+    chat_of = {record.id: record.chat_id for record in records}
+    for record_id in removed:
+        _notify_change(record_id, chat_of[record_id])
+    return removed
+
 def update_record_field(record_id, field, new_value):
     """Обновляет одно поле в записи"""
+    return update_record_fields(record_id, {field: new_value})
+
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
+def update_record_fields(record_id, fields):
+    """
+    Обновляет несколько полей записи одной операцией
+    fields - словарь {поле: новое значение}
+    Если меняется "date" без "datetime", время разбирается заново
+    """
+    if "date" in fields and "datetime" not in fields:
+        parsed = dates.parse_appointment(fields["date"])
+        fields = dict(fields, datetime=dates.to_iso(parsed) if parsed else None)
     try:
-        records = load_all_records()
-        updated = False
-        
-        for record in records:
-            if record.get("id") == record_id:
-                if field in record["client"]:
-                    record["client"][field] = new_value
-                    record["timestamp"] = datetime.datetime.now().isoformat()
-                    updated = True
-                    break
-        
-        if not updated:
+        store = get_store()
+        record = store.get(record_id)
+        if record is None or not store.update_fields(record_id, fields):
             return False
-        
-        with open("clients.json", "w", encoding="utf-8") as f:
-            for record in records:
-                f.write(json.dumps(record, ensure_ascii=False) + "\n")
-        
-        print(f"✅ Запись {record_id} обновлена")
+
+        log.info("Запись обновлена", extra={"record_id": record_id,
+                                            "fields": ",".join(fields)})
+        _notify_change(record_id, record.chat_id)
         return True
-        
-    except Exception as e:
-        print(f"❌ Ошибка обновления: {e}")
+
+    except Exception:
+        _failed("update_record_fields", "Ошибка обновления записи", record_id=record_id)
         return False
 
-def get_today_records():
-    """Возвращает записи на сегодня"""
-    records = load_all_records()
-    today = datetime.datetime.now().strftime("%d.%m")
-    
-    today_records = []
-    for record in records:
-        if today in record["client"].get("date", ""):
-            today_records.append(record)
-    
-    return today_records
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
+def get_today_records(chat_id=None):
+    """
+    Возвращает записи на сегодня, отсортированные по времени:
+    одного чата или (chat_id=None) всех чатов
+    """
+    today = datetime.date.today().isoformat()
+    records = _snapshot_records(chat_id) if chat_id is not None else None
+    if records is not None:
+        records = [r for r in records if r.day == today]
+    else:
+        records = get_store().by_date(today, chat_id)
+    return sorted(records, key=lambda record: record.starts_at)
 
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
 def load_reminder_status(record_id):
     """
     Загружает статус напоминаний для записи
     """
     try:
-        with open("reminders_sent.json", "r", encoding="utf-8") as f:
-            reminders = json.load(f)
-            return reminders.get(record_id, {})
-    except FileNotFoundError:
+        return get_store().reminder_status(record_id)
+    except Exception:
+        _failed("load_reminder_status", "Ошибка загрузки статуса напоминаний",
+                record_id=record_id)
         return {}
-    except Exception as e:
-        print(f"❌ Ошибка загрузки статуса напоминаний: {e}")
+
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
+def load_all_reminder_statuses():
+    """
+    Загружает статусы напоминаний всех записей: {record_id: status}
+    """
+    try:
+        return get_store().all_reminder_statuses()
+    except Exception:
+        _failed("load_all_reminder_statuses", "Ошибка загрузки статусов напоминаний")
         return {}
 
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
+def prune_reminder_statuses(now=None):
+    """
+    Удаляет статусы напоминаний для удаленных и прошедших записей
+    Возвращает количество удаленных статусов
+    """
+    try:
+        return get_store().prune_reminder_statuses(now or datetime.datetime.now())
+    except Exception:
+        _failed("prune_reminder_statuses", "Ошибка очистки статусов напоминаний")
+        return 0
+
+@instrument(DB_SECONDS, DB_ERRORS, "operation")
 def save_reminder_status(record_id, status):
     """
     Сохраняет статус напоминаний для записи
     """
     try:
-        reminders = {}
-        
-        try:
-            with open("reminders_sent.json", "r", encoding="utf-8") as f:
-                reminders = json.load(f)
-        except FileNotFoundError:
-            pass
-        
-        reminders[record_id] = status
-        
-        with open("reminders_sent.json", "w", encoding="utf-8") as f:
-            json.dump(reminders, f, ensure_ascii=False, indent=2)
-            
-    except Exception as e:
-        print(f"❌ Ошибка сохранения статуса напоминаний: {e}")
\ No newline at end of file
+        get_store().set_reminder_status(record_id, status)
+    except Exception:
+        _failed("save_reminder_status", "Ошибка сохранения статуса напоминаний",
+                record_id=record_id)
\ No newline at end of file
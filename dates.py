@@ -0,0 +1,106 @@
+"""
+dates.py - разбор даты и времени записи
+
+Дата вводится текстом ("25.12 в 15:00") и разбирается один раз при
+сохранении. В записи рядом с текстом хранится нормализованное время
+client["datetime"] в формате ISO ("2026-12-25T15:00:00").
+"""
+import datetime
+import re
+
+DATE_EXAMPLE = "25.12 в 15:00"
+
+# Насколько в прошлое может попасть дата без года: позже этого она
+# относится к следующему году ("20.08", введенное в январе, - август
+# этого года, а не прошлого)
+PAST_GRACE = datetime.timedelta(days=7)
+
+# "25.12 в 15:00", "25.12.2026 в 15:00", "25.12 15:00", "25.12 в 15.00"
+APPOINTMENT_RE = re.compile(
+    r"^\s*(\d{1,2})\.(\d{1,2})(?:\.(\d{2}|\d{4}))?\s*(?:в\s+)?(\d{1,2})[:.](\d{2})\s*$",
+    re.IGNORECASE)
+
+# "25.12", "25.12.2026" - день без времени (например, для /free)
+DAY_RE = re.compile(r"^\s*(\d{1,2})\.(\d{1,2})(?:\.(\d{2}|\d{4}))?\s*$")
+
+# "05.2026", "5.26" - месяц (например, для /history)
+MONTH_RE = re.compile(r"^\s*(\d{1,2})\.(\d{2}|\d{4})\s*$")
+
+def parse_appointment(text, now=None):
+    """
+    Разбирает дату и время записи
+    text - строка вида "25.12 в 15:00"
+    now - момент, относительно которого подбирается год (по умолчанию сейчас):
+          дата без года относится к ближайшему такому дню не раньше
+          чем за PAST_GRACE до now, так что "05.01", введенное в декабре,
+          - это январь следующего года, а "20.12", введенное в июне, -
+          декабрь этого
+    Возвращает datetime или None, если строка не распознана
+    """
+    match = APPOINTMENT_RE.match(text or "")
+    if not match:
+        return None
+    day, month, year, hour, minute = match.groups()
+    return _next_occurrence(day, month, year, int(hour), int(minute),
+                            now or datetime.datetime.now())
+
+def parse_day(text, now=None):
+    """
+    Разбирает день без времени ("25.12" или "25.12.2026"), год
+    подбирается так же, как в parse_appointment.
+    Возвращает date или None, если строка не распознана
+    """
+    match = DAY_RE.match(text or "")
+    if not match:
+        return None
+    now = now or datetime.datetime.now()
+    day, month, year = match.groups()
+    parsed = _next_occurrence(day, month, year, 0, 0,
+                              now.replace(hour=0, minute=0, second=0, microsecond=0))
+    return parsed.date() if parsed else None
+
+def parse_month(text):
+    """
+    Разбирает месяц ("05.2026" или "5.26")
+    Возвращает строку "ГГГГ-ММ" или None, если строка не распознана
+    """
+    match = MONTH_RE.match(text or "")
+    if not match:
+        return None
+    month, year = int(match.group(1)), match.group(2)
+    year = int(year) + 2000 if len(year) == 2 else int(year)
+    if not 1 <= month <= 12:
+        return None
+    return f"{year:04d}-{month:02d}"
+
+def _next_occurrence(day, month, year, hour, minute, now):
+    """
+    Подходящий момент: с годом из текста - ровно он, без года - первый
+    не раньше чем now - PAST_GRACE (этот или следующий год; 29.02 -
+    ближайший високосный)
+    """
+    day, month = int(day), int(month)
+    if year:
+        years = [int(year) + 2000 if len(year) == 2 else int(year)]
+    else:
+        years = range(now.year, now.year + 5)
+    earliest = now - PAST_GRACE
+    for candidate_year in years:
+        try:
+            candidate = datetime.datetime(candidate_year, month, day, hour, minute)
+        except ValueError:
+            # 31.02, 25:00, 29.02 в невисокосном году и т.п.
+            continue
+        if year or candidate >= earliest:
+            return candidate
+    return None
+
+def to_iso(dt):
+    """datetime -> строка для client["datetime"]"""
+    return dt.isoformat(timespec="seconds")
+
+def from_iso(value):
+    """Строка client["datetime"] -> datetime (или None)"""
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value)
@@ -0,0 +1,245 @@
+"""
+dispatcher.py - очередь исходящих сообщений
+
+Сообщения кладутся в ограниченную очередь и отправляются пулом потоков.
+Скорость ограничивается "ведрами токенов": общим на бота и отдельным
+на каждый чат (лимиты Telegram: ~30 сообщений в секунду всего,
+1 в секунду в личный чат, 20 в минуту в группу).
+При 429 ждем retry_after из ответа, при 5xx и сетевых ошибках -
+экспоненциальная пауза.
+
+Диспетчер один на процесс (api_client.get_dispatcher): через него
+отправляют и напоминания, и ответы обработчиков (DispatchingBot),
+так что общий лимит, лимиты чатов и пауза после 429 действуют на все
+исходящие сообщения бота. Источник (source) нужен только метрикам.
+
+Функция отправки передается снаружи, поэтому диспетчер можно
+проверять с фейковой функцией без сети.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+SEND_WORKERS = int(os.environ.get("SEND_WORKERS", "4"))
+SEND_QUEUE_SIZE = int(os.environ.get("SEND_QUEUE_SIZE", "1000"))
+
+GLOBAL_RATE = 30          # сообщений в секунду на бота
+PRIVATE_CHAT_RATE = 1     # сообщений в секунду в личный чат
+GROUP_CHAT_RATE = 20 / 60  # сообщений в секунду в группу
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0        # секунд, удваивается с каждой попыткой
+BACKOFF_MAX = 60.0
+MAX_CHAT_BUCKETS = 10000
+
+log = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд появится токен (0 - уже есть)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+def retry_delay(error, attempt):
+    """
+    Пауза перед повтором после ошибки отправки или None, если
+    повторять бессмысленно (например, 403 - бот заблокирован)
+    """
+    code = getattr(error, "error_code", None)
+    if code == 429:
+        result = getattr(error, "result_json", None) or {}
+        retry_after = result.get("parameters", {}).get("retry_after")
+        if retry_after is not None:
+            return float(retry_after)
+    elif code is not None and code < 500:
+        return None
+    elif code is None and not isinstance(error, OSError):
+        return None
+    # 5xx, 429 без retry_after, сетевые ошибки (requests - наследники OSError)
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+
+class MessageDispatcher:
+    """
+    Пул потоков, отправляющий сообщения из ограниченной очереди
+    send_func(chat_id, text, **kwargs) - функция отправки, обычно bot.send_message
+    source - метка источника в метриках отправки по умолчанию
+    """
+
+    def __init__(self, send_func, workers=SEND_WORKERS, queue_size=SEND_QUEUE_SIZE,
+                 global_rate=GLOBAL_RATE, max_attempts=MAX_ATTEMPTS, source="reminders"):
+        self.send_func = send_func
+        self.source = source
+        self._senders = {}   # источник -> send_func с замером
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+        self._threads = []
+        self.running = False
+
+    def start(self):
+        """Запускает потоки отправки"""
+        if self.running:
+            return
+        self.running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"sender-{i}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        log.info("Очередь отправки запущена", extra={"workers": self.workers})
+
+    def stop(self, timeout=5):
+        """Останавливает потоки, дождавшись уже поставленных сообщений"""
+        if not self.running:
+            return
+        self.running = False
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+        log.info("Очередь отправки остановлена")
+
+    def submit(self, chat_id, text, timeout=None, source=None, **kwargs):
+        """
+        Ставит сообщение в очередь, возвращает Future с результатом отправки.
+        Если очередь полна, ждет до timeout секунд (None - бесконечно)
+        и бросает queue.Full.
+        source - метка источника в метриках (None - self.source)
+        """
+        future = Future()
+        self._queue.put((chat_id, text, kwargs, source or self.source, future),
+                        timeout=timeout)
+        return future
+
+    def send_message(self, chat_id, text, **kwargs):
+        """Отправка через очередь с ожиданием результата (как bot.send_message)"""
+        return self.submit(chat_id, text, **kwargs).result()
+
+    def pending(self):
+        """Сколько сообщений ждет в очереди"""
+        return self._queue.qsize()
+
+    # ---------- потоки отправки ----------
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            chat_id, text, kwargs, source, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._send_with_retry(chat_id, text, kwargs, source))
+            except Exception as e:
+                log.error("Не удалось отправить сообщение",
+                          extra={"chat_id": chat_id, "error": str(e)})
+                future.set_exception(e)
+
+    def _sender(self, source):
+        sender = self._senders.get(source)
+        if sender is None:
+            sender = self._senders.setdefault(
+                source, metrics.timed_send(self.send_func, source))
+        return sender
+
+    def _send_with_retry(self, chat_id, text, kwargs, source):
+        send = self._sender(source)
+        attempt = 0
+        while True:
+            self._acquire(chat_id)
+            try:
+                return send(chat_id, text, **kwargs)
+            except Exception as e:
+                attempt += 1
+                delay = retry_delay(e, attempt - 1)
+                if delay is None or attempt >= self.max_attempts:
+                    raise
+                if getattr(e, "error_code", None) == 429:
+                    # Флуд-контроль Telegram действует на всего бота
+                    with self._lock:
+                        self._paused_until = max(self._paused_until,
+                                                 time.monotonic() + delay)
+                metrics.SEND_RETRIES.inc()
+                log.warning("Ошибка отправки, повтор",
+                            extra={"chat_id": chat_id, "delay": round(delay, 1),
+                                   "error": str(e)})
+                time.sleep(delay)
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                # Полные ведра ничего не помнят - их можно выбросить
+                self._chat_buckets = {key: b for key, b in self._chat_buckets.items()
+                                      if not b.is_full(now)}
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            rate = GROUP_CHAT_RATE if is_group else PRIVATE_CHAT_RATE
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate)
+        return bucket
+
+    def _acquire(self, chat_id):
+        """Ждет, пока разрешат и общий лимит, и лимит чата"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                chat_bucket = self._chat_bucket(chat_id, now)
+                wait = max(self._paused_until - now,
+                           self._global_bucket.wait_time(now),
+                           chat_bucket.wait_time(now))
+                if wait <= 0:
+                    self._global_bucket.take()
+                    chat_bucket.take()
+                    return
+            time.sleep(wait)
+
+class DispatchingBot:
+    """
+    Клиент бота для обработчиков: send_message идет через очередь
+    диспетчера (с общими лимитами и повторами), остальные методы -
+    напрямую в client
+    """
+
+    def __init__(self, client, dispatcher, source="handlers"):
+        self._client = client
+        self._dispatcher = dispatcher
+        self._source = source
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._dispatcher.send_message(chat_id, text, source=self._source, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -19,6 +19,14 @@ def cancel_keyboard():
     markup.add(btn)
     return markup
 
+def phone_choice_keyboard(phones):
+    """Сохраненные телефоны клиента кнопками и кнопка Отмена"""
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for phone in phones:
+        markup.add(types.KeyboardButton(phone))
+    markup.add(types.KeyboardButton("❌ Отмена"))
+    return markup
+
 def edit_fields_keyboard():
     """Клавиатура для выбора поля при редактировании"""
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -28,4 +36,18 @@ def edit_fields_keyboard():
     btn4 = types.KeyboardButton("💇 Услуга")
     btn5 = types.KeyboardButton("❌ Отмена")
     markup.add(btn1, btn2, btn3, btn4, btn5)
+    return markup
+
+def records_page_keyboard(page, pages):
+    """Кнопки листания списка записей (page - с 0)"""
+    markup = types.InlineKeyboardMarkup()
+    buttons = []
+    if page > 0:
+        buttons.append(types.InlineKeyboardButton(
+            "◀️ Назад", callback_data=f"records_page:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(types.InlineKeyboardButton(
+            "Вперед ▶️", callback_data=f"records_page:{page + 1}"))
+    if buttons:
+        markup.row(*buttons)
     return markup
\ No newline at end of file
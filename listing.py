@@ -0,0 +1,130 @@
+"""
+listing.py - постраничный список "📋 Все записи"
+
+Каждый чат видит только свои записи. Они сортируются по времени
+записи и делятся на страницы по PAGE_SIZE штук. Отсортированный список
+и готовые тексты страниц кэшируются для каждого чата отдельно и
+сбрасываются при изменении записей этого чата
+(database.add_change_listener), так что листание страниц не
+перечитывает и не перерисовывает всю историю.
+
+Для /edit и /delete запоминается, какой список последним видел
+каждый чат: номер из команды относится именно к нему, даже если
+с тех пор записи добавлялись или удалялись.
+"""
+import collections
+import os
+import threading
+
+import database as db
+
+PAGE_SIZE = int(os.environ.get("RECORDS_PAGE_SIZE", "10"))
+MAX_CHAT_VIEWS = 1000
+
+def sort_key(record):
+    """Сначала записи с распознанной датой по времени, затем остальные"""
+    starts_at = record.starts_at
+    return starts_at is None, starts_at or 0
+
+def render_record(number, record):
+    """Текст одной записи в списке"""
+    return (f"{number}. *{record.name}*\n"
+            f"   📅 {record.date}\n"
+            f"   📞 {record.phone}\n"
+            f"   💇 {record.service}\n"
+            f"   🆔 `{record.id or 'без ID'}`\n\n")
+
+class RecordListing:
+    """Кэш отсортированных записей и отрисованных страниц по чатам"""
+
+    def __init__(self, page_size=PAGE_SIZE):
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._records = {}   # chat_id -> отсортированные записи
+        self._pages = {}     # chat_id -> {номер страницы: текст}
+        db.add_change_listener(self.invalidate)
+
+    def invalidate(self, record_id=None, chat_id=None):
+        """
+        Сбрасывает кэш чата (вызывается при изменении записей);
+        без chat_id - кэш всех чатов
+        """
+        with self._lock:
+            if chat_id is None:
+                self._records = {}
+                self._pages = {}
+            else:
+                self._records.pop(chat_id, None)
+                self._pages.pop(chat_id, None)
+
+    def records(self, chat_id):
+        """Записи чата в порядке списка (по времени записи)"""
+        with self._lock:
+            records = self._records.get(chat_id)
+            if records is None:
+                records = sorted(db.get_chat_records(chat_id), key=sort_key)
+                self._records[chat_id] = records
+                self._pages[chat_id] = {}
+            return records
+
+    def page_count(self, chat_id):
+        return max((len(self.records(chat_id)) + self.page_size - 1)
+                   // self.page_size, 1)
+
+    def page(self, chat_id, page):
+        """
+        Текст страницы (с 0) списка чата. Номер приводится к допустимому
+        диапазону. Возвращает (номер страницы, число страниц, текст)
+        """
+        records = self.records(chat_id)
+        pages = max((len(records) + self.page_size - 1) // self.page_size, 1)
+        page = min(max(page, 0), pages - 1)
+        with self._lock:
+            current = records is self._records.get(chat_id)
+            text = self._pages[chat_id].get(page) if current else None
+            if text is None:
+                text = self._render(records, page, pages)
+                if current:
+                    self._pages[chat_id][page] = text
+        return page, pages, text
+
+    def _render(self, records, page, pages):
+        start = page * self.page_size
+        response = f"📋 *Все записи* (стр. {page + 1} из {pages}):\n\n"
+        for number, record in enumerate(records[start:start + self.page_size],
+                                        start + 1):
+            response += render_record(number, record)
+
+        response += "✏️ *Для управления:*\n"
+        response += "/edit [номер или ID] - редактировать запись\n"
+        response += "/delete [номер или ID] - удалить запись\n"
+        response += "Например: `/edit 3` или `/delete rec_1a2b3c4d`"
+        return response
+
+class ChatViews:
+    """
+    Последний показанный каждому чату список записей:
+    номер в списке -> запись. Хранится не больше max_chats чатов.
+    """
+
+    def __init__(self, max_chats=MAX_CHAT_VIEWS):
+        self.max_chats = max_chats
+        self._lock = threading.Lock()
+        self._views = collections.OrderedDict()
+
+    def remember(self, chat_id, records):
+        """Запоминает список (records не копируется и не должен меняться)"""
+        with self._lock:
+            self._views[chat_id] = records
+            self._views.move_to_end(chat_id)
+            while len(self._views) > self.max_chats:
+                self._views.popitem(last=False)
+
+    def get(self, chat_id):
+        """Последний показанный чату список или None"""
+        with self._lock:
+            return self._views.get(chat_id)
+
+# Общий кэш списка и последние просмотры чатов
+listing = RecordListing()
+chat_views = ChatViews()
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+logs.py - настройка структурированного логирования
+
+Модули пишут в logging.getLogger(__name__), дополнительные поля
+передаются через extra={...}:
+    log.info("Запись сохранена", extra={"record_id": record_id})
+
+Переменные окружения:
+  LOG_LEVEL  - уровень (по умолчанию INFO)
+  LOG_FORMAT - text (по умолчанию): "время уровень модуль: сообщение ключ=значение"
+               json: одна JSON-строка на событие (для сборщиков логов)
+"""
+import datetime
+import json
+import logging
+import os
+import sys
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+
+# Атрибуты LogRecord, которые не являются полями extra
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "taskName"}
+
+def _extra_fields(record):
+    return {key: value for key, value in vars(record).items()
+            if key not in _STANDARD_ATTRS and not key.startswith("_")}
+
+def _timestamp(record):
+    return (datetime.datetime.fromtimestamp(record.created)
+            .isoformat(timespec="milliseconds"))
+
+class JsonFormatter(logging.Formatter):
+    """Событие лога - одна строка JSON"""
+
+    def format(self, record):
+        entry = {"ts": _timestamp(record), "level": record.levelname,
+                 "logger": record.name, "msg": record.getMessage()}
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Читаемая строка: сообщение и поля extra в виде ключ=значение"""
+
+    def format(self, record):
+        line = f"{_timestamp(record)} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Настраивает корневой логгер (повторный вызов заменяет обработчик)"""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # telebot пишет в свой логгер с собственным обработчиком
+    logging.getLogger("TeleBot").propagate = False
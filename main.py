@@ -1,36 +1,47 @@
 """
 main.py - точка входа в приложение
-Запускает бота и систему напоминаний
+Запускает бота и систему напоминаний (сборка - в app.py)
+
+Режим выбирается переменной окружения BOT_MODE:
+  polling (по умолчанию) - TeleBot + поток напоминаний
+  async                  - AsyncTeleBot, напоминания как задача asyncio
+  webhook                - встроенный HTTP-сервер для webhook (см. webhook.py)
+
+Логи настраиваются в logs.py (LOG_LEVEL, LOG_FORMAT), метрики
+Prometheus отдаются на METRICS_PORT (см. metrics.py).
 """
-from bot_core import run_bot
-import reminders
+from app import Application
+import logging
+import logs
 import os
 import signal
 import sys
 
-def signal_handler(sig, frame):
-    """Обработчик сигналов для корректного завершения"""
-    print("\n🛑 Получен сигнал завершения...")
-    reminders.stop_reminder_system()
-    print("✅ Бот остановлен корректно")
-    sys.exit(0)
+log = logging.getLogger("main")
+
+def main():
+    logs.setup_logging()
 
-if __name__ == "__main__":
-    # Настраиваем обработчики сигналов
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
     # Получаем токен бота
     bot_token = os.environ.get('BOT_TOKEN')
     if not bot_token:
-        print("❌ ОШИБКА: BOT_TOKEN не установлен!")
-        print("⚙️ Установите переменную окружения BOT_TOKEN")
+        log.error("BOT_TOKEN не установлен! Установите переменную окружения BOT_TOKEN")
         sys.exit(1)
-    
-    # Запускаем систему напоминаний
-    print("🔔 Запускаем систему напоминаний...")
-    reminders.init_reminder_system(bot_token)
-    
-    # Запускаем бота
-    print("🚀 Запускаем основного бота...")
-    run_bot()
\ No newline at end of file
+
+    app = Application(bot_token, os.environ.get('BOT_MODE', 'polling').lower())
+
+    def signal_handler(sig, frame):
+        """Обработчик сигналов для корректного завершения"""
+        log.info("Получен сигнал завершения", extra={"signal": sig})
+        app.stop()
+        log.info("Бот остановлен корректно")
+        sys.exit(0)
+
+    # Настраиваем обработчики сигналов
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    app.run()
+
+if __name__ == "__main__":
+    main()
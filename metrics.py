@@ -0,0 +1,304 @@
+"""
+metrics.py - счетчики и гистограммы задержек в формате Prometheus
+
+Метрики живут в памяти процесса и отдаются текстом Prometheus
+(text/plain; version=0.0.4) по адресу http://METRICS_HOST:METRICS_PORT/metrics.
+Обновление метрики - одна блокировка и пара арифметических операций,
+поэтому их можно не выключать в проде.
+
+Переменные окружения:
+  METRICS_PORT - порт сервера метрик (по умолчанию 9100, 0 - не запускать)
+  METRICS_HOST - адрес (по умолчанию 127.0.0.1, только локально)
+"""
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# Границы корзин гистограмм задержек, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+log = logging.getLogger(__name__)
+
+_registry = []
+_registry_lock = threading.Lock()
+_sending = threading.local()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}   # значения меток -> состояние
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name}: ожидались метки {self.labels}")
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = [(key, self._snapshot(state)) for key, state in self._values.items()]
+        for key, state in items:
+            lines.extend(self._render_one(key, state))
+        return lines
+
+    def _snapshot(self, state):
+        return state
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_one(self, key, value):
+        return [f"{self.name}_total{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+class Gauge(_Metric):
+    """
+    Текущее значение. Если задан func, значение без меток
+    вычисляется в момент чтения метрик (например, длина очереди)
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labels=(), func=None):
+        super().__init__(name, documentation, labels)
+        self.func = func
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.func is not None:
+            try:
+                self.set(self.func())
+            except Exception as e:
+                log.warning("Не удалось вычислить метрику", extra={"metric": self.name,
+                                                                   "error": str(e)})
+        return super().render()
+
+    def _render_one(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+class Histogram(_Metric):
+    """Распределение величин (обычно задержек в секундах) по корзинам"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счетчики корзин..., +Inf], сумма, количество
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Контекстный менеджер: замеряет длительность блока"""
+        return _Timer(self, labels)
+
+    def _snapshot(self, state):
+        return list(state[0]), state[1], state[2]
+
+    def _render_one(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} "
+                         f"{cumulative}")
+        labels = _format_labels(self.labels, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+def instrument(histogram, errors, label):
+    """
+    Декоратор: время вызова функции - в histogram, исключения - в errors,
+    с меткой label = имя функции
+    """
+    def decorator(func):
+        labels = {label: func.__name__}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+def timed_send(send_func, source):
+    """
+    Оборачивает функцию отправки (обычно bot.send_message): время вызова -
+    в telegram_send_seconds, исход (ok/error) - в telegram_sends.
+    Вложенные замеры не считаются: очередь напоминаний отправляет через
+    тот же клиент, что и обработчики, и отправка учитывается один раз
+    с источником внешней обертки.
+    """
+    @functools.wraps(send_func)
+    def send(*args, **kwargs):
+        if getattr(_sending, "active", False):
+            return send_func(*args, **kwargs)
+        _sending.active = True
+        start = time.perf_counter()
+        try:
+            result = send_func(*args, **kwargs)
+        except Exception:
+            SENDS.inc(source=source, result="error")
+            raise
+        finally:
+            _sending.active = False
+            SEND_SECONDS.observe(time.perf_counter() - start, source=source)
+        SENDS.inc(source=source, result="ok")
+        return result
+    return send
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# ---------- HTTP ----------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    Запускает сервер метрик в фоновом потоке.
+    Возвращает сервер или None, если порт 0 или занят
+    """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        log.warning("Сервер метрик не запущен", extra={"port": port, "error": str(e)})
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("Сервер метрик запущен", extra={"address": f"http://{host}:{port}/metrics"})
+    return server
+
+# ---------- метрики бота ----------
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds",
+                            "Длительность обработчиков сообщений", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors",
+                         "Исключения в обработчиках сообщений", ("handler",))
+UPDATES = Counter("bot_updates", "Полученные обновления Telegram")
+STARTUP_SECONDS = Gauge("bot_startup_phase_seconds",
+                        "Длительность этапов запуска", ("phase",))
+
+DB_SECONDS = Histogram("db_operation_seconds",
+                       "Длительность операций с хранилищем", ("operation",))
+DB_ERRORS = Counter("db_operation_errors",
+                    "Ошибки операций с хранилищем", ("operation",))
+ARCHIVED_RECORDS = Counter("records_archived", "Записи, перенесенные в архив")
+
+REMINDER_PASS_SECONDS = Histogram("reminder_pass_seconds",
+                                  "Длительность проходов системы напоминаний",
+                                  ("stage",))
+REMINDER_RECORDS_SCANNED = Counter("reminder_records_scanned",
+                                   "Записи, просмотренные при построении расписания")
+REMINDERS_DUE = Counter("reminders_due", "Наступившие напоминания", ("kind",))
+REMINDERS_SENT = Counter("reminders_sent", "Отправленные напоминания", ("kind",))
+REMINDERS_FAILED = Counter("reminders_failed", "Неотправленные напоминания", ("kind",))
+REMINDER_LAG_SECONDS = Histogram("reminder_lag_seconds",
+                                 "Отставание обработки напоминания от срока",
+                                 buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+
+SEND_SECONDS = Histogram("telegram_send_seconds",
+                         "Длительность вызовов send_message", ("source",))
+SENDS = Counter("telegram_sends", "Вызовы send_message", ("source", "result"))
+SEND_RETRIES = Counter("telegram_send_retries", "Повторы отправки после ошибок")
@@ -1,187 +1,436 @@
 """
 reminders.py - система напоминаний клиентам
+
+Напоминания планируются по куче (heapq) моментов отправки: за день
+и за 2 часа до каждой записи. Поток спит ровно до ближайшего момента
+и будится условной переменной, когда записи сохраняются, меняются
+или удаляются (database.add_change_listener).
+
+Отправленные напоминания хранятся в журнале (database.save_reminder_status)
+и один раз загружаются в память множеством (id записи, вид, время записи):
+после переноса записи на другое время напоминания уйдут заново.
+Статусы прошедших записей периодически удаляются.
+
+Каждый проход (загрузка журнала, построение расписания, чистка,
+обработка наступившего напоминания) замеряется в metrics.py, вместе
+с числом просмотренных записей и отставанием отправки от срока.
 """
+import asyncio
 import datetime
+import heapq
+import itertools
+import logging
 import threading
-import time
-from database import load_all_records, update_record_field
-import telebot
+from database import load_all_records, get_record
+import database
+import dates
+from booking import from_epoch, to_epoch
+import api_client
+from dispatcher import MessageDispatcher, retry_delay
+import metrics
+import queue
 import os
 
+# Виды напоминаний: (за сколько до записи отправлять,
+#                    сколько минимум должно оставаться до записи)
+REMINDER_KINDS = {
+    "day": (datetime.timedelta(hours=24), datetime.timedelta(hours=23)),
+    "hour": (datetime.timedelta(hours=2), datetime.timedelta(hours=1, minutes=30)),
+}
+
+# То же в секундах - для сравнения с Booking.starts_at
+_KIND_SECONDS = {kind: (int(before.total_seconds()), int(min_left.total_seconds()))
+                 for kind, (before, min_left) in REMINDER_KINDS.items()}
+
+# Максимальный сон: страховка от перевода системных часов
+MAX_SLEEP_SECONDS = 3600
+
+# Как часто чистить статусы напоминаний прошедших записей
+PRUNE_INTERVAL = datetime.timedelta(hours=6)
+
+# Через сколько повторить напоминание, которое не удалось отправить
+# (после всех повторов диспетчера) из-за временной ошибки
+RETRY_DELAY = datetime.timedelta(minutes=5)
+
+log = logging.getLogger(__name__)
+
 class ReminderSystem:
-    def __init__(self, bot_token):
+    def __init__(self, bot_token, bot=None, dispatcher=None):
         """
         Инициализация системы напоминаний
         bot_token - токен бота для отправки сообщений
+        bot - готовый клиент с методом send_message (например, мост
+              к AsyncTeleBot); по умолчанию - общий клиент бота
+              (api_client.get_bot)
+        dispatcher - общая очередь отправки; по умолчанию - очередь
+              api_client.get_dispatcher, а с собственным bot - своя
+              очередь, которая останавливается вместе с напоминаниями
         """
-        self.bot = telebot.TeleBot(bot_token)
+        self.bot = bot or api_client.get_bot(bot_token)
+        self._own_dispatcher = dispatcher is None and bot is not None
+        if dispatcher is None:
+            dispatcher = (MessageDispatcher(self.bot.send_message) if bot is not None
+                          else api_client.get_dispatcher(bot_token))
+        self.dispatcher = dispatcher
         self.running = False
         self.thread = None
-    
+        self._cond = threading.Condition()
+        self._heap = []          # (момент отправки, порядковый №, id записи, вид, версия)
+        self._versions = {}      # id записи -> версия расписания
+        self._counter = itertools.count()
+        self._sent = set()       # (id записи, вид, время записи) отправленных
+        self._next_prune = datetime.datetime.now()
+        self._async_wakeup = None  # asyncio.Event в async-режиме
+        self._loop = None
+
     def start(self):
         """Запуск системы напоминаний в отдельном потоке"""
         if self.running:
-            print("⚠️ Система напоминаний уже запущена")
+            log.warning("Система напоминаний уже запущена")
             return
-        
-        self.running = True
+
+        self._prepare()
         self.thread = threading.Thread(target=self._reminder_loop, daemon=True)
         self.thread.start()
-        print("🔔 Система напоминаний запущена")
-    
+        log.info("Система напоминаний запущена")
+
+    async def run_async(self):
+        """
+        Запуск системы напоминаний как задачи asyncio (async-режим).
+        Работа с хранилищем выполняется вне цикла событий.
+        """
+        if self.running:
+            log.warning("Система напоминаний уже запущена")
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._async_wakeup = asyncio.Event()
+        await asyncio.to_thread(self._prepare)
+        log.info("Система напоминаний запущена (asyncio)")
+        while self.running:
+            with self._cond:
+                item, delay = self._next_due()
+            if item is None:
+                try:
+                    await asyncio.wait_for(self._async_wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._async_wakeup.clear()
+                continue
+            try:
+                await asyncio.to_thread(self._handle_item, item)
+            except Exception:
+                log.exception("Ошибка в системе напоминаний")
+
+    def _prepare(self):
+        """Общая подготовка: журнал, очередь отправки, расписание"""
+        self.running = True
+        self._load_ledger()
+        self.dispatcher.start()
+        database.add_change_listener(self.reschedule)
+        self._schedule_all()
+
+    def _wake(self):
+        """Будит цикл напоминаний (вызывается под self._cond)"""
+        self._cond.notify_all()
+        if self._async_wakeup is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._async_wakeup.set)
+
     def stop(self):
         """Остановка системы напоминаний"""
-        self.running = False
+        database.remove_change_listener(self.reschedule)
+        with self._cond:
+            self.running = False
+            self._wake()
         if self.thread:
             self.thread.join(timeout=5)
-        print("🔔 Система напоминаний остановлена")
-    
+        if self._own_dispatcher:
+            self.dispatcher.stop()
+        log.info("Система напоминаний остановлена")
+
+    # ---------- журнал отправленных ----------
+
+    def _load_ledger(self):
+        """Загружает отметки об отправленных напоминаниях в память"""
+        with metrics.REMINDER_PASS_SECONDS.time(stage="load_ledger"):
+            self._sent = self._read_ledger()
+        log.info("Загружены отметки о напоминаниях", extra={"sent": len(self._sent)})
+
+    def _read_ledger(self):
+        sent = set()
+        for record_id, status in database.load_all_reminder_statuses().items():
+            for kind in REMINDER_KINDS:
+                if not status.get(f"{kind}_reminder_sent"):
+                    continue
+                appointment = status.get(f"{kind}_reminder_for")
+                if appointment is None:
+                    # Старые отметки без времени относим к текущему времени записи
+                    record = get_record(record_id)
+                    starts_at = record.starts_at if record else None
+                else:
+                    starts_at = to_epoch(dates.from_iso(appointment))
+                sent.add((record_id, kind, starts_at))
+        return sent
+
+    def _prune_ledger(self):
+        """Удаляет отметки прошедших и удаленных записей"""
+        with metrics.REMINDER_PASS_SECONDS.time(stage="prune"):
+            removed = database.prune_reminder_statuses()
+            if removed:
+                live = database.load_all_reminder_statuses()
+                with self._cond:
+                    self._sent = {item for item in self._sent if item[0] in live}
+        if removed:
+            log.info("Удалены статусы напоминаний", extra={"removed": removed})
+
+    # ---------- расписание ----------
+
+    def _schedule_all(self):
+        """Строит очередь напоминаний по всем записям"""
+        with metrics.REMINDER_PASS_SECONDS.time(stage="schedule_all"):
+            records = load_all_records()
+            now = to_epoch(datetime.datetime.now())
+            with self._cond:
+                self._heap.clear()
+                self._versions.clear()
+                for record in records:
+                    self._schedule_record(record, now)
+                self._wake()
+        metrics.REMINDER_RECORDS_SCANNED.inc(len(records))
+        log.info("Напоминания запланированы", extra={"scheduled": len(self._heap),
+                                                     "records": len(records)})
+
+    def reschedule(self, record_id, chat_id=None):
+        """
+        Пересчитывает напоминания одной записи после ее изменения
+        (запись читается из раздела ее чата).
+        Старые элементы кучи не удаляются, а устаревают по версии.
+        """
+        record = get_record(record_id)
+        with self._cond:
+            if record is None:
+                self._versions.pop(record_id, None)
+            else:
+                self._versions[record_id] = self._versions.get(record_id, 0) + 1
+                self._schedule_record(record)
+            self._wake()
+
+    def _schedule_record(self, record, now=None):
+        """
+        Кладет в кучу будущие напоминания записи (под self._cond)
+        now - текущий момент в секундах (to_epoch), по умолчанию сейчас
+        """
+        starts_at = record.starts_at
+        if starts_at is None:
+            return
+        if now is None:
+            now = to_epoch(datetime.datetime.now())
+        for kind, (before, min_left) in _KIND_SECONDS.items():
+            # Окно напоминания прошло или уже отправлено
+            if (starts_at - min_left <= now
+                    or (record.id, kind, starts_at) in self._sent):
+                continue
+            version = self._versions.setdefault(record.id, 0)
+            heapq.heappush(self._heap, (from_epoch(starts_at - before), next(self._counter),
+                                        record.id, kind, version))
+
+    @staticmethod
+    def _sent_key(record, kind):
+        return record.id, kind, record.starts_at
+
+    # ---------- основной цикл ----------
+
     def _reminder_loop(self):
-        """Основной цикл проверки напоминаний"""
-        while self.running:
+        """Основной цикл: ждет ближайшего напоминания и отправляет его"""
+        while True:
+            with self._cond:
+                item = self._wait_next_due()
+                if item is None:
+                    return
             try:
-                self._check_and_send_reminders()
-                time.sleep(60)  # Проверяем каждую минуту
-            except Exception as e:
-                print(f"❌ Ошибка в системе напоминаний: {e}")
-                time.sleep(300)  # При ошибке ждем 5 минут
-    
-    def _check_and_send_reminders(self):
-        """Проверяет и отправляет напоминания"""
-        now = datetime.datetime.now()
-        records = load_all_records()
-        
-        for record in records:
-            self._check_record_for_reminders(record, now)
-    
-    def _check_record_for_reminders(self, record, now):
-        """
-        Проверяет одну запись на необходимость напоминаний
+                self._handle_item(item)
+            except Exception:
+                log.exception("Ошибка в системе напоминаний")
+
+    def _handle_item(self, item):
+        if item == "prune":
+            self._prune_ledger()
+        else:
+            self._process_due(*item)
+
+    def _wait_next_due(self):
         """
-        try:
-            # Получаем дату и время записи
-            date_str = record["client"].get("date", "")
-            if not date_str or " в " not in date_str:
-                return
-            
-            # Парсим дату и время (формат: "25.12 в 15:00")
-            date_part, time_part = date_str.split(" в ")
-            day, month = map(int, date_part.split("."))
-            hour, minute = map(int, time_part.split(":"))
-            
-            # Создаем объект datetime записи
-            current_year = now.year
-            record_datetime = datetime.datetime(
-                current_year, month, day, hour, minute
+        Ждет под self._cond, пока подойдет время ближайшего напоминания.
+        Возвращает то же, что _next_due, или None при остановке.
+        """
+        while self.running:
+            item, delay = self._next_due()
+            if item is not None:
+                return item
+            self._cond.wait(delay)
+        return None
+
+    def _next_due(self):
+        """
+        Достает из очереди наступившее дело (под self._cond):
+        (id записи, вид, срок) или "prune", когда пора чистить журнал.
+        Если ничего не наступило - возвращает (None, сколько секунд ждать).
+        """
+        while True:
+            now = datetime.datetime.now()
+            if now >= self._next_prune:
+                self._next_prune = now + PRUNE_INTERVAL
+                return "prune", 0
+            wake_at = self._next_prune
+            if self._heap:
+                due, _, record_id, kind, version = self._heap[0]
+                if version != self._versions.get(record_id):
+                    heapq.heappop(self._heap)
+                    continue
+                if due <= now:
+                    heapq.heappop(self._heap)
+                    return (record_id, kind, due), 0
+                wake_at = min(wake_at, due)
+            return None, min((wake_at - now).total_seconds(), MAX_SLEEP_SECONDS)
+
+    def _process_due(self, record_id, kind, due):
+        """Проверяет, что напоминание еще актуально, и отправляет его"""
+        metrics.REMINDERS_DUE.inc(kind=kind)
+        metrics.REMINDER_LAG_SECONDS.observe(
+            max((datetime.datetime.now() - due).total_seconds(), 0))
+        with metrics.REMINDER_PASS_SECONDS.time(stage="due"):
+            self._send_if_actual(record_id, kind)
+
+    def _send_if_actual(self, record_id, kind):
+        record = get_record(record_id)
+        if record is None:
+            return
+        record_datetime = record.appointment
+        if record_datetime is None:
+            return
+        time_left = record_datetime - datetime.datetime.now()
+        if time_left < REMINDER_KINDS[kind][1]:
+            return  # Опоздали: окно напоминания уже прошло
+
+        if kind == "day":
+            self._check_one_day_reminder(record, record_datetime)
+        else:
+            self._check_two_hours_reminder(record, record_datetime)
+
+    def _check_one_day_reminder(self, record, record_datetime):
+        """
+        Отправляет напоминание за день
+        """
+        reminder_sent = self._sent_key(record, "day") in self._sent
+
+        if not reminder_sent:
+            self._send_reminder(
+                record, "day",
+                "📅 *Напоминание за день!*\n\n"
+                f"Завтра в {record_datetime.strftime('%H:%M')} у вас запись:\n"
+                f"👤 *{record.name}*\n"
+                f"📞 {record.phone}\n"
+                f"💇 {record.service}"
             )
-            
-            # Проверяем что запись в будущем
-            if record_datetime <= now:
-                return
-            
-            # Вычисляем разницу во времени
-            time_diff = record_datetime - now
-            
-            # Проверяем условия для напоминаний
-            self._check_one_day_reminder(record, time_diff, record_datetime)
-            self._check_two_hours_reminder(record, time_diff, record_datetime)
-            
-        except Exception as e:
-            print(f"❌ Ошибка при проверке записи {record.get('id')}: {e}")
-    
-    def _check_one_day_reminder(self, record, time_diff, record_datetime):
-        """
-        Проверяет и отправляет напоминание за день
-        """
-        # Если до записи осталось от 23 до 25 часов
-        if datetime.timedelta(hours=23) <= time_diff <= datetime.timedelta(hours=25):
-            reminder_sent = record.get("day_reminder_sent", False)
-            
-            if not reminder_sent:
-                self._send_reminder(
-                    record,
-                    "📅 *Напоминание за день!*\n\n"
-                    f"Завтра в {record_datetime.strftime('%H:%M')} у вас запись:\n"
-                    f"👤 *{record['client']['name']}*\n"
-                    f"📞 {record['client']['phone']}\n"
-                    f"💇 {record['client']['service']}"
-                )
-                # Отмечаем что напоминание отправлено
-                self._mark_reminder_sent(record["id"], "day")
-    
-    def _check_two_hours_reminder(self, record, time_diff, record_datetime):
-        """
-        Проверяет и отправляет напоминание за 2 часа
-        """
-        # Если до записи осталось от 1.5 до 2.5 часов
-        if datetime.timedelta(hours=1, minutes=30) <= time_diff <= datetime.timedelta(hours=2, minutes=30):
-            reminder_sent = record.get("hour_reminder_sent", False)
-            
-            if not reminder_sent:
-                self._send_reminder(
-                    record,
-                    "⏰ *Напоминание за 2 часа!*\n\n"
-                    f"Через 2 часа ({record_datetime.strftime('%H:%M')}) у вас запись:\n"
-                    f"👤 *{record['client']['name']}*\n"
-                    f"📞 {record['client']['phone']}\n"
-                    f"💇 {record['client']['service']}"
-                )
-                # Отмечаем что напоминание отправлено
-                self._mark_reminder_sent(record["id"], "hour")
-    
-    def _send_reminder(self, record, message):
-        """
-        Отправляет напоминание в чат
+
+    def _check_two_hours_reminder(self, record, record_datetime):
         """
-        try:
-            chat_id = record.get("chat_id")
-            if chat_id:
-                self.bot.send_message(chat_id, message, parse_mode='Markdown')
-                print(f"🔔 Отправлено напоминание для записи {record.get('id')}")
-        except Exception as e:
-            print(f"❌ Ошибка отправки напоминания: {e}")
-    
-    def _mark_reminder_sent(self, record_id, reminder_type):
-        """
-        Отмечает что напоминание отправлено
-        Для простоты будем хранить в отдельном файле
+        Отправляет напоминание за 2 часа
+        """
+        reminder_sent = self._sent_key(record, "hour") in self._sent
+
+        if not reminder_sent:
+            self._send_reminder(
+                record, "hour",
+                "⏰ *Напоминание за 2 часа!*\n\n"
+                f"Через 2 часа ({record_datetime.strftime('%H:%M')}) у вас запись:\n"
+                f"👤 *{record.name}*\n"
+                f"📞 {record.phone}\n"
+                f"💇 {record.service}"
+            )
+
+    def _send_reminder(self, record, reminder_type, message):
+        """
+        Ставит напоминание в очередь отправки. В памяти оно отмечается
+        сразу (чтобы не поставить дважды), в журнал - после отправки.
         """
+        chat_id = record.chat_id
+        if not chat_id:
+            return
+        key = self._sent_key(record, reminder_type)
+        with self._cond:
+            self._sent.add(key)
         try:
-            # Создаем или обновляем файл с отметками о напоминаниях
-            reminders_file = "reminders_sent.json"
-            reminders = {}
-            
-            try:
-                import json
-                with open(reminders_file, "r", encoding="utf-8") as f:
-                    reminders = json.load(f)
-            except FileNotFoundError:
-                pass
-            
-            # Добавляем отметку
-            if record_id not in reminders:
-                reminders[record_id] = {}
-            
-            reminders[record_id][f"{reminder_type}_reminder_sent"] = True
-            reminders[record_id][f"{reminder_type}_reminder_time"] = datetime.datetime.now().isoformat()
-            
-            # Сохраняем
-            with open(reminders_file, "w", encoding="utf-8") as f:
-                json.dump(reminders, f, ensure_ascii=False, indent=2)
-                
-        except Exception as e:
-            print(f"❌ Ошибка сохранения отметки о напоминании: {e}")
+            future = self.dispatcher.submit(chat_id, message, timeout=30,
+                                            source="reminders", parse_mode='Markdown')
+        except queue.Full:
+            metrics.REMINDERS_FAILED.inc(kind=reminder_type)
+            log.error("Очередь отправки переполнена, напоминание отложено",
+                      extra={"record_id": record.id, "kind": reminder_type})
+            with self._cond:
+                self._sent.discard(key)
+            self._retry_later(record.id, reminder_type)
+            return
+
+        def on_done(future):
+            error = future.exception()
+            if error is not None:
+                metrics.REMINDERS_FAILED.inc(kind=reminder_type)
+                log.error("Ошибка отправки напоминания",
+                          extra={"record_id": record.id, "kind": reminder_type,
+                                 "error": str(error)})
+                with self._cond:
+                    self._sent.discard(key)
+                # 400, 403 (бот заблокирован) и т.п. повторять бессмысленно
+                if retry_delay(error, 0) is not None:
+                    self._retry_later(record.id, reminder_type)
+                return
+            metrics.REMINDERS_SENT.inc(kind=reminder_type)
+            log.info("Отправлено напоминание",
+                     extra={"record_id": record.id, "kind": reminder_type})
+            self._mark_reminder_sent(record, reminder_type)
+
+        future.add_done_callback(on_done)
+
+    def _retry_later(self, record_id, kind, delay=RETRY_DELAY):
+        """
+        Возвращает напоминание в очередь через delay. Когда срок
+        наступит, оно снова проверяется: окно могло уже пройти,
+        а запись - измениться или удалиться
+        """
+        with self._cond:
+            version = self._versions.get(record_id)
+            if version is None:
+                return  # Запись удалена
+            heapq.heappush(self._heap, (datetime.datetime.now() + delay,
+                                        next(self._counter), record_id, kind, version))
+            self._wake()
+        log.info("Напоминание будет отправлено повторно",
+                 extra={"record_id": record_id, "kind": kind,
+                        "delay": delay.total_seconds()})
+
+    def _mark_reminder_sent(self, record, reminder_type):
+        """
+        Отмечает что напоминание отправлено дописыванием строки
+        в журнал статусов
+        """
+        status = database.load_reminder_status(record.id)
+        status[f"{reminder_type}_reminder_sent"] = True
+        status[f"{reminder_type}_reminder_time"] = datetime.datetime.now().isoformat()
+        status[f"{reminder_type}_reminder_for"] = record.appointment_iso
+        database.save_reminder_status(record.id, status)
 
 # Глобальный экземпляр системы напоминаний
 reminder_system = None
 
-def init_reminder_system(bot_token):
+def init_reminder_system(bot_token, dispatcher=None):
     """
     Инициализирует и запускает систему напоминаний
+    dispatcher - общая очередь отправки (см. ReminderSystem)
     """
     global reminder_system
     if not reminder_system:
-        reminder_system = ReminderSystem(bot_token)
+        reminder_system = ReminderSystem(bot_token, dispatcher=dispatcher)
         reminder_system.start()
     return reminder_system
 
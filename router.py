@@ -0,0 +1,94 @@
+"""
+router.py - выбор обработчика текстового сообщения за один шаг
+
+Вместо цепочки @bot.message_handler(func=lambda ...), где каждое
+сообщение по очереди проверяется каждым фильтром (и каждый фильтр
+состояния заново ищет сессию чата), обработчики лежат в словаре
+по ключу (состояние, текст кнопки или /команда). В telebot
+регистрируется один обработчик - MessageRouter.dispatch.
+
+Порядок выбора:
+  1. команда или кнопка меню - в любом состоянии;
+  2. обработчик текущего состояния диалога;
+  3. обработчик по умолчанию.
+В цепочке фильтров было иначе: /delete и /edit стояли после
+обработчиков шагов записи (ADDING_*), и, например, "/delete",
+введенное вместо имени клиента, сохранялось как имя. Теперь любая
+команда выполняется в любом состоянии, а начатый диалог остается
+в своем шаге.
+
+Время и исключения каждого обработчика попадают в метрики
+bot_handler_seconds и bot_handler_errors (метка handler - имя функции).
+"""
+from telebot import util
+
+import metrics
+
+ANY = object()  # ключ "любое состояние" / "любой текст"
+
+def _instrumented(handler):
+    return metrics.instrument(metrics.HANDLER_SECONDS, metrics.HANDLER_ERRORS,
+                              "handler")(handler)
+
+class MessageRouter:
+    """
+    Таблица обработчиков текстовых сообщений
+    state_func(chat_id) - текущее состояние диалога чата или None
+    """
+
+    def __init__(self, state_func):
+        self.state_func = state_func
+        self._routes = {}   # (состояние или ANY, текст/команда или ANY) -> обработчик
+        self._default = None
+
+    def route(self, state, key):
+        """Декоратор: обработчик для пары (состояние, текст или /команда)"""
+        def decorator(handler):
+            if (state, key) in self._routes:
+                raise ValueError(f"Маршрут уже занят: {key}")
+            self._routes[(state, key)] = _instrumented(handler)
+            return handler
+        return decorator
+
+    def command(self, name):
+        """Обработчик команды /name в любом состоянии"""
+        return self.route(ANY, "/" + name)
+
+    def text(self, text):
+        """Обработчик кнопки (точного текста) в любом состоянии"""
+        return self.route(ANY, text)
+
+    def state(self, state):
+        """Обработчик любого текста в состоянии диалога state"""
+        return self.route(state, ANY)
+
+    def default(self, handler):
+        """Обработчик сообщений, для которых нет маршрута"""
+        self._default = _instrumented(handler)
+        return handler
+
+    @staticmethod
+    def key(text):
+        """Ключ сообщения: "/команда" (без @имя_бота) или сам текст"""
+        command = util.extract_command(text)
+        return "/" + command if command is not None else text
+
+    def resolve(self, message):
+        """Обработчик для сообщения (или обработчик по умолчанию)"""
+        routes = self._routes
+        key = self.key(message.text or "")
+        handler = routes.get((ANY, key))
+        if handler is None:
+            state = self.state_func(message.chat.id)
+            if state is not None:
+                handler = routes.get((state, key)) or routes.get((state, ANY))
+        return handler or self._default
+
+    def dispatch(self, message):
+        handler = self.resolve(message)
+        if handler is not None:
+            handler(message)
+
+    def register(self, bot):
+        """Регистрирует маршрутизатор в telebot одним обработчиком"""
+        bot.register_message_handler(self.dispatch, content_types=["text"])
@@ -0,0 +1,194 @@
+"""
+schedule.py - занятость времени: пересечения записей и свободные окна
+
+Для каждого чата (мастера) строится индекс интервалов записей
+[начало, начало + длительность услуги), отсортированный по началу.
+Длительность услуги не больше MAX_DURATION, поэтому пересечения
+с интервалом ищутся бинарным поиском и просмотром только соседей,
+начинающихся не раньше чем за MAX_DURATION, - без обхода всей истории.
+Индекс чата строится при первом запросе и дальше обновляется по
+изменениям записей (database.add_change_listener).
+
+Переменные окружения:
+  SERVICE_DURATIONS       - длительности услуг в минутах,
+                            например "стрижка=60;окрашивание=120"
+  DEFAULT_SERVICE_MINUTES - длительность остальных услуг (по умолчанию 60)
+  WORK_DAY_START, WORK_DAY_END - рабочие часы для свободных окон
+                            (по умолчанию 10:00 и 20:00)
+"""
+import bisect
+import datetime
+import os
+import threading
+
+import database as db
+
+DEFAULT_SERVICE_DURATIONS = {
+    "стрижка": 60,
+    "окрашивание": 120,
+    "маникюр": 90,
+    "педикюр": 90,
+}
+
+def _parse_durations(text):
+    """"стрижка=60;окрашивание=120" -> {"стрижка": 60, ...}"""
+    durations = {}
+    for item in text.split(";"):
+        name, _, minutes = item.partition("=")
+        if name.strip() and minutes.strip().isdigit():
+            durations[name.strip().lower()] = int(minutes)
+    return durations
+
+def _parse_time(text):
+    hour, minute = text.split(":")
+    return datetime.time(int(hour), int(minute))
+
+SERVICE_DURATIONS = dict(DEFAULT_SERVICE_DURATIONS,
+                         **_parse_durations(os.environ.get("SERVICE_DURATIONS", "")))
+DEFAULT_SERVICE_MINUTES = int(os.environ.get("DEFAULT_SERVICE_MINUTES", "60"))
+WORK_DAY_START = _parse_time(os.environ.get("WORK_DAY_START", "10:00"))
+WORK_DAY_END = _parse_time(os.environ.get("WORK_DAY_END", "20:00"))
+
+MAX_DURATION = datetime.timedelta(
+    minutes=max([DEFAULT_SERVICE_MINUTES, *SERVICE_DURATIONS.values()]))
+
+# Свободные окна сегодняшнего дня начинаются не раньше текущего
+# времени, округленного вверх до стольких минут
+SLOT_STEP_MINUTES = 15
+
+def service_duration(service):
+    """Длительность услуги (timedelta) по ее названию"""
+    minutes = SERVICE_DURATIONS.get((service or "").strip().lower(),
+                                    DEFAULT_SERVICE_MINUTES)
+    return datetime.timedelta(minutes=minutes)
+
+def record_interval(record):
+    """(начало, конец) записи или None, если время не распознано"""
+    start = record.appointment
+    if start is None:
+        return None
+    return start, start + service_duration(record.service)
+
+class ChatIntervals:
+    """Интервалы записей одного чата, отсортированные по началу"""
+
+    def __init__(self, records=()):
+        self._by_id = {}      # id записи -> (начало, конец, id)
+        for record in records:
+            interval = record_interval(record)
+            if interval is not None:
+                self._by_id[record.id] = (*interval, record.id)
+        self._items = sorted(self._by_id.values())   # по возрастанию начала
+        self._starts = [item[0] for item in self._items]
+
+    def add(self, record):
+        interval = record_interval(record)
+        if interval is None:
+            return
+        item = (*interval, record.id)
+        index = bisect.bisect_right(self._items, item)
+        self._items.insert(index, item)
+        self._starts.insert(index, item[0])
+        self._by_id[record.id] = item
+
+    def remove(self, record_id):
+        item = self._by_id.pop(record_id, None)
+        if item is None:
+            return
+        index = bisect.bisect_left(self._items, item)
+        del self._items[index]
+        del self._starts[index]
+
+    def overlapping(self, start, end):
+        """Интервалы, пересекающиеся с [start, end), по возрастанию начала"""
+        # Начинаются раньше end, но не раньше start - MAX_DURATION
+        hi = bisect.bisect_left(self._starts, end)
+        lo = bisect.bisect_left(self._starts, start - MAX_DURATION)
+        return [item for item in self._items[lo:hi] if item[1] > start]
+
+    def __len__(self):
+        return len(self._items)
+
+class ScheduleIndex:
+    """Индексы интервалов записей по чатам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chats = {}   # chat_id -> ChatIntervals
+        db.add_change_listener(self.on_change)
+
+    def on_change(self, record_id, chat_id):
+        """Обновляет индекс чата после изменения записи"""
+        record = db.get_record(record_id)
+        with self._lock:
+            intervals = self._chats.get(chat_id)
+            if intervals is None:
+                return  # Индекс чата еще не строился
+            intervals.remove(record_id)
+            if record is not None:
+                intervals.add(record)
+
+    def _intervals(self, chat_id):
+        with self._lock:
+            intervals = self._chats.get(chat_id)
+            if intervals is None:
+                intervals = ChatIntervals(db.get_chat_records(chat_id))
+                self._chats[chat_id] = intervals
+            return intervals
+
+    def conflicts(self, chat_id, start, service, exclude=None):
+        """
+        Записи чата, пересекающиеся с услугой service, начинающейся в start
+        exclude - ID записи, которую не учитывать (при ее редактировании)
+        """
+        intervals = self._intervals(chat_id)
+        with self._lock:
+            items = intervals.overlapping(start, start + service_duration(service))
+        records = (db.get_record(record_id) for _, _, record_id in items
+                   if record_id != exclude)
+        return [record for record in records
+                if record is not None and record_interval(record) is not None]
+
+    def free_slots(self, chat_id, day, now=None):
+        """
+        Свободные окна чата в рабочие часы дня day (date):
+        список (начало, конец). Прошедшее время не предлагается:
+        для сегодняшнего дня окна начинаются с текущего момента
+        (now, по умолчанию - сейчас), для прошедших дней их нет
+        """
+        now = now or datetime.datetime.now()
+        day_start = max(datetime.datetime.combine(day, WORK_DAY_START), _round_up(now))
+        day_end = datetime.datetime.combine(day, WORK_DAY_END)
+        if day_start >= day_end:
+            return []
+        intervals = self._intervals(chat_id)
+        with self._lock:
+            busy = intervals.overlapping(day_start, day_end)
+        slots = []
+        cursor = day_start
+        for start, end, _ in busy:
+            if start > cursor:
+                slots.append((cursor, min(start, day_end)))
+            cursor = max(cursor, end)
+        if cursor < day_end:
+            slots.append((cursor, day_end))
+        return slots
+
+def _round_up(moment):
+    """Момент, округленный вверх до SLOT_STEP_MINUTES минут"""
+    step = datetime.timedelta(minutes=SLOT_STEP_MINUTES)
+    hour = moment.replace(minute=0, second=0, microsecond=0)
+    steps = -(-(moment - hour) // step)   # деление с округлением вверх
+    return hour + steps * step
+
+def format_conflicts(records):
+    """Предупреждение о пересечениях для оператора"""
+    lines = ["⚠️ *Время пересекается с записями:*"]
+    for record in records:
+        start, end = record_interval(record)
+        lines.append(f"• {start.strftime('%H:%M')}–{end.strftime('%H:%M')} "
+                     f"{record.name} ({record.service})")
+    return "\n".join(lines)
+
+# Общий индекс занятости
+schedule = ScheduleIndex()
@@ -0,0 +1,376 @@
+"""
+sqlite_store.py - хранилище записей в SQLite (stdlib sqlite3, режим WAL)
+
+Включается переменной окружения STORAGE_BACKEND=sqlite.
+Реализует тот же интерфейс, что и database.RecordStore.
+Данные чатов разделены составными индексами (chat_id, ...): список
+и записи на дату одного чата читаются только из его части индекса.
+При первом открытии базы один раз импортирует JSON-записи
+(clients/ или старый clients.json) и reminders_sent.json, если они есть.
+
+Ручной запуск миграции:
+    python sqlite_store.py migrate
+"""
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+from booking import Booking, parse_timestamp
+import database
+import dates
+
+log = logging.getLogger(__name__)
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "salon.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    seq       INTEGER PRIMARY KEY AUTOINCREMENT,
+    id        TEXT NOT NULL UNIQUE,
+    chat_id   INTEGER,
+    timestamp TEXT,
+    date_key  TEXT,
+    starts_at TEXT,
+    client    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_records_chat_seq ON records(chat_id, seq);
+CREATE INDEX IF NOT EXISTS idx_records_date ON records(date_key);
+CREATE TABLE IF NOT EXISTS reminders (
+    record_id TEXT PRIMARY KEY,
+    status    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def _row_to_record(row):
+    record_id, chat_id, timestamp, client = row
+    return Booking.from_dict({
+        "id": record_id,
+        "chat_id": chat_id,
+        "timestamp": timestamp,
+        "client": json.loads(client)
+    })
+
+def _record_row(record):
+    """Booking -> (id, chat_id, timestamp, date_key, starts_at, client)"""
+    return (record.id, record.chat_id, record.timestamp_iso, record.day,
+            record.appointment_iso,
+            json.dumps(record.client_fields(), ensure_ascii=False))
+
+class SqliteRecordStore:
+    """Хранилище записей в SQLite с тем же интерфейсом, что RecordStore"""
+
+    COLUMNS = "id, chat_id, timestamp, client"
+
+    def __init__(self, path=SQLITE_PATH, clients_path=database.CLIENTS_FILE,
+                 reminders_path=database.REMINDERS_FILE,
+                 clients_dir=database.CLIENTS_DIR):
+        self.path = path
+        self.clients_path = clients_path
+        self.clients_dir = clients_dir
+        self.reminders_path = reminders_path
+        self._lock = threading.RLock()
+        self._conn = None
+
+    # ---------- подключение ----------
+
+    def load(self, migrate=True):
+        """Открывает базу, создает схему и при необходимости мигрирует JSON"""
+        with self._lock:
+            if self._conn is not None:
+                return
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            self._upgrade_schema()
+            if migrate and not self._meta("json_migrated"):
+                self.migrate_from_json()
+            count = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            log.info("SQLite: записи загружены", extra={"records": count,
+                                                        "path": self.path})
+
+    def _db(self):
+        if self._conn is None:
+            self.load()
+        return self._conn
+
+    def _meta(self, key):
+        row = self._db().execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _upgrade_schema(self):
+        """
+        Добавляет колонку starts_at и индексы по чатам в базы,
+        созданные до их появления
+        """
+        conn = self._conn
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(records)")]
+        with conn:
+            if "starts_at" not in columns:
+                conn.execute("ALTER TABLE records ADD COLUMN starts_at TEXT")
+                rows = conn.execute(
+                    f"SELECT {self.COLUMNS} FROM records").fetchall()
+                for row in rows:
+                    # Время старых записей без datetime разбирает Booking.from_dict
+                    record_id, _, _, date_key, starts_at, client = _record_row(
+                        _row_to_record(row))
+                    conn.execute(
+                        "UPDATE records SET client = ?, date_key = ?, starts_at = ?"
+                        " WHERE id = ?",
+                        (client, date_key, starts_at, record_id))
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_records_starts"
+                         " ON records(starts_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_records_chat_date"
+                         " ON records(chat_id, date_key)")
+            # Заменен индексом (chat_id, seq)
+            conn.execute("DROP INDEX IF EXISTS idx_records_chat")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- миграция ----------
+
+    def migrate_from_json(self):
+        """
+        Однократно импортирует JSON-записи и reminders_sent.json.
+        Уже существующие ID не перезаписываются.
+        """
+        json_store = database.ShardedRecordStore(self.clients_dir, self.clients_path,
+                                                 self.reminders_path)
+        json_store.load()
+        records = json_store.all()
+        statuses = json_store.all_reminder_statuses()
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO records"
+                    " (id, chat_id, timestamp, date_key, starts_at, client)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    [_record_row(r) for r in records])
+                conn.executemany(
+                    "INSERT OR IGNORE INTO reminders (record_id, status)"
+                    " VALUES (?, ?)",
+                    [(record_id, json.dumps(status, ensure_ascii=False))
+                     for record_id, status in statuses.items()])
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    ("json_migrated", datetime.datetime.now().isoformat()))
+        log.info("Записи импортированы из JSON",
+                 extra={"records": len(records), "reminder_statuses": len(statuses)})
+        return len(records)
+
+    # ---------- запросы ----------
+
+    def _select(self, where="", params=()):
+        with self._lock:
+            rows = self._db().execute(
+                f"SELECT {self.COLUMNS} FROM records {where} ORDER BY seq",
+                params).fetchall()
+        return [_row_to_record(row) for row in rows]
+
+    def all(self):
+        """Все записи в порядке добавления"""
+        return self._select()
+
+    def get(self, record_id):
+        """Запись по ID или None"""
+        records = self._select("WHERE id = ?", (record_id,))
+        return records[0] if records else None
+
+    def by_chat(self, chat_id):
+        """Записи одного чата"""
+        return self._select("WHERE chat_id = ?", (chat_id,))
+
+    def by_chats(self, chat_ids):
+        """Записи нескольких чатов одним запросом: {chat_id: [записи]}"""
+        chat_ids = list(chat_ids)
+        result = {chat_id: [] for chat_id in chat_ids}
+        if chat_ids:
+            placeholders = ", ".join("?" * len(chat_ids))
+            for record in self._select(f"WHERE chat_id IN ({placeholders})", chat_ids):
+                result[record.chat_id].append(record)
+        return result
+
+    def by_date(self, key, chat_id=None):
+        """
+        Записи на дату в формате "ГГГГ-ММ-ДД": одного чата
+        или (chat_id=None) всех чатов
+        """
+        if chat_id is not None:
+            return self._select("WHERE chat_id = ? AND date_key = ?", (chat_id, key))
+        return self._select("WHERE date_key = ?", (key,))
+
+    # ---------- изменения ----------
+
+    def add(self, chat_id, client_data):
+        """Добавляет запись (client_data - словарь полей клиента), возвращает ее ID"""
+        record = Booking.new(chat_id, client_data, database.generate_record_id())
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT INTO records"
+                    " (id, chat_id, timestamp, date_key, starts_at, client)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", _record_row(record))
+        return record.id
+
+    def add_many(self, records):
+        """
+        Добавляет готовые записи (Booking с id) одной транзакцией.
+        Записи с уже существующими ID пропускаются.
+        Возвращает список добавленных записей.
+        """
+        added = []
+        with self._lock:
+            conn = self._db()
+            with conn:
+                for record in records:
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO records"
+                        " (id, chat_id, timestamp, date_key, starts_at, client)"
+                        " VALUES (?, ?, ?, ?, ?, ?)", _record_row(record))
+                    if cursor.rowcount:
+                        added.append(record)
+        return added
+
+    def iter_records(self, chat_id=None, date_from=None, date_to=None):
+        """
+        Записи чата (или всех чатов) с датой в диапазоне
+        [date_from, date_to] ("ГГГГ-ММ-ДД", границы необязательны).
+        Читаются курсором через отдельное подключение, не блокируя хранилище.
+        """
+        conditions, params = [], []
+        if chat_id is not None:
+            conditions.append("chat_id = ?")
+            params.append(chat_id)
+        if date_from is not None:
+            conditions.append("date_key >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append("date_key <= ?")
+            params.append(date_to)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        self._db()
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(
+                f"SELECT {self.COLUMNS} FROM records {where} ORDER BY seq", params)
+            for row in cursor:
+                yield _row_to_record(row)
+        finally:
+            conn.close()
+
+    def delete(self, record_id):
+        """Удаляет запись, возвращает False если ее нет"""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                cursor = conn.execute("DELETE FROM records WHERE id = ?", (record_id,))
+        return cursor.rowcount > 0
+
+    def delete_many(self, timestamps):
+        """
+        Удаляет пачку записей {id: timestamp} одной транзакцией,
+        пропуская записи, измененные после чтения (timestamp другой,
+        как в Booking - микросекунды). Возвращает ID удаленных записей
+        """
+        removed = []
+        with self._lock:
+            conn = self._db()
+            with conn:
+                for record_id, timestamp in timestamps.items():
+                    row = conn.execute("SELECT timestamp FROM records WHERE id = ?",
+                                       (record_id,)).fetchone()
+                    if row is None or parse_timestamp(row[0]) != timestamp:
+                        continue
+                    conn.execute("DELETE FROM records WHERE id = ?", (record_id,))
+                    removed.append(record_id)
+        return removed
+
+    def update_fields(self, record_id, fields):
+        """Обновляет поля client, возвращает False если нечего менять"""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                row = conn.execute(
+                    f"SELECT {self.COLUMNS} FROM records WHERE id = ?",
+                    (record_id,)).fetchone()
+                if row is None:
+                    return False
+                record = _row_to_record(row)
+                if not fields or not all(record.has_field(field) for field in fields):
+                    return False
+                record.update(fields, parse_timestamp(datetime.datetime.now().isoformat()))
+                _, _, timestamp, date_key, starts_at, client = _record_row(record)
+                conn.execute(
+                    "UPDATE records SET client = ?, date_key = ?, starts_at = ?,"
+                    " timestamp = ? WHERE id = ?",
+                    (client, date_key, starts_at, timestamp, record_id))
+        return True
+
+    # ---------- статусы напоминаний ----------
+
+    def reminder_status(self, record_id):
+        """Статус напоминаний записи"""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT status FROM reminders WHERE record_id = ?",
+                (record_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def all_reminder_statuses(self):
+        """Все статусы напоминаний: {record_id: status}"""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT record_id, status FROM reminders").fetchall()
+        return {record_id: json.loads(status) for record_id, status in rows}
+
+    def set_reminder_status(self, record_id, status):
+        """Сохраняет статус напоминаний записи"""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO reminders (record_id, status)"
+                    " VALUES (?, ?)",
+                    (record_id, json.dumps(status, ensure_ascii=False)))
+
+    def prune_reminder_statuses(self, now):
+        """
+        Удаляет статусы напоминаний удаленных и прошедших записей
+        Возвращает количество удаленных статусов
+        """
+        with self._lock:
+            conn = self._db()
+            with conn:
+                cursor = conn.execute(
+                    "DELETE FROM reminders WHERE record_id NOT IN"
+                    " (SELECT id FROM records WHERE starts_at >= ?)",
+                    (dates.to_iso(now),))
+        return cursor.rowcount
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("Использование: python sqlite_store.py migrate")
+        sys.exit(1)
+    import logs
+    logs.setup_logging()
+    store = SqliteRecordStore()
+    store.load(migrate=False)
+    # Повторный импорт безопасен: существующие ID пропускаются
+    store.migrate_from_json()
+    store.close()
\ No newline at end of file
@@ -0,0 +1,213 @@
+"""
+states.py - состояния многошаговых диалогов (запись и редактирование)
+
+У каждого чата не больше одной сессии (Session). Сессии хранятся
+в порядке последнего обращения: сессия, к которой не обращались
+дольше STATE_TTL секунд, удаляется, а при превышении STATE_MAX_SESSIONS
+удаляются самые давние. Так брошенные на полпути диалоги не копят память.
+
+Если задан STATE_SNAPSHOT_PATH (по умолчанию user_states.json), после
+изменений сессии через несколько секунд атомарно сохраняются на диск
+и загружаются при старте: начатая запись переживает перезапуск бота.
+Пустое значение отключает сохранение.
+"""
+import atexit
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+STATE_TTL = float(os.environ.get("STATE_TTL", str(6 * 3600)))
+STATE_MAX_SESSIONS = int(os.environ.get("STATE_MAX_SESSIONS", "10000"))
+STATE_SNAPSHOT_PATH = os.environ.get("STATE_SNAPSHOT_PATH", "user_states.json")
+STATE_SNAPSHOT_DELAY = float(os.environ.get("STATE_SNAPSHOT_DELAY", "2"))
+
+log = logging.getLogger(__name__)
+
+class Session:
+    """Сессия диалога одного чата"""
+
+    __slots__ = ("state", "client", "record_id", "record_label",
+                 "field", "field_display", "touched")
+
+    def __init__(self, state, client=None, record_id=None, record_label=None,
+                 field=None, field_display=None, touched=None):
+        self.state = state
+        self.client = client if client is not None else {}
+        self.record_id = record_id
+        self.record_label = record_label
+        self.field = field
+        self.field_display = field_display
+        self.touched = touched if touched is not None else time.time()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+class StateStore:
+    """
+    Сессии диалогов по chat_id с вытеснением по простою и по размеру
+    и отложенным сохранением снимка на диск
+    """
+
+    def __init__(self, ttl=STATE_TTL, max_sessions=STATE_MAX_SESSIONS,
+                 snapshot_path=STATE_SNAPSHOT_PATH,
+                 snapshot_delay=STATE_SNAPSHOT_DELAY):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.snapshot_path = snapshot_path
+        self.snapshot_delay = snapshot_delay
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()  # одна запись снимка за раз
+        self._sessions = collections.OrderedDict()  # chat_id -> Session
+        self._loaded = False
+        self._timer = None
+
+    # ---------- снимок на диске ----------
+
+    def load(self):
+        """Загружает сессии из снимка (один раз)"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.snapshot_path:
+                return
+            try:
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                return
+            except Exception:
+                log.exception("Ошибка чтения состояний диалогов",
+                              extra={"path": self.snapshot_path})
+                return
+            entries = sorted(data.get("sessions", []),
+                             key=lambda entry: entry.get("touched") or 0)
+            for entry in entries:
+                self._sessions[entry.pop("chat_id")] = Session.from_dict(entry)
+            self._evict(time.time())
+            if self._sessions:
+                log.info("Восстановлены незавершенные диалоги",
+                         extra={"sessions": len(self._sessions)})
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def _schedule_snapshot(self):
+        """Планирует сохранение снимка (под self._lock)"""
+        if not self.snapshot_path or self._timer is not None:
+            return
+        self._timer = threading.Timer(self.snapshot_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Сохраняет снимок сессий на диск (атомарно через os.replace)"""
+        with self._flush_lock:
+            with self._lock:
+                self._timer = None
+                if not self.snapshot_path or not self._loaded:
+                    return
+                sessions = [dict(session.to_dict(), chat_id=chat_id)
+                            for chat_id, session in self._sessions.items()]
+            tmp_path = self.snapshot_path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"sessions": sessions}, f, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+            except Exception:
+                log.exception("Ошибка сохранения состояний диалогов",
+                              extra={"path": self.snapshot_path})
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    # ---------- вытеснение ----------
+
+    def _evict(self, now):
+        """
+        Удаляет просроченные и лишние сессии (под self._lock).
+        Сессии упорядочены по последнему обращению, поэтому
+        проверять достаточно начало очереди.
+        """
+        while self._sessions:
+            chat_id, session = next(iter(self._sessions.items()))
+            if (len(self._sessions) <= self.max_sessions
+                    and now - session.touched < self.ttl):
+                break
+            del self._sessions[chat_id]
+
+    # ---------- доступ ----------
+
+    def get(self, chat_id):
+        """Сессия чата или None (обращение продлевает ее жизнь)"""
+        with self._lock:
+            self._ensure_loaded()
+            session = self._sessions.get(chat_id)
+            if session is None:
+                return None
+            now = time.time()
+            if now - session.touched >= self.ttl:
+                del self._sessions[chat_id]
+                self._schedule_snapshot()
+                return None
+            session.touched = now
+            self._sessions.move_to_end(chat_id)
+            return session
+
+    def state(self, chat_id):
+        """Текущее состояние диалога чата или None"""
+        session = self.get(chat_id)
+        return session.state if session else None
+
+    def set(self, chat_id, state, **fields):
+        """Начинает новую сессию чата, заменяя прежнюю"""
+        session = Session(state, **fields)
+        with self._lock:
+            self._ensure_loaded()
+            self._sessions[chat_id] = session
+            self._sessions.move_to_end(chat_id)
+            self._evict(session.touched)
+            self._schedule_snapshot()
+        return session
+
+    def update(self, chat_id, **fields):
+        """
+        Меняет поля сессии чата (например, state=...).
+        Возвращает сессию или None, если ее уже нет
+        """
+        with self._lock:
+            session = self.get(chat_id)
+            if session is None:
+                return None
+            for name, value in fields.items():
+                setattr(session, name, value)
+            self._schedule_snapshot()
+            return session
+
+    def pop(self, chat_id):
+        """Завершает сессию чата, возвращает ее или None"""
+        with self._lock:
+            self._ensure_loaded()
+            session = self._sessions.pop(chat_id, None)
+            if session is not None:
+                self._schedule_snapshot()
+            return session
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._sessions)
+
+# Общее хранилище сессий; несохраненные изменения пишутся при выходе
+user_states = StateStore()
+atexit.register(user_states.flush)
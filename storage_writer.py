@@ -0,0 +1,339 @@
+"""
+storage_writer.py - единственный поток записи JSON-хранилища
+
+Все изменения файлов хранилища (дописывание в журналы записей и
+статусов напоминаний, компактизация, импорт, перезапись журнала статусов)
+проходят через одну очередь и выполняются одним потоком по порядку.
+
+Групповая фиксация: пока поток пишет и делает fsync, новые изменения
+копятся в очереди и следующим проходом уходят вместе - одна запись
+и один fsync на файл за пачку, а не на каждое изменение (fsync разных
+файлов пачки идут параллельно). Вызывающий поток ждет, пока его
+изменение окажется на диске.
+
+Межпроцессная блокировка: на время каждой пачки берется
+advisory-блокировка fcntl.flock на файл STORAGE_LOCK_FILE, так что
+второй процесс (bulk.py, вторая реплика) не пишет одновременно.
+Если файл журнала вырос не нашими записями (писал другой процесс),
+перезапись этого файла из памяти отменяется - иначе чужие строки
+потерялись бы; дописывание продолжается как обычно. Владелец файла
+видит это по changed_elsewhere(), перечитывает файл и вызывает track()
+- после этого перезапись снова разрешена.
+
+Переменные окружения:
+  STORAGE_LOCK_FILE   - файл блокировки (по умолчанию storage.lock)
+  GROUP_COMMIT_DELAY  - сколько секунд подождать попутные изменения
+                        перед записью пачки (по умолчанию 0)
+  GROUP_COMMIT_MAX    - максимум изменений в пачке (по умолчанию 1000)
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+STORAGE_LOCK_FILE = os.environ.get("STORAGE_LOCK_FILE", "storage.lock")
+GROUP_COMMIT_DELAY = float(os.environ.get("GROUP_COMMIT_DELAY", "0"))
+GROUP_COMMIT_MAX = int(os.environ.get("GROUP_COMMIT_MAX", "1000"))
+FSYNC_WORKERS = 4
+
+log = logging.getLogger(__name__)
+
+class ForeignWriteError(RuntimeError):
+    """Файл изменен другим процессом - перезаписывать его из памяти нельзя"""
+
+class FileLock:
+    """
+    Эксклюзивная блокировка: внутри процесса - threading.Lock,
+    между процессами - fcntl.flock на файл path
+    """
+
+    def __init__(self, path=STORAGE_LOCK_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self):
+        self._lock.acquire()
+        if fcntl is None or not self.path:
+            return
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def release(self):
+        try:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+class _Append:
+    __slots__ = ("path", "lines", "on_commit", "future")
+
+    def __init__(self, path, lines, on_commit):
+        self.path = path
+        self.lines = lines
+        self.on_commit = on_commit
+        self.future = Future()
+
+class _Call:
+    __slots__ = ("func", "future")
+
+    def __init__(self, func):
+        self.func = func
+        self.future = Future()
+
+class StorageWriter:
+    """
+    Поток записи хранилища
+    lock_path - файл межпроцессной блокировки (пусто - без flock)
+    delay - ожидание попутных изменений перед записью пачки, секунды
+    """
+
+    def __init__(self, lock_path=STORAGE_LOCK_FILE, delay=GROUP_COMMIT_DELAY,
+                 max_batch=GROUP_COMMIT_MAX):
+        self.lock = FileLock(lock_path)
+        self.delay = delay
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._sizes = {}      # путь -> ожидаемый размер файла (None - писал кто-то еще)
+        self._thread = None
+        self._executor = None  # параллельный fsync файлов одной пачки
+        self._start_lock = threading.Lock()
+
+    # ---------- интерфейс ----------
+
+    def append(self, path, lines, on_commit=None):
+        """
+        Ставит строки в очередь на дописывание в path, возвращает Future.
+        on_commit() вызывается в потоке записи после fsync, в порядке
+        очереди - там изменение применяется к данным в памяти.
+        Нельзя ждать Future, держа блокировку, которую берет on_commit.
+        """
+        return self._submit(_Append(path, list(lines), on_commit))
+
+    def call(self, func):
+        """
+        Выполняет func() в потоке записи под блокировкой после всех
+        уже поставленных изменений, возвращает Future с результатом
+        """
+        return self._submit(_Call(func))
+
+    def track(self, path):
+        """Запоминает текущий размер файла (вызывается после чтения файла)"""
+        self._sizes[path] = _file_size(path)
+
+    def write(self, path, lines):
+        """Дописывает строки в path с fsync (только внутри call())"""
+        f = self._write(path, lines)
+        try:
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def replace(self, path, lines, suffix=".tmp"):
+        """
+        Атомарно переписывает path строками lines (временный файл
+        и os.replace). Только внутри call(); если файл изменен другим
+        процессом - ForeignWriteError.
+        """
+        tmp_path = path + suffix
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.replace_file(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def replace_file(self, tmp_path, path):
+        """Подменяет path готовым файлом tmp_path (только внутри call())"""
+        self.check_unchanged(path)
+        os.replace(tmp_path, path)
+        self._sizes[path] = _file_size(path)
+
+    def changed_elsewhere(self, path):
+        """
+        Дописывал ли path другой процесс (замечено при нашей записи):
+        файл нужно перечитать и снова вызвать track()
+        """
+        return path in self._sizes and self._sizes[path] is None
+
+    def size_changed(self, path):
+        """
+        Дешевая проверка из любого потока: размер path не тот, что
+        запомнил поток записи. Срабатывает и посреди нашей же записи,
+        поэтому это только повод проверить точно (check_unchanged
+        в потоке записи)
+        """
+        expected = self._sizes.get(path)
+        return expected is not None and _file_size(path) != expected
+
+    def check_unchanged(self, path):
+        """ForeignWriteError, если path менялся не через этот поток"""
+        expected = self._sizes.get(path, _file_size(path))
+        if expected is None or _file_size(path) != expected:
+            self._sizes[path] = None
+            raise ForeignWriteError(f"{path} изменен другим процессом")
+
+    # ---------- поток записи ----------
+
+    def _submit(self, job):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="storage-writer",
+                                                    daemon=True)
+                    self._thread.start()
+        self._queue.put(job)
+        return job.future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if self.delay:
+                time.sleep(self.delay)
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.lock:
+                    self._commit(batch)
+            except Exception as e:
+                # Не удалось взять блокировку - отказываем всей пачке
+                log.exception("Ошибка блокировки хранилища")
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+
+    def _commit(self, batch):
+        """Выполняет пачку по порядку: дописывания подряд - одной записью на файл"""
+        pending = []
+        for job in batch:
+            if isinstance(job, _Append):
+                pending.append(job)
+                continue
+            self._flush(pending)
+            pending = []
+            try:
+                job.future.set_result(job.func())
+            except Exception as e:
+                job.future.set_exception(e)
+        self._flush(pending)
+
+    def _flush(self, jobs):
+        if not jobs:
+            return
+        by_path = {}
+        for job in jobs:
+            by_path.setdefault(job.path, []).append(job)
+        files, failed = {}, {}
+        try:
+            for path, path_jobs in by_path.items():
+                try:
+                    files[path] = self._write(path, [line for job in path_jobs
+                                                     for line in job.lines])
+                except Exception as e:
+                    log.exception("Ошибка записи в хранилище", extra={"path": path})
+                    failed[path] = e
+            # fsync разных файлов - параллельно: это ожидание диска, не CPU
+            if len(files) > 1:
+                syncs = {path: self._fsync_pool().submit(os.fsync, f.fileno())
+                         for path, f in files.items()}
+            else:
+                syncs = {path: _done(os.fsync, f.fileno()) for path, f in files.items()}
+            for path, sync in syncs.items():
+                error = sync.exception()
+                if error is not None:
+                    log.error("Ошибка fsync", extra={"path": path, "error": str(error)})
+                    failed[path] = error
+        finally:
+            for f in files.values():
+                f.close()
+        for job in jobs:
+            error = failed.get(job.path)
+            if error is None:
+                try:
+                    if job.on_commit is not None:
+                        job.on_commit()
+                except Exception as e:
+                    error = e
+            if error is None:
+                job.future.set_result(None)
+            else:
+                job.future.set_exception(error)
+
+    def _write(self, path, lines):
+        """Дописывает строки без fsync, возвращает открытый файл"""
+        f = open(path, "a", encoding="utf-8")
+        try:
+            size = os.fstat(f.fileno()).st_size
+            expected = self._sizes.get(path, size)
+            if expected is not None and expected != size:
+                log.warning("Файл хранилища изменен другим процессом, "
+                            "перезапись из памяти отключена", extra={"path": path})
+                self._sizes[path] = None
+            f.writelines(lines)
+            f.flush()
+            if self._sizes.get(path, size) is not None:
+                self._sizes[path] = os.fstat(f.fileno()).st_size
+            return f
+        except BaseException:
+            f.close()
+            raise
+
+    def _fsync_pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=FSYNC_WORKERS,
+                                                thread_name_prefix="fsync")
+        return self._executor
+
+def _done(func, *args):
+    """Future с результатом уже выполненного вызова"""
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """Общий поток записи процесса (поток запускается при первом изменении)"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = StorageWriter()
+    return _writer
@@ -0,0 +1,189 @@
+"""
+Проверки dispatcher.py с фейковой функцией отправки, без сети
+
+Время подменяется виртуальными часами: time.sleep в диспатчере
+только сдвигает их, поэтому паузы в минуту проходят мгновенно,
+а моменты отправок можно сравнивать точно.
+"""
+import queue
+import threading
+import unittest
+from unittest import mock
+
+import dispatcher
+
+class FakeClock:
+    """Виртуальные monotonic() и sleep() для диспатчера"""
+
+    def __init__(self):
+        self.now = 0.0
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        with self._lock:
+            return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += max(seconds, 0)
+
+class ApiError(Exception):
+    """Ошибка Bot API в том виде, в каком ее видит retry_delay"""
+
+    def __init__(self, code, retry_after=None):
+        super().__init__(f"error {code}")
+        self.error_code = code
+        self.result_json = ({"parameters": {"retry_after": retry_after}}
+                            if retry_after is not None else {})
+
+class FakeSend:
+    """
+    Фейковая send_message: запоминает (момент, chat_id, текст) и бросает
+    ошибки из очереди errors перед очередными попытками
+    """
+
+    def __init__(self, clock, errors=()):
+        self.clock = clock
+        self.errors = list(errors)
+        self.calls = []
+
+    def __call__(self, chat_id, text, **kwargs):
+        self.calls.append((self.clock.monotonic(), chat_id, text))
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        return f"sent:{text}"
+
+class DispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(dispatcher, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make(self, send, **kwargs):
+        # Один поток: отправки идут строго по очереди, время детерминировано
+        kwargs.setdefault("workers", 1)
+        sender = dispatcher.MessageDispatcher(send, **kwargs)
+        sender.start()
+        self.addCleanup(sender.stop)
+        return sender
+
+    def times(self, send):
+        return [moment for moment, _, _ in send.calls]
+
+    def test_private_chat_rate(self):
+        send = FakeSend(self.clock)
+        sender = self.make(send)
+        futures = [sender.submit(1, f"m{i}") for i in range(3)]
+        self.assertEqual([f.result(5) for f in futures], ["sent:m0", "sent:m1", "sent:m2"])
+        self.assertEqual(self.times(send), [0.0, 1.0, 2.0])
+
+    def test_group_chat_rate(self):
+        send = FakeSend(self.clock)
+        sender = self.make(send)
+        for future in [sender.submit(-100, "a"), sender.submit(-100, "b")]:
+            future.result(5)
+        self.assertAlmostEqual(self.times(send)[1] - self.times(send)[0], 3.0)
+
+    def test_global_rate(self):
+        send = FakeSend(self.clock)
+        sender = self.make(send, global_rate=5)
+        futures = [sender.submit(chat_id, "m") for chat_id in range(1, 11)]
+        for future in futures:
+            future.result(5)
+        times = self.times(send)
+        # Первые 5 - из полного ведра сразу, дальше по одному за 1/5 секунды
+        self.assertEqual(times[:5], [0.0] * 5)
+        for earlier, later in zip(times[4:], times[5:]):
+            self.assertAlmostEqual(later - earlier, 0.2)
+
+    def test_429_pauses_whole_bot(self):
+        send = FakeSend(self.clock, errors=[ApiError(429, retry_after=7)])
+        sender = self.make(send)
+        self.assertEqual(sender.submit(1, "first").result(5), "sent:first")
+        self.assertEqual(sender.submit(2, "other chat").result(5), "sent:other chat")
+        first_try, retry, other = self.times(send)
+        self.assertEqual(first_try, 0.0)
+        self.assertGreaterEqual(retry, 7.0)
+        self.assertGreaterEqual(other, 7.0)
+        # Пауза общая: ее ждал бы и любой другой поток отправки
+        self.assertEqual(sender._paused_until, 7.0)
+
+    def test_5xx_backoff(self):
+        send = FakeSend(self.clock, errors=[ApiError(502), ApiError(500)])
+        sender = self.make(send)
+        self.assertEqual(sender.submit(1, "m").result(5), "sent:m")
+        first, second, third = self.times(send)
+        self.assertGreaterEqual(second - first, dispatcher.BACKOFF_BASE)
+        self.assertGreaterEqual(third - second, dispatcher.BACKOFF_BASE * 2)
+
+    def test_5xx_gives_up_after_max_attempts(self):
+        send = FakeSend(self.clock, errors=[ApiError(502)] * 10)
+        sender = self.make(send, max_attempts=3)
+        with self.assertRaises(ApiError):
+            sender.submit(1, "m").result(5)
+        self.assertEqual(len(send.calls), 3)
+
+    def test_other_4xx_fails_fast(self):
+        for code in (400, 403):
+            send = FakeSend(self.clock, errors=[ApiError(code)])
+            sender = self.make(send)
+            with self.assertRaises(ApiError) as raised:
+                sender.submit(1, "m").result(5)
+            self.assertEqual(raised.exception.error_code, code)
+            self.assertEqual(len(send.calls), 1)
+
+    def test_full_queue_backpressure(self):
+        send = FakeSend(self.clock)
+        # Потоки не запущены: очередь не разбирается
+        sender = dispatcher.MessageDispatcher(send, workers=1, queue_size=2)
+        sender.submit(1, "a")
+        sender.submit(1, "b")
+        self.assertEqual(sender.pending(), 2)
+        with self.assertRaises(queue.Full):
+            sender.submit(1, "c", timeout=0.01)
+        sender.start()
+        self.addCleanup(sender.stop)
+        sender.submit(1, "c", timeout=5).result(5)
+        self.assertEqual([text for _, _, text in send.calls], ["a", "b", "c"])
+
+    def test_sources_share_limits(self):
+        send = FakeSend(self.clock)
+        sender = self.make(send, global_rate=2)
+        client = mock.Mock()
+        handlers = dispatcher.DispatchingBot(client, sender)
+        # Общий лимит один на оба источника: ответ обработчика ждет,
+        # пока напоминания израсходуют ведро на 2 сообщения
+        reminders = [sender.submit(chat_id, "r", source="reminders") for chat_id in (2, 3, 4)]
+        self.assertEqual(handlers.send_message(5, "reply"), "sent:reply")
+        for future in reminders:
+            future.result(5)
+        self.assertEqual(self.times(send), [0.0, 0.0, 0.5, 1.0])
+        # Лимит чата тоже общий: ответ в чат напоминания - через секунду
+        reminder = sender.submit(2, "reminder", source="reminders")
+        handlers.send_message(2, "reply")
+        reminder.result(5)
+        first, second = self.times(send)[-2:]
+        self.assertAlmostEqual(second - first, 1.0)
+        # Остальные методы клиента - напрямую, мимо очереди
+        handlers.answer_callback_query("q")
+        client.answer_callback_query.assert_called_once_with("q")
+        client.send_message.assert_not_called()
+
+class RetryDelayTest(unittest.TestCase):
+
+    def test_delays(self):
+        self.assertEqual(dispatcher.retry_delay(ApiError(429, retry_after=3), 0), 3.0)
+        self.assertEqual(dispatcher.retry_delay(ApiError(502), 2),
+                         dispatcher.BACKOFF_BASE * 4)
+        self.assertEqual(dispatcher.retry_delay(ApiError(502), 100), dispatcher.BACKOFF_MAX)
+        self.assertEqual(dispatcher.retry_delay(ConnectionError(), 0),
+                         dispatcher.BACKOFF_BASE)
+        self.assertIsNone(dispatcher.retry_delay(ApiError(403), 0))
+        self.assertIsNone(dispatcher.retry_delay(ValueError(), 0))
+
+if __name__ == "__main__":
+    unittest.main()
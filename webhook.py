@@ -0,0 +1,174 @@
+"""
+webhook.py - прием обновлений Telegram через webhook (BOT_MODE=webhook)
+
+Встроенный HTTP-сервер принимает POST с обновлением, проверяет
+заголовок X-Telegram-Bot-Api-Secret-Token и сразу отвечает 200,
+а само обновление кладет в очередь пула обработчиков.
+Обновления одного чата всегда попадают в один и тот же поток,
+поэтому их порядок сохраняется. Если очередь полна, сервер отвечает
+503 и Telegram повторит доставку позже.
+
+Переменные окружения:
+  PORT            - порт сервера (на Railway задается автоматически)
+  WEBHOOK_URL     - внешний адрес приложения; если задан, webhook
+                    регистрируется в Telegram при запуске
+  WEBHOOK_PATH    - путь для обновлений (по умолчанию /webhook)
+  WEBHOOK_SECRET  - секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+                    (обязателен, если задан WEBHOOK_URL)
+  WEBHOOK_WORKERS - число потоков-обработчиков
+
+Локальная проверка без Telegram:
+  BOT_MODE=webhook WEBHOOK_SECRET=s python main.py
+  curl -X POST localhost:8080/webhook -H 'X-Telegram-Bot-Api-Secret-Token: s' \\
+       -H 'Content-Type: application/json' -d @update.json
+"""
+import hmac
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+from batching import update_chat_id
+
+WEBHOOK_PORT = int(os.environ.get("PORT", "8080"))
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "256"))
+
+log = logging.getLogger(__name__)
+MAX_BODY_BYTES = 1024 * 1024
+
+class UpdateWorkerPool:
+    """
+    Пул потоков с ограниченными очередями. Обновление направляется
+    в поток по chat_id, так что обновления одного чата идут по порядку.
+    process_func(update) - обработка одного обновления
+    """
+
+    def __init__(self, process_func, workers=WEBHOOK_WORKERS,
+                 queue_size=WEBHOOK_QUEUE_SIZE):
+        self.process_func = process_func
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+
+    def start(self):
+        for i, worker_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(worker_queue,),
+                                      name=f"webhook-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        for worker_queue in self._queues:
+            worker_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, update):
+        """Ставит обновление в очередь; False, если очередь переполнена"""
+        chat_id = update_chat_id(update)
+        worker_queue = self._queues[hash(chat_id) % len(self._queues)]
+        try:
+            worker_queue.put_nowait(update)
+            return True
+        except queue.Full:
+            return False
+
+    def _worker(self, worker_queue):
+        while True:
+            update = worker_queue.get()
+            if update is None:
+                return
+            try:
+                self.process_func(update)
+            except Exception:
+                log.exception("Ошибка обработки обновления",
+                              extra={"update_id": update.update_id})
+
+class WebhookServer(ThreadingHTTPServer):
+    """HTTP-сервер, принимающий обновления Telegram"""
+
+    daemon_threads = True
+
+    def __init__(self, address, pool, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        super().__init__(address, WebhookRequestHandler)
+        self.pool = pool
+        self.webhook_path = path
+        self.secret = secret
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        if self.path != server.webhook_path:
+            self._reply(404)
+            return
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if server.secret and not hmac.compare_digest(token, server.secret):
+            self._reply(403)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._reply(400)
+            return
+        try:
+            update = types.Update.de_json(json.loads(self.rfile.read(length)))
+        except (ValueError, KeyError, TypeError):
+            # Не JSON или не обновление Telegram ({}, сообщение без message_id...)
+            self._reply(400)
+            return
+        self._reply(200 if server.pool.submit(update) else 503)
+
+    def do_GET(self):
+        # Проверка живости для платформы
+        self._reply(200 if self.path == "/health" else 404)
+
+    def _reply(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        # Не печатаем строку на каждый запрос
+        pass
+
+def run_webhook(bot, port=WEBHOOK_PORT):
+    """
+    Запускает прием обновлений через webhook для bot
+    (TeleBot с зарегистрированными обработчиками).
+    С WEBHOOK_URL без WEBHOOK_SECRET не запускается: обновления
+    мог бы прислать кто угодно
+    """
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        log.error("WEBHOOK_SECRET не задан! Задайте его вместе с WEBHOOK_URL")
+        sys.exit(1)
+    # Обработчики вызываются в потоках пула по порядку, а не во
+    # внутреннем пуле TeleBot, иначе порядок внутри чата потеряется
+    bot.threaded = False
+    pool = UpdateWorkerPool(lambda update: bot.process_new_updates([update]))
+    pool.start()
+    server = WebhookServer(("0.0.0.0", port), pool)
+
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                        secret_token=WEBHOOK_SECRET or None)
+        log.info("Webhook зарегистрирован",
+                 extra={"url": WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH})
+    if not WEBHOOK_SECRET:
+        log.warning("WEBHOOK_SECRET не задан, заголовок секрета не проверяется")
+
+    log.info("Webhook-сервер слушает порт", extra={"port": port})
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        pool.stop()
\ No newline at end of file